@@ -2,6 +2,11 @@ import os
 import boto3
 import base64
 import math
+import array
+import operator
+import struct
+import zlib
+import itertools
 import numpy as np
 import json
 import requests
@@ -10,16 +15,14 @@ import traceback
 import hashlib
 import hmac
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import traceback
 
 {Strategy src}
 
-def convert_numpy_array_to_dynamodb(np_array, chunk_size_kb=400):
-    # Numpy配列をバイト列に変換
-    array_bytes = np_array.tobytes()
-
+def split_base64(data_bytes, chunk_size_kb=400):
     # バイト列をBase64エンコード
-    array_base64 = base64.b64encode(array_bytes).decode('utf-8')
+    array_base64 = base64.b64encode(data_bytes).decode('utf-8')
 
     # 分割サイズをバイト単位に変換
     chunk_size = chunk_size_kb * 1024
@@ -30,19 +33,14 @@ def convert_numpy_array_to_dynamodb(np_array, chunk_size_kb=400):
     for i in range(num_chunks):
         chunk = array_base64[i * chunk_size:(i + 1) * chunk_size]
         data[str(i)] = chunk
-    return data, np_array.dtype
+    return data
 
-def revert_numpy_array_from_dynamodb(data, dtype):
-    # パートを結合
+def join_base64(data):
+    # パートを結合してBase64デコード
     combined_base64 = b''.join([data[str(i)].encode('utf-8') for i in range(len(data))])
+    return base64.b64decode(combined_base64)
 
-    # Base64デコード
-    array_bytes = base64.b64decode(combined_base64)
-
-    # バイト列からNumpy配列に変換
-    np_array = np.frombuffer(array_bytes, dtype=dtype)
-
-    return np_array
+{Array codec}
 
 # データ変換関数
 def convert_for_dynamodb(data):
@@ -56,15 +54,11 @@ def convert_for_dynamodb(data):
         return {'F': str(data)}
     elif isinstance(data, str):
         return {'S': data}
-    elif isinstance(data, list) or isinstance(data, np.ndarray):
-        re_data, dtype = convert_numpy_array_to_dynamodb(np.array(data))
-        if "int" in str(dtype):
-            k = "LI"
-        elif "float" in str(dtype):
-            k = "LF"
-        else:
+    elif isinstance(data, ARRAY_TYPES):
+        encoded = array_bytes(data)
+        if encoded is None:
             return {'L': [convert_for_dynamodb(item) for item in data]}
-        return {k: re_data}
+        return {encoded[0]: split_base64(encoded[1])}
     elif isinstance(data, dict):
         return {'M': {k: convert_for_dynamodb(v) for k, v in data.items()}}
     else:
@@ -82,9 +76,9 @@ def revert_from_dynamodb(data):
     elif 'S' in data:
         return data['S']
     elif 'LI' in data:
-        return revert_numpy_array_from_dynamodb(data["LI"], np.int64)
+        return bytes_to_array(join_base64(data["LI"]), "LI")
     elif 'LF' in data:
-        return revert_numpy_array_from_dynamodb(data["LF"], np.float64)
+        return bytes_to_array(join_base64(data["LF"]), "LF")
     elif "L" in data:
         return [revert_from_dynamodb(item) for item in data['L']]
     elif 'M' in data:
@@ -92,76 +86,136 @@ def revert_from_dynamodb(data):
     else:
         raise TypeError(f"Type {data.keys()} is not supported")
 
-def save_to_dynamodb(table: object, item: dict, partition_key: str):
-    """save to dynamoDB
+{State codec}
+
+# Clients, params and the last saved state are cached by the first
+# invocation and reused while the container is warm. The state is kept as
+# the encoded attributes, to find the ones that changed.
+_table = None
+_params = None
+_state = {"attributes": None, "version": None}
+_executor = None
 
-    Args:
-        table (object): DynamoDB table
-        item (dict): save data
-        partition_key (str): partition key of yuor table
+def get_table():
+    global _table
+    if _table is None:
+        dynamodb = boto3.resource('dynamodb')
+        _table = dynamodb.Table(os.environ["TABLE_NAME"])
+    return _table
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=3)
+    return _executor
+
+def get_params():
+    global _params
+    if _params is None:
+        # 環境変数読み込み
+        _params = {}
+        for key, value in os.environ.items():
+            try:
+                # float に変換
+                _params[key] = float(value)
+            except ValueError:
+                # 変換できない場合はそのまま文字列で保持
+                _params[key] = value
+    return dict(_params)
+
+def state_compression():
+    return os.environ.get("STATE_COMPRESSION", "zlib")
+
+def load_state(table, key_value):
+    """State in DynamoDB, read only if none is cached
+
+    A state saved by another writer is found by the conditional write of
+    save_state(), which then drops the cached state.
     """
-    item_converted = {k: convert_for_dynamodb(v) for k, v in item.items()}
-    item_converted["id"] = partition_key
-    item = json.loads(json.dumps(item_converted))
-    
-    table.put_item(Item=item)
+    if _state["version"] is None:
+        data, version = read_versioned_from_dynamodb(table, key_value, "id")
+        _state["attributes"] = {
+            k: encode_binary(v, state_compression())
+            for k, v in (data or {}).items()
+        }
+        _state["version"] = version
+    if not _state["attributes"]:
+        return None
+    return {k: decode_binary(v) for k, v in _state["attributes"].items()}
 
-def read_from_dynamodb(table: object, key_value, partition_key: str) -> dict:
-    """read from dynamoDB
+def save_state(table, key_value, data):
+    """Save the keys of the state that changed, unless another writer saved a newer state
 
-    Args:
-        table (object): DynamoDB table
-        key_value : partition key value of your data
-        partition_key (str): partition key of yuor table
+    Returns:
+        bool: True if saved
+    """
+    if _state["version"] is None:
+        # The state could not be read, do not overwrite it
+        return False
+    attributes = {
+        k: encode_binary(v, state_compression())
+        for k, v in data.items() if k not in ("id", "version")
+    }
+    changed = {k: v for k, v in attributes.items() if _state["attributes"].get(k) != v}
+    removed = [k for k in _state["attributes"] if k not in attributes]
+    if not changed and not removed:
+        return False
+    try:
+        version = update_versioned_in_dynamodb(table, changed, removed, key_value, "id", _state["version"])
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        # The next invocation reads the newer state
+        _state["attributes"] = _state["version"] = None
+        raise
+    _state["attributes"] = attributes
+    _state["version"] = version
+    return True
+
+def prefetch(table, market, key_value):
+    """Read the state, the price and the open orders at the same time
 
     Returns:
-        dict: data
+        tuple: state (None if not saved yet), price, open orders (None if
+            trading is disabled, they are not needed)
+
+    Raises:
+        Exception: the error of reading the state, so that no order is
+            placed on a new state
     """
-    key = {partition_key: key_value}
-    response = table.get_item(Key=key)
-    item = response.get('Item')
-    if item:
-        return {k: v if k == partition_key else revert_from_dynamodb(v) for k, v in item.items()}
-    else:
-        return None
+    executor = get_executor()
+    state = executor.submit(load_state, table, key_value)
+    price = executor.submit(market.get_current_price)
+    orders = None
+    if os.environ.get("TRADE_ENABLE") == "1":
+        orders = executor.submit(market.get_open_orders)
+    return state.result(), price.result(), None if orders is None else orders.result()
 
 def lambda_handler(event, context):
+    start = time.perf_counter()
+    signals = None
     try:
         # ビットフライヤーのAPIキーとシークレット
         API_KEY = os.environ["API_KEY"]
         API_SECRET = os.environ["API_SECRET"]
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table(os.environ["TABLE_NAME"])
+        table = get_table()
         
         market = {Market class}()
         market.set_apikey(API_KEY, API_SECRET)        
         strategy = {Strategy class}(market)
-        # 環境変数読み込み
-        env_variables = {}
-        for key, value in os.environ.items():
-            try:
-                # float に変換
-                env_variables[key] = float(value)
-            except ValueError:
-                # 変換できない場合はそのまま文字列で保持
-                env_variables[key] = value
-        strategy.reset_param(env_variables)
-        try:
-            val = read_from_dynamodb(table, os.environ["PARAMS_KEY"], "id")
-            if val is not None:
-                strategy.dynamic = val
-        except:
-            pass
-        current_price = market.get_current_price()
+        strategy.reset_param(get_params())
+        val, current_price, orders = prefetch(table, market, os.environ["PARAMS_KEY"])
+        if val is not None:
+            strategy.load_dynamic(val)
         signals = strategy.generate_signals(current_price)
 
-        if strategy.trade_limiter():
+        if strategy.trade_limiter(orders):
             strategy.execute_trade(current_price, signals)
-        save_to_dynamodb(table, strategy.dynamic, os.environ["PARAMS_KEY"])
+        save_state(table, os.environ["PARAMS_KEY"], strategy.dump_dynamic())
 
     except:
         traceback.print_exc()
+    latency = time.perf_counter() - start
+    print(f"signal: {signals}, latency: {latency * 1000:.1f} ms")
     return {
         'statusCode': 200,
-        'body': json.dumps('')
-    }
+        'body': json.dumps({'signal': signals, 'latency_ms': latency * 1000})
+    }
\ No newline at end of file
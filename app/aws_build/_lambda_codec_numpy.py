@@ -0,0 +1,30 @@
+# Lists and arrays of numbers are saved as their int64 / float64 bytes
+ARRAY_TYPES = (list, np.ndarray)
+
+def array_bytes(data):
+    np_array = np.array(data)
+    if "int" in str(np_array.dtype):
+        return "LI", np_array.astype(np.int64).tobytes()
+    elif "float" in str(np_array.dtype):
+        return "LF", np_array.astype(np.float64).tobytes()
+    return None
+
+def bytes_to_array(raw, key):
+    dtype = np.int64 if key == "LI" else np.float64
+    return np.frombuffer(raw, dtype=dtype)
+
+def integral_deltas(key, raw):
+    # int64 bytes of the first value and the differences, None if the values
+    # are not integers (-0.0 is not, its sign would be lost) or they overflow
+    values = bytes_to_array(raw, key)
+    if key == "LF":
+        if not np.all((values == np.round(values)) & (np.abs(values) < 2**53)) or \
+           np.any((values == 0) & np.signbit(values)):
+            return None
+        values = values.astype(np.int64)
+    deltas = values.copy()
+    np.subtract(values[1:], values[:-1], out=deltas[1:])
+    # The sign of a wrapped difference is not the one of values[1:]
+    if np.any((values[1:] ^ values[:-1]) & (values[1:] ^ deltas[1:]) < 0):
+        return None
+    return deltas.tobytes()
@@ -0,0 +1,41 @@
+# Lists of numbers are saved as their int64 / float64 bytes, the same format
+# as _lambda_codec_numpy.py, with the array module
+ARRAY_TYPES = (list, )
+
+def array_bytes(data):
+    if any(isinstance(v, bool) or not isinstance(v, (int, float)) for v in data):
+        return None
+    if data and all(isinstance(v, int) for v in data):
+        if any(not -2**63 <= v < 2**63 for v in data):
+            # Saved as a list, as numpy does
+            return None
+        return "LI", array.array("q", data).tobytes()
+    return "LF", array.array("d", data).tobytes()
+
+def bytes_to_array(raw, key):
+    values = array.array("q" if key == "LI" else "d")
+    values.frombytes(raw)
+    return values.tolist()
+
+def integral_deltas(key, raw):
+    # int64 bytes of the first value and the differences, None if the values
+    # are not integers (-0.0 is not, its sign would be lost) or they overflow.
+    # The loops are map(), max() and min(), not Python code per value.
+    values = array.array("q" if key == "LI" else "d")
+    values.frombytes(raw)
+    if key == "LF":
+        if not all(map(float.is_integer, values)) or \
+           (values and (max(values) >= 2**53 or min(values) <= -2**53)):
+            return None
+        negative_zero = array.array("d", [-0.0]).tobytes()
+        i = raw.find(negative_zero)
+        while i >= 0 and i % 8:
+            i = raw.find(negative_zero, i + 1)
+        if i >= 0:
+            return None
+        values = map(int, values)
+    values = list(values)
+    deltas = values[:1] + list(map(operator.sub, values[1:], values[:-1]))
+    if deltas and (max(deltas) >= 2**63 or min(deltas) < -2**63):
+        return None
+    return array.array("q", deltas).tobytes()
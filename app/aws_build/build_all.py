@@ -27,7 +27,6 @@ if __name__ == "__main__":
                         help="The directories to search for Python files.")
     parser.add_argument("-s",
                         "--strategy-class",
-                        required=True,
                         help="Strategy Class Name.")
     parser.add_argument("-m",
                         "--market-class",
@@ -42,13 +41,28 @@ if __name__ == "__main__":
         "--additional_target_names",
         nargs="+",
         help="The names of the target functions and classes to include.")
+    parser.add_argument(
+        "--spec",
+        help="Strategy spec JSON file, used instead of a strategy class.")
+    parser.add_argument(
+        "--no-numpy",
+        action="store_true",
+        help="Build without numpy, for strategies whose state is numbers and lists.")
 
     args = parser.parse_args()
+    if args.strategy_class is None and args.spec is None:
+        parser.error("-s/--strategy-class or --spec is required")
 
     comb_args = [
-        "./app/aws_build/build_lambda_src.py", "-s", args.strategy_class, "-m",
-        args.market_class, "-o", tmp_file
+        "./app/aws_build/build_lambda_src.py", "-m", args.market_class, "-o",
+        tmp_file
     ]
+    if args.spec is not None:
+        comb_args.extend(["--spec", args.spec])
+    else:
+        comb_args.extend(["-s", args.strategy_class])
+    if args.no_numpy:
+        comb_args.append("--no-numpy")
     if args.directories is None:
         args.directories = []
     if not "src/" in args.directories:
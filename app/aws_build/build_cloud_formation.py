@@ -14,8 +14,15 @@ def extract_static_keys_from_file(file_path):
 
   # パターンにマッチする全ての部分を検索します
   matches = re.findall(pattern, script)
+  keys = [match[1] for match in matches]
 
-  return [match[1] for match in matches]
+  # Parameters of spec strategies: static_keys = ["key1", "key2"]
+  for static_keys in re.findall(r'static_keys\s*=\s*\[(.*?)\]', script,
+                                re.DOTALL):
+    keys.extend(
+        match[1] for match in re.findall(r'(["\'])(.*?)\1', static_keys))
+
+  return keys
 
 
 def create_cloudformation_template(lambda_code_path, output_file,
@@ -1,8 +1,31 @@
 import os
 import re
+import io
+import ast
+import sys
+import json
+import pprint
+import zipfile
 import argparse
+import subprocess
 
 base_file = "./app/aws_build/_lambda_base.py"
+codec_files = {
+    "numpy": "./app/aws_build/_lambda_codec_numpy.py",
+    "python": "./app/aws_build/_lambda_codec_python.py",
+}
+# The binary state format and the versioned reads and writes, copied into the
+# handler from bitbacktest.utils.dynamodb so that both use the same code
+state_codec_file = "./src/bitbacktest/utils/dynamodb.py"
+STATE_CODEC_NAMES = ("COMPRESSION_FLAGS", "_encode_array", "_encode",
+                     "_decode", "encode_binary", "decode_binary",
+                     "revert_attribute", "read_versioned_from_dynamodb",
+                     "update_versioned_in_dynamodb")
+# Methods of Strategy that the handler does not call, they may use numpy in a
+# handler built with --no-numpy
+OFFLINE_METHODS = ("backtest", "_result", "backtest_history",
+                   "create_backtest_graph", "reset_all", "clone", "snapshot",
+                   "restore")
 
 
 def find_python_files(directories):
@@ -30,11 +53,30 @@ def extract_class_hierarchy(file_path, target_classes):
                 base_class.strip() for base_class in base_classes.split(',')
                 if base_class.strip()
             ]
-            if class_name in target_classes:
+            if target_classes is None or class_name in target_classes:
                 class_hierarchy[class_name] = base_classes
     return class_hierarchy
 
 
+def extract_state_classes(file_path, target_classes):
+    """Extract StrategyState classes referenced by "state_class = ..." in target classes."""
+    state_classes = set()
+    current_class = None
+    with open(file_path, 'r', encoding='utf-8') as file:
+        lines = file.readlines()
+
+    for line in lines:
+        match = re.match(r'^class\s+(\w+)\s*[\(:]', line)
+        if match:
+            current_class = match.groups()[0]
+            continue
+        match = re.match(r'^\s+state_class\s*=\s*(\w+)', line)
+        if match and current_class in target_classes:
+            if match.groups()[0] != "None":
+                state_classes.add(match.groups()[0])
+    return state_classes
+
+
 def get_all_superclasses(class_hierarchy, target_classes):
     """Get all superclasses for the target classes."""
     superclasses = set()
@@ -64,8 +106,10 @@ def extract_imports_and_definitions(file_path, target_names, logger):
     current_class_lines = []
 
     for line in lines:
-        if line.strip().startswith("import ") or line.strip().startswith(
-                "from "):
+        # Not docstring lines that start with "from" or "import"
+        if re.match(r'^\s*(import\s+\w|from\s+[\w.]+\s+import\s)', line):
+            # Imports in functions (lazy imports) are moved to the top
+            line = line.lstrip()
             if line not in imports and "tqdm" not in line and "matplotlib" not in line and "plotly" not in line:
                 imports.append(line)
         elif re.match(r'^\s*class\s+(\w+)\s*[\(:]', line):
@@ -101,6 +145,53 @@ def extract_imports_and_definitions(file_path, target_names, logger):
     return imports, definitions
 
 
+def sort_definitions(definitions, class_hierarchy):
+    """Reorder class definitions so that base classes come before subclasses."""
+    head = []
+    chunks = {}
+    order = []
+    current = None
+    for line in definitions:
+        match = re.match(r'^class\s+(\w+)\s*[\(:]', line)
+        if match:
+            current = match.groups()[0]
+            chunks[current] = []
+            order.append(current)
+        if current is None:
+            head.append(line)
+        else:
+            chunks[current].append(line)
+
+    sorted_lines = list(head)
+    done = set()
+
+    def add(class_name):
+        if class_name in done:
+            return
+        done.add(class_name)
+        for base_class in class_hierarchy.get(class_name, []):
+            if base_class in chunks:
+                add(base_class)
+        sorted_lines.extend(chunks[class_name])
+
+    for class_name in order:
+        add(class_name)
+    return sorted_lines
+
+
+def create_spec_class(spec):
+    """Source of the SpecStrategy subclass of a strategy spec (see bitbacktest/spec.py)."""
+    spec_src = pprint.pformat(spec, indent=4, sort_dicts=False)
+    lines = [
+        f"class {spec['name']}(SpecStrategy):\n",
+        "    # Parameters set as AWS env\n",
+        f"    static_keys = {list(spec.get('params', {}))!r}\n",
+        "    spec = " + spec_src.replace("\n", "\n        ") + "\n",
+        "\n",
+    ]
+    return "".join(lines)
+
+
 def combine_files(directory, output_file, target_names):
     """Combine relevant import statements and definitions from all Python files in the directory."""
     all_imports = set()
@@ -114,26 +205,36 @@ def combine_files(directory, output_file, target_names):
 
     # Step 1: Extract class hierarchy
     for file_path in python_files:
-        class_hierarchy.update(extract_class_hierarchy(file_path,
-                                                       target_names))
+        class_hierarchy.update(extract_class_hierarchy(file_path, None))
 
     # Step 2: Get all superclasses
     superclasses = get_all_superclasses(class_hierarchy, target_names)
     target_names.extend(superclasses)
 
+    # Step 2.5: Get state classes used by "state_class" and their superclasses
+    state_classes = set()
+    for file_path in python_files:
+        state_classes.update(extract_state_classes(file_path, target_names))
+    state_classes.update(
+        get_all_superclasses(class_hierarchy, list(state_classes)))
+    target_names.extend(c for c in state_classes if c not in target_names)
+
     # Step 3: Extract relevant imports and definitions
     for file_path in python_files:
         imports, definitions = extract_imports_and_definitions(
             file_path, target_names, logger)
         if definitions != []:
             all_imports.update(imports)
-            if "class Market(ABC):\n" in definitions:
+            if "class Market(ABC):\n" in definitions or \
+               "class StrategyState:\n" in definitions:
                 definitions.extend(all_definitions)
                 all_definitions = definitions
             else:
                 all_definitions.extend(definitions)
             all_definitions.append("")
 
+    all_definitions = sort_definitions(all_definitions, class_hierarchy)
+
     with open(output_file, 'w', encoding='utf-8') as out_file:
         for imp in sorted(all_imports):
             out_file.write(imp)
@@ -141,14 +242,185 @@ def combine_files(directory, output_file, target_names):
             out_file.write(definition)
 
 
-def create_lamda_file(base_file, tmp_file, out_file, strategy_class,
-                      market_class):
+def select_imports(source, drop_modules=()):
+    """Remove the top-level imports whose names are not used, and duplicates.
+
+    Imports of "drop_modules" are removed even if their names are used.
+    Returns the source and the removed import statements.
+    """
+    tree = ast.parse(source)
+    used = {
+        node.id
+        for node in ast.walk(tree) if isinstance(node, ast.Name)
+    }
+    lines = source.splitlines(keepends=True)
+    seen = set()
+    removed = []
+    for node in tree.body:
+        if not isinstance(node, (ast.Import, ast.ImportFrom)):
+            continue
+        statement = ast.unparse(node)
+        modules = [alias.name for alias in node.names]
+        if isinstance(node, ast.ImportFrom):
+            modules = [node.module or ""]
+        names = [(alias.asname or alias.name).split(".")[0]
+                 for alias in node.names]
+        keep = statement not in seen and (
+            "*" in names or any(name in used for name in names))
+        if any(m.split(".")[0] in drop_modules for m in modules):
+            keep = False
+        seen.add(statement)
+        if not keep:
+            removed.append(statement)
+            for i in range(node.lineno - 1, node.end_lineno):
+                lines[i] = ""
+    return "".join(lines), removed
+
+
+def find_module_uses(source, name):
+    """Functions and methods ("Class.method") that use the global "name"."""
+    uses = []
+
+    def visit(node, prefix):
+        for child in node.body:
+            if isinstance(child, ast.ClassDef):
+                visit(child, prefix + child.name + ".")
+            elif isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                if any(
+                        isinstance(n, ast.Name) and n.id == name
+                        for n in ast.walk(child)):
+                    uses.append(prefix + child.name)
+
+    visit(ast.parse(source), "")
+    return uses
+
+
+def measure_import_time(file_path):
+    """Import the handler in a new interpreter, as a cold start of Lambda.
+
+    Returns the seconds of each top-level import (None if the module is not
+    installed here) and of the whole file, the imports and the definitions
+    (None if an import failed).
+    """
+    script = """
+import ast, json, sys, time
+path = sys.argv[1]
+with open(path, encoding="utf-8") as f:
+    source = f.read()
+imports = {}
+module = {"__name__": "lambda_function"}
+for node in ast.parse(source).body:
+    if isinstance(node, (ast.Import, ast.ImportFrom)):
+        start = time.perf_counter()
+        try:
+            exec(compile(ast.Module([node], []), path, "exec"), module)
+        except ImportError:
+            imports[ast.unparse(node)] = None
+        else:
+            imports[ast.unparse(node)] = time.perf_counter() - start
+total = None
+if None not in imports.values():
+    # The imported modules are cached, this is the time of the definitions
+    code = compile(source, path, "exec")
+    start = time.perf_counter()
+    exec(code, module)
+    total = sum(imports.values()) + time.perf_counter() - start
+print(json.dumps({"imports": imports, "total": total}))
+"""
+    result = subprocess.run([sys.executable, "-c", script, file_path],
+                            check=True,
+                            capture_output=True,
+                            text=True)
+    return json.loads(result.stdout)
+
+
+def build_report(file_path, removed_imports):
+    """Size of the handler and its deployment zip, and its import time."""
+    with open(file_path, "rb") as f:
+        source = f.read()
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("lambda_function.py", source)
+    report = {
+        "file": file_path,
+        "size": len(source),
+        "zip_size": len(buffer.getvalue()),
+        "removed_imports": removed_imports,
+    }
+    report.update(measure_import_time(file_path))
+    return report
+
+
+def print_report(report):
+    print(f"Build report: {report['file']}")
+    print(f"  size: {report['size'] / 1024:.1f} KB "
+          f"(zip {report['zip_size'] / 1024:.1f} KB)")
+    print("  imports:")
+    for statement, seconds in report["imports"].items():
+        time_str = "not installed" if seconds is None \
+            else f"{seconds * 1000:.1f} ms"
+        print(f"    {statement}: {time_str}")
+    if report["removed_imports"]:
+        print(f"  removed imports: {', '.join(report['removed_imports'])}")
+    if report["total"] is None:
+        print("  cold start import time: not measured")
+    else:
+        print(f"  cold start import time: {report['total'] * 1000:.1f} ms")
+
+
+def extract_top_level(file_path, names):
+    """Source lines of top-level functions and assignments, with the comments
+    just above them, in the order of the file."""
+    with open(file_path, "r", encoding="utf-8") as f:
+        source = f.read()
+    lines = source.splitlines(keepends=True)
+    out = []
+    found = set()
+    for node in ast.parse(source).body:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            name = node.name
+        elif isinstance(node, ast.Assign) and len(node.targets) == 1 and \
+                isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+        else:
+            continue
+        if name not in names:
+            continue
+        found.add(name)
+        start = min([node.lineno] +
+                    [d.lineno for d in getattr(node, "decorator_list", [])]) - 1
+        while start > 0 and lines[start - 1].lstrip().startswith("#"):
+            start -= 1
+        out.extend(lines[start:node.end_lineno])
+        out.append("\n")
+    missing = [name for name in names if name not in found]
+    if missing:
+        raise ValueError(f"{file_path} does not define {', '.join(missing)}")
+    return out
+
+
+def create_lamda_file(base_file,
+                      tmp_file,
+                      out_file,
+                      strategy_class,
+                      market_class,
+                      codec_file=codec_files["numpy"],
+                      drop_modules=()):
+    """Create the handler from the template, with only the used imports.
+
+    Returns the removed import statements.
+    """
     out = []
     with open(base_file, "r") as f:
         base = f.readlines()
 
     for line in base:
-        if "{Strategy src}" in line:
+        if "{Array codec}" in line:
+            with open(codec_file, "r") as f:
+                out.extend(f.readlines())
+        elif "{State codec}" in line:
+            out.extend(extract_top_level(state_codec_file, STATE_CODEC_NAMES))
+        elif "{Strategy src}" in line:
             with open(tmp_file, "r") as f:
                 for line in f.readlines():
                     if "import" in line and " ." in line:
@@ -165,8 +437,10 @@ def create_lamda_file(base_file, tmp_file, out_file, strategy_class,
         else:
             out.append(line)
 
+    source, removed = select_imports("".join(out), drop_modules)
     with open(out_file, "w") as f:
-        f.write("".join(out))
+        f.write(source)
+    return removed
 
 
 if __name__ == "__main__":
@@ -185,7 +459,6 @@ if __name__ == "__main__":
                         help="Path to the output file.")
     parser.add_argument("-s",
                         "--strategy-class",
-                        required=True,
                         help="Strategy Class Name.")
     parser.add_argument("-m",
                         "--market-class",
@@ -196,15 +469,56 @@ if __name__ == "__main__":
         "--additional_target_names",
         nargs="+",
         help="The names of the target functions and classes to include.")
+    parser.add_argument(
+        "--spec",
+        help="Strategy spec JSON file, used instead of a strategy class.")
+    parser.add_argument(
+        "--no-numpy",
+        action="store_true",
+        help="Build without numpy, for strategies whose state is numbers and lists.")
+    parser.add_argument("--report",
+                        help="Write the build report to this JSON file.")
 
     args = parser.parse_args()
+    spec = None
+    if args.spec is not None:
+        with open(args.spec, "r", encoding="utf-8") as f:
+            spec = json.load(f)
+        spec.setdefault("name", "CustomSpecStrategy")
+        args.strategy_class = spec["name"]
+    elif args.strategy_class is None:
+        parser.error("-s/--strategy-class or --spec is required")
     classes = []
     classes.append(args.market_class)
-    classes.append(args.strategy_class)
+    classes.append("SpecStrategy" if spec is not None else args.strategy_class)
     if args.additional_target_names is not None:
         classes.extend(args.additional_target_names)
 
     combine_files(args.directories, tmp_file, classes)
-    create_lamda_file(base_file, tmp_file, args.output_file,
-                      args.strategy_class, args.market_class)
+    if spec is not None:
+        with open(tmp_file, "a", encoding="utf-8") as f:
+            f.write(create_spec_class(spec))
+    codec = "python" if args.no_numpy else "numpy"
+    removed = create_lamda_file(base_file,
+                                tmp_file,
+                                args.output_file,
+                                args.strategy_class,
+                                args.market_class,
+                                codec_file=codec_files[codec],
+                                drop_modules=("numpy", ) if args.no_numpy else ())
     os.remove(tmp_file)
+    if args.no_numpy:
+        with open(args.output_file, "r", encoding="utf-8") as f:
+            uses = [
+                use for use in find_module_uses(f.read(), "np")
+                if use.split(".")[-1] not in OFFLINE_METHODS
+            ]
+        if uses:
+            os.remove(args.output_file)
+            parser.error(f"--no-numpy: numpy is used by {', '.join(uses)}")
+
+    report = build_report(args.output_file, removed)
+    print_report(report)
+    if args.report is not None:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,75 @@
+"""Throughput of saving and loading strategy states, offline
+
+Runs many MovingAverageCrossoverStrategy and MACDStrategy instances as
+paper trading: every tick, each strategy is loaded from the store, gets
+the price and is saved. The encoding (utils.dynamodb.encode_binary) is
+measured separately from the stores.
+"""
+import os
+import tempfile
+import time
+
+try:
+    from bitbacktest.strategy import MovingAverageCrossoverStrategy, MACDStrategy
+    from bitbacktest.market import BacktestMarket
+    from bitbacktest.data_generater import random_data
+    from bitbacktest.state_store import SQLiteStateStore, FileStateStore
+    from bitbacktest.utils.dynamodb import encode_binary, convert_for_dynamodb
+except:
+    import sys
+    sys.path.append(".")
+    from src.bitbacktest.strategy import MovingAverageCrossoverStrategy, MACDStrategy
+    from src.bitbacktest.market import BacktestMarket
+    from src.bitbacktest.data_generater import random_data
+    from src.bitbacktest.state_store import SQLiteStateStore, FileStateStore
+    from src.bitbacktest.utils.dynamodb import encode_binary, convert_for_dynamodb
+
+strategy_num = 100
+tick_num = 200
+price_data = random_data(1e7, 0.001, tick_num, 111).round()
+
+strategies = {}
+for i in range(strategy_num):
+    if i % 2:
+        strategy = MACDStrategy(BacktestMarket(price_data))
+        strategy.reset_param({"short_window": 12, "long_window": 26,
+                              "signal_window": 9, "one_order_quantity": 0.001})
+    else:
+        strategy = MovingAverageCrossoverStrategy(BacktestMarket(price_data))
+        strategy.reset_param({"short_window": 10, "long_window": 100,
+                              "one_order_quantity": 0.001})
+    strategies[f"strategy-{i}"] = strategy
+
+# Encoding
+states = [s.dump_dynamic() for s in strategies.values()]
+for price in price_data[:100]:
+    for s in strategies.values():
+        s.generate_signals(price)
+states = [s.dump_dynamic() for s in strategies.values()]
+for name, encode in (("map format", convert_for_dynamodb),
+                     ("binary", encode_binary)):
+    start = time.perf_counter()
+    for _ in range(10):
+        for state in states:
+            encode(state)
+    elapsed = time.perf_counter() - start
+    print(f"encode {name}: {10 * len(states) / elapsed:.0f} states/s")
+
+# Paper trading with each store
+with tempfile.TemporaryDirectory() as tmp:
+    stores = {
+        "sqlite": SQLiteStateStore(os.path.join(tmp, "states.db")),
+        "file": FileStateStore(os.path.join(tmp, "states")),
+    }
+    for name, store in stores.items():
+        start = time.perf_counter()
+        for price in price_data:
+            loaded = store.load_many(strategies)
+            for key, strategy in strategies.items():
+                if key in loaded:
+                    strategy.load_dynamic(loaded[key])
+                strategy.generate_signals(price)
+            store.save_many({k: s.dump_dynamic() for k, s in strategies.items()})
+        elapsed = time.perf_counter() - start
+        store.close()
+        print(f"{name}: {strategy_num * tick_num / elapsed:.0f} strategy ticks/s")
@@ -2,6 +2,7 @@ try:
     from bitbacktest.strategy import MovingAverageCrossoverStrategy
     from bitbacktest.market import BacktestMarket
     from bitbacktest.backtester import GridBacktester
+    from bitbacktest.grid import ParamGrid
     from bitbacktest.data_generater import random_data
 except:
     import sys
@@ -9,6 +10,7 @@ except:
     from src.bitbacktest.strategy import MovingAverageCrossoverStrategy
     from src.bitbacktest.market import BacktestMarket
     from src.bitbacktest.backtester import GridBacktester
+    from src.bitbacktest.grid import ParamGrid
     from src.bitbacktest.data_generater import random_data
 
 # Generate data for test
@@ -19,44 +21,16 @@ length = 60 * 24 * 7 * 4  # data length
 price_data = random_data(start_price, price_range, length, seed)
 
 # Set parameters
-params = [
+# Lists and ranges are swept, other values are fixed.
+# Combinations that do not satisfy the constraints are not backtested.
+params = ParamGrid(
     {
-        "short_window": 30,
-        "long_window": 120,
+        "short_window": [30, 60],
+        "long_window": [120, 720, 1440],
         "profit": 1.01,
         "one_order_quantity": 0.01
     },
-    {
-        "short_window": 30,
-        "long_window": 720,
-        "profit": 1.01,
-        "one_order_quantity": 0.01
-    },
-    {
-        "short_window": 30,
-        "long_window": 1440,
-        "profit": 1.01,
-        "one_order_quantity": 0.01
-    },
-    {
-        "short_window": 60,
-        "long_window": 120,
-        "profit": 1.01,
-        "one_order_quantity": 0.01
-    },
-    {
-        "short_window": 60,
-        "long_window": 720,
-        "profit": 1.01,
-        "one_order_quantity": 0.01
-    },
-    {
-        "short_window": 60,
-        "long_window": 1440,
-        "profit": 1.01,
-        "one_order_quantity": 0.01
-    },
-]
+    constraints=[lambda p: p["short_window"] < p["long_window"]])
 start_cash = 1e6
 
 # Prepare Strategy and Backtester
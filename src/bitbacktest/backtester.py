@@ -1,15 +1,27 @@
-import pandas as pd
-try:
-    from IPython.display import display
-except:
-    pass
-
 from .strategy import *
-try:
-    from skopt import gp_minimize
-    from skopt.space import Integer, Real, Categorical
-except:
-    pass
+from .space import is_dimension, to_skopt
+import itertools
+import json
+
+
+def __getattr__(name):
+    # scikit-optimize takes seconds to import, so Integer, Real and
+    # Categorical are resolved on first use
+    if name in ("Integer", "Real", "Categorical"):
+        try:
+            import skopt.space as space
+        except ImportError:
+            from . import space
+        return getattr(space, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _display(df):
+    try:
+        from IPython.display import display
+        display(df)
+    except:
+        print(df)
 
 
 class GridBacktester:
@@ -17,24 +29,128 @@ class GridBacktester:
     def __init__(self, strategy: Strategy):
         self.strategy = strategy
 
-    def backtest(self, params: list, start_cash: int, start_coin: float = 0):
-        self.grid_backtest_params = params
+    def backtest(self,
+                 params: list,
+                 start_cash: int,
+                 start_coin: float = 0,
+                 n_workers: int = 1,
+                 cost_model=None,
+                 sink=None,
+                 top_k: int = None,
+                 metric: str = "total_value",
+                 maximize: bool = True,
+                 keep_results: bool = True,
+                 pruner=None,
+                 metrics=None,
+                 chunk_size: int = 10000):
+        """
+        params: list of params, or any iterable of params such as ParamGrid.
+            Iterables are consumed lazily, len() is used for progress if available.
+        start_cash: int, start cash
+        start_coin: float, start coin
+        n_workers: int, number of worker processes. If more than 1, tasks are
+            scheduled longest-first by CostAwareScheduler and the load balance
+            is stored in "self.schedule_report".
+        cost_model: CostModel, run time estimator for n_workers > 1
+        sink: ResultSink, every result is written to the sink. Parameter sets
+            already in the sink are skipped, so an interrupted sweep resumes.
+            Their results are ranked for top_k.
+        top_k: int, keep the best "top_k" runs by "metric" in "self.top_results"
+        metric: str, key of the result used for top_k
+        maximize: bool, True if larger "metric" is better
+        keep_results: bool, keep every result in "self.test_results".
+            Set False with sink and/or top_k for huge sweeps.
+        pruner: Pruner, stop hopeless runs early. Pruned results are partial
+            and flagged with "pruned". The best finished run is used as the
+            reference of BehindBestRule.
+        metrics: list of metric names (see metrics.METRICS) or Metrics, added
+            to every result. "metric" can be one of them, e.g. "sharpe".
+        chunk_size: int, number of params scheduled at a time for
+            n_workers > 1
+        """
+        from .results import ResultSink, TopKResults
+        if metrics is not None and not hasattr(metrics, "compute"):
+            from .metrics import Metrics
+            metrics = Metrics(metrics)
         self.test_results = []
-        for i, param in enumerate(params):
-            print(f"Running test {i+1}/{len(params)}")
-            self.strategy.reset_all(param, start_cash, start_coin)
-            portfolio_result = self.strategy.backtest()
-            self.test_results.append(portfolio_result)
+        self.grid_backtest_params = []
+        self.top_results = None
+        if top_k is not None:
+            self.top_results = TopKResults(top_k, metric, maximize)
+
+        def record(param, result):
+            if sink is not None:
+                sink.append(param, result)
+            if self.top_results is not None:
+                self.top_results.push(param, result)
+            if keep_results:
+                self.grid_backtest_params.append(param)
+                self.test_results.append(result)
+
+        if sink is not None:
+            completed = sink.completed()
+            if len(completed) > 0:
+                print(f"Skipping {len(completed)} finished tests in the sink")
+                params = (p for p in params
+                          if not ResultSink.is_completed(completed, p))
+                if self.top_results is not None:
+                    # Finished runs are ranked with the new ones
+                    for param, result in sink.rows():
+                        if result.get(metric) is not None:
+                            self.top_results.push(param, result)
+
+        if n_workers > 1:
+            from .scheduler import CostAwareScheduler, merge_reports
+            scheduler = CostAwareScheduler(n_workers, cost_model)
+            reports = []
+            # Params are scheduled "chunk_size" at a time, so a lazy
+            # ParamGrid is not read into memory at once
+            params = iter(params)
+            while True:
+                chunk = list(itertools.islice(params, chunk_size))
+                if not chunk:
+                    break
+                if keep_results:
+                    # Keep the results in the order of params
+                    results = scheduler.run(self.strategy, chunk, start_cash,
+                                            start_coin, pruner=pruner,
+                                            metrics=metrics)
+                    for param, result in zip(chunk, results):
+                        record(param, result)
+                else:
+                    scheduler.run(self.strategy, chunk, start_cash,
+                                  start_coin, callback=record, pruner=pruner,
+                                  metrics=metrics)
+                reports.append(scheduler.report)
+            self.schedule_report = merge_reports(reports, scheduler.n_workers)
+            print(f"Load balance efficiency: "
+                  f"{self.schedule_report['efficiency']:.1%}")
+        else:
+            total = len(params) if hasattr(params, "__len__") else "?"
+            for i, param in enumerate(params):
+                print(f"Running test {i+1}/{total}")
+                strategy = self.strategy.clone()
+                strategy.reset_all(param, start_cash, start_coin)
+                result = strategy.backtest(pruner=pruner, metrics=metrics)
+                if pruner is not None and not result["pruned"]:
+                    pruner.update_best(strategy.market.hist["total_value_hist"])
+                record(param, result)
+        if sink is not None:
+            sink.flush()
         return self.test_results
 
     def print_backtest_result(self):
-        df1 = pd.DataFrame(self.grid_backtest_params)
-        df2 = pd.DataFrame(self.test_results)
+        if self.top_results is not None and not self.test_results:
+            params = [p for p, _ in self.top_results.items()]
+            results = [r for _, r in self.top_results.items()]
+        else:
+            params = self.grid_backtest_params
+            results = self.test_results
+        import pandas as pd
+        df1 = pd.DataFrame(params)
+        df2 = pd.DataFrame(results)
         df_h = pd.concat([df1, df2], axis=1)
-        try:
-            display(df_h)
-        except:
-            print(df_h)
+        _display(df_h)
 
 
 class BayesianBacktester:
@@ -46,21 +162,83 @@ class BayesianBacktester:
     def _backtest_algorithm(self, params):
         self.count += 1
         print(f"Running test {self.count}/{self.n_calls}")
-        param = self.target_params
+        param = dict(self.target_params)
         for i, k in enumerate(self.keys):
             param[k] = params[i]
-        self.strategy.reset_all(param, self.start_cash, self.start_coin)
-        result = self.strategy.backtest()
+        strategy = self.strategy.clone()
+        strategy.reset_all(param, self.start_cash, self.start_coin)
+        result = strategy.backtest()
         total_value = result["total_value"]
         print(f"param: {param}, total_value: {total_value}")
+        if self.checkpoint_path is not None:
+            self._write_checkpoint(param, total_value)
         return -total_value
 
+    def _write_checkpoint(self, param: dict, total_value: float):
+        line = json.dumps({"params": param, "total_value": total_value},
+                          default=lambda o: o.item())
+        with open(self.checkpoint_path, "a") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def read_checkpoint(checkpoint_path: str) -> list:
+        """Read evaluations written to a checkpoint file
+
+        Returns:
+            list: list of (params, total_value)
+        """
+        observations = []
+        if not os.path.exists(checkpoint_path):
+            return observations
+        with open(checkpoint_path) as f:
+            for line in f:
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    # A line cut off by a kill
+                    continue
+                observations.append((data["params"], data["total_value"]))
+        return observations
+
+    def _to_point(self, param: dict, dimensions: list):
+        """Convert params to a point of the search space, None if outside"""
+        for k, v in self.target_params.items():
+            if k not in self.keys and k in param and param[k] != v:
+                # Evaluated with other fixed params
+                return None
+        point = []
+        for k, dim in zip(self.keys, dimensions):
+            if k not in param or param[k] not in dim:
+                return None
+            value = param[k]
+            point.append(value.item() if isinstance(value, np.generic) else value)
+        return point
+
+    def _add_observations(self, observations, dimensions: list,
+                          x0: list, y0: list) -> int:
+        """Append (param, result) pairs inside the space to x0/y0, return the number added"""
+        n_added = 0
+        for param, result in observations:
+            point = self._to_point(param, dimensions)
+            if point is None:
+                continue
+            value = result["total_value"] if isinstance(result, dict) else result
+            x0.append(point)
+            y0.append(-float(value))
+            n_added += 1
+        return n_added
+
     def backtest(self,
                  target_params: dict,
                  start_cash: int,
                  start_coin: float = 0,
                  n_calls: int = 50,
-                 random_state: int = 777):
+                 random_state: int = 777,
+                 prior_results=None,
+                 checkpoint_path: str = None,
+                 n_initial_points: int = 10):
         """
         params: dict of params. Optimization parameters should be Integer, Real or Categorical.
             example,
@@ -75,31 +253,242 @@ class BayesianBacktester:
         start_coin: float, start coin
         n_calls: int, number of calls
         random_state: int, random state
+        prior_results: iterable of (params, result) evaluated before, e.g.
+            zip(grid.grid_backtest_params, grid.test_results) or ResultSink.rows().
+            "result" is a total value or a dict with "total_value". They seed the
+            optimizer (x0/y0) without being backtested again. Points outside the
+            space or with other fixed params are ignored.
+        checkpoint_path: str, every evaluation is appended to this file. If the
+            file exists, its evaluations are reused and only the remaining
+            calls of "n_calls" are run, so a killed optimization resumes.
+        n_initial_points: int, number of random points before fitting the model,
+            reduced by the number of prior points
         """
         self.start_cash = start_cash
         self.start_coin = start_coin
         self.target_params = target_params
         self.n_calls = n_calls
+        self.checkpoint_path = checkpoint_path
         self.keys = []
         param_ranges_variable = []
 
         for k in self.target_params.keys():
-            t = type(target_params[k])
-            if t is Integer or t is Real or t is Categorical:
-                param_ranges_variable.append(target_params[k])
+            if is_dimension(target_params[k]):
+                param_ranges_variable.append(to_skopt(target_params[k]))
                 self.keys.append(k)
 
+        # warm start
+        x0, y0 = [], []
+        n_done = 0
+        done = []
+        if checkpoint_path is not None:
+            if os.path.exists(checkpoint_path):
+                with open(checkpoint_path, "rb+") as f:
+                    data = f.read()
+                    if data and not data.endswith(b"\n"):
+                        # Drop the line cut off by a kill
+                        f.truncate(data.rfind(b"\n") + 1)
+            done = self.read_checkpoint(checkpoint_path)
+        self._add_observations(prior_results or [], param_ranges_variable,
+                               x0, y0)
+        # Only the evaluations inside the current space count as done
+        n_done = self._add_observations(done, param_ranges_variable, x0, y0)
+        if n_done > 0:
+            print(f"Resume from {checkpoint_path}: {n_done} evaluations")
+
         # execute
-        result = gp_minimize(func=self._backtest_algorithm,
-                             dimensions=param_ranges_variable,
-                             n_calls=n_calls,
-                             random_state=random_state)
+        n_remaining = n_calls - n_done
+        self.count = n_done
+        if n_remaining > 0:
+            n_random = min(max(n_initial_points - len(x0), 0), n_remaining)
+            if n_random == 0 and not x0:
+                n_random = 1
+            from skopt import gp_minimize
+            result = gp_minimize(func=self._backtest_algorithm,
+                                 dimensions=param_ranges_variable,
+                                 n_calls=n_remaining,
+                                 n_initial_points=n_random,
+                                 x0=x0 if x0 else None,
+                                 y0=y0 if y0 else None,
+                                 random_state=random_state)
+            best_x, best_fun = result.x, result.fun
+        else:
+            if not y0:
+                raise ValueError("No evaluation in the search space to resume from")
+            best = int(np.argmin(y0))
+            best_x, best_fun = x0[best], y0[best]
 
-        self.best_params = target_params
+        self.best_params = dict(target_params)
         for i, k in enumerate(self.keys):
-            self.best_params[k] = result.x[i]
-        self.best_value = -result.fun
+            self.best_params[k] = best_x[i]
+        self.best_value = -best_fun
+        print(f"Best Parameters: {self.best_params}")
+        print(f"Best Total Value: {self.best_value}")
+
+        return self.best_value, self.best_params
+
+
+class SuccessiveHalvingBacktester:
+    """Multi-fidelity optimizer by successive halving
+
+    All candidates are backtested on a short prefix (or a decimated
+    series) of the data. The best 1/eta of them are backtested again on
+    eta times more data, until the survivors run on the full data.
+    The total number of backtested ticks is about
+    (number of rungs) * n_candidates * (ticks of the first rung).
+    """
+
+    def __init__(self, strategy: Strategy):
+        self.strategy = strategy
+
+    @staticmethod
+    def _sample_candidates(target_params: dict, n_candidates: int,
+                           random_state: int) -> list:
+        from .space import sample_params
+        return sample_params(target_params, n_candidates, "random",
+                             random_state)
+
+    def _rung_market(self, n_rungs: int, rung: int, eta: int, mode: str):
+        data = self.strategy.market.data
+        scale = eta**(n_rungs - 1 - rung)
+        if mode == "prefix":
+            length = max(int(np.ceil(len(data) / scale)), 1)
+            return self.strategy.market.fork(data=data[:length])
+        elif mode == "decimate":
+            return self.strategy.market.fork(data=data[::scale])
+        raise ValueError(f"Unknown mode {mode}")
+
+    def backtest(self,
+                 target_params,
+                 start_cash: int,
+                 start_coin: float = 0,
+                 n_candidates: int = 81,
+                 eta: int = 3,
+                 min_resource: int = 1000,
+                 mode: Literal["prefix", "decimate"] = "prefix",
+                 random_state: int = 777):
+        """
+        target_params: dict of params like BayesianBacktester.backtest, from which
+            "n_candidates" candidates are sampled. A list of param dicts or a
+            ParamGrid is used as the candidates as is.
+        start_cash: int, start cash
+        start_coin: float, start coin
+        n_candidates: int, number of sampled candidates
+        eta: int, 1/eta of the candidates survive each rung, with eta times more data
+        min_resource: int, minimum number of ticks of the first rung
+        mode: "prefix" backtests on the first part of the data,
+            "decimate" on every n-th tick. Note that with "decimate" window
+            parameters count decimated ticks.
+        random_state: int, random state
+        """
+        if isinstance(target_params, dict):
+            candidates = self._sample_candidates(target_params, n_candidates,
+                                                 random_state)
+        else:
+            candidates = list(target_params)
+
+        length = len(self.strategy.market)
+        n_rungs = 1
+        while eta**n_rungs <= len(candidates) and \
+                length / eta**n_rungs >= min_resource:
+            n_rungs += 1
+
+        self.rung_results = []
+        for rung in range(n_rungs):
+            market = self._rung_market(n_rungs, rung, eta, mode)
+            print(f"Rung {rung+1}/{n_rungs}: {len(candidates)} candidates, "
+                  f"{len(market)} ticks")
+            values = []
+            for param in candidates:
+                strategy = self.strategy.clone(market=market.fork())
+                strategy.reset_all(param, start_cash, start_coin)
+                values.append(strategy.backtest()["total_value"])
+            self.rung_results.append(list(zip(candidates, values)))
+            n_keep = max(len(candidates) // eta, 1)
+            if rung == n_rungs - 1:
+                n_keep = 1
+            order = np.argsort(-np.asarray(values), kind="stable")[:n_keep]
+            candidates = [candidates[i] for i in order]
+            best_value = values[order[0]]
+
+        self.best_params = candidates[0]
+        self.best_value = best_value
         print(f"Best Parameters: {self.best_params}")
         print(f"Best Total Value: {self.best_value}")
 
         return self.best_value, self.best_params
+
+
+class SamplingBacktester:
+    """Quasi-random search
+
+    Parameter sets are sampled by a low-discrepancy sequence (Sobol or
+    Halton) or Latin hypercube, which cover the space more evenly than
+    random sampling with the same number of backtests. Unlike
+    BayesianBacktester, the samples are independent and are backtested
+    in parallel by GridBacktester. scikit-optimize is not required.
+    """
+
+    def __init__(self, strategy: Strategy):
+        self.strategy = strategy
+
+    def backtest(self,
+                 target_params: dict,
+                 start_cash: int,
+                 start_coin: float = 0,
+                 n_samples: int = 64,
+                 method: Literal["sobol", "halton", "lhs", "random"] = "sobol",
+                 n_workers: int = 1,
+                 random_state: int = 777,
+                 metric: str = "total_value",
+                 maximize: bool = True,
+                 **kwargs):
+        """
+        target_params: dict of params like BayesianBacktester.backtest.
+            Integer, Real and Categorical of skopt.space or bitbacktest.space are accepted.
+        start_cash: int, start cash
+        start_coin: float, start coin
+        n_samples: int, number of parameter sets. Sobol points are best
+            balanced for a power of 2.
+        method: "sobol" (needs scipy, otherwise "halton" is used), "halton",
+            "lhs" (Latin hypercube) or "random"
+        n_workers: int, number of worker processes
+        random_state: int, random state
+        metric: str, key of the result to optimize
+        maximize: bool, True if larger "metric" is better
+        kwargs: passed to GridBacktester.backtest (e.g. sink, pruner)
+        """
+        from .space import sample_params
+        self.samples = sample_params(target_params, n_samples, method,
+                                     random_state)
+        self.grid_backtester = GridBacktester(self.strategy)
+        self.grid_backtester.backtest(self.samples,
+                                      start_cash,
+                                      start_coin,
+                                      n_workers=n_workers,
+                                      top_k=1,
+                                      metric=metric,
+                                      maximize=maximize,
+                                      **kwargs)
+        best = self.grid_backtester.top_results.items()
+        if not best:
+            # No sample was backtested and none is in the sink
+            print("No results")
+            self.best_value, self.best_params = None, None
+            return self.best_value, self.best_params
+        self.best_params, result = best[0]
+        self.best_value = result[metric]
+        print(f"Best Parameters: {self.best_params}")
+        print(f"Best Total Value: {self.best_value}")
+
+        return self.best_value, self.best_params
+
+    def print_backtest_result(self):
+        self.grid_backtester.print_backtest_result()
+
+
+# A star import does not call __getattr__ for names missing from __all__,
+# so Integer, Real and Categorical are listed to keep
+# "from bitbacktest.backtester import *" exporting them
+__all__ = [name for name in globals() if not name.startswith("_")
+           ] + ["Integer", "Real", "Categorical"]
@@ -0,0 +1,202 @@
+"""Periodic checkpoints of a running backtest
+
+A checkpoint directory has one state file and one append-only file per
+history list. The state file is a Strategy.snapshot(history=False) and
+the committed length of every history file, written atomically. History
+lists only get the items added since the previous checkpoint, so a
+checkpoint of a long backtest does not rewrite its whole history. Bytes
+after the committed length (from a crash during a checkpoint) are
+ignored and truncated.
+"""
+import os
+import pickle
+import time
+
+import numpy as np
+
+from .ledger import FILL_DTYPE, TradeLedger
+from .storage import HistoryBuffer
+
+STATE_FILE = "state.pkl"
+PREV_STATE_FILE = "state.prev.pkl"
+LEDGER_FILE = "ledger.bin"
+
+
+def _history_lists(strategy) -> dict:
+    lists = {}
+
+    def walk(prefix, value):
+        if isinstance(value, dict):
+            for k, v in value.items():
+                walk(f"{prefix}.{k}", v)
+        else:
+            lists[prefix] = value
+
+    walk("hist", strategy.market.hist)
+    walk("hold", strategy.__dict__.get("hold_params", {}))
+    return lists
+
+
+def _set_history(snapshot: dict, name: str, items: list):
+    keys = name.split(".")
+    root = snapshot["market"]["hist"] if keys[0] == "hist" \
+        else snapshot["hold_params"]
+    for k in keys[1:-1]:
+        root = root.setdefault(k, {})
+    if isinstance(root.get(keys[-1]), HistoryBuffer):
+        # Compact history of BacktestMarket(compact=True)
+        items = HistoryBuffer(items)
+    root[keys[-1]] = items
+
+
+def _dump_items(items: list) -> bytes:
+    # Other values, e.g. the arrays of hold_params, are pickled as a list
+    if all(np.ndim(x) == 0 for x in items):
+        array = np.asarray(items)
+    else:
+        array = None
+    if array is not None and array.ndim == 1 and array.dtype.kind in "biuf":
+        # Numbers (e.g. total_value_hist) are stored as an array, 8 bytes each
+        return pickle.dumps(array)
+    return pickle.dumps(list(items))
+
+
+def _load_items(f) -> list:
+    items = pickle.load(f)
+    if isinstance(items, np.ndarray):
+        return items.tolist()
+    return items
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _read_state(path: str) -> dict:
+    # The previous state is used if the latest one is missing or broken
+    for name in (STATE_FILE, PREV_STATE_FILE):
+        try:
+            with open(os.path.join(path, name), "rb") as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            continue
+    raise FileNotFoundError(f"No valid checkpoint in {path}")
+
+
+def load_checkpoint(path: str) -> dict:
+    """Read the latest valid checkpoint
+
+    Args:
+        path (str): checkpoint directory
+
+    Returns:
+        dict: snapshot with the full history, see Strategy.restore()
+    """
+    state = _read_state(path)
+    snapshot = state["snapshot"]
+    for name, (offset, count) in state["files"].items():
+        if name == LEDGER_FILE:
+            with open(os.path.join(path, name), "rb") as f:
+                data = f.read(offset)
+            fills = np.frombuffer(data, dtype=FILL_DTYPE)
+            snapshot["market"]["ledger"] = TradeLedger.from_fills(fills)
+            continue
+        items = []
+        with open(os.path.join(path, name), "rb") as f:
+            while f.tell() < offset:
+                items.extend(_load_items(f))
+        _set_history(snapshot, name[:-len(".pkl")], items[:count])
+    return snapshot
+
+
+class Checkpointer:
+    """Writes checkpoints during Strategy.backtest(checkpoint=...)
+
+    example,
+        strategy.backtest(checkpoint=Checkpointer("ckpt", every_ticks=100000))
+        # after a crash
+        strategy.backtest(checkpoint=Checkpointer("ckpt", every_ticks=100000),
+                          resume_from="ckpt")
+
+    Args:
+        path (str): checkpoint directory
+        every_ticks (int, optional): ticks between checkpoints
+        every_seconds (float, optional): seconds between checkpoints
+    """
+
+    def __init__(self, path: str, every_ticks: int = None,
+                 every_seconds: float = None):
+        if every_ticks is None and every_seconds is None:
+            raise ValueError("every_ticks or every_seconds is required")
+        self.path = path
+        self.every_ticks = every_ticks
+        self.every_seconds = every_seconds
+        self._files = {}
+        self._last_time = time.monotonic()
+
+    def start(self, resumed_from: str = None):
+        """Prepare the directory. Called at the start of a backtest.
+
+        Args:
+            resumed_from (str, optional): checkpoint directory the backtest resumed from.
+                If it is this directory, the history files are appended to.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        self._files = {}
+        if resumed_from is not None and \
+           os.path.abspath(resumed_from) == os.path.abspath(self.path):
+            self._files = dict(_read_state(self.path)["files"])
+        for name in os.listdir(self.path):
+            file = os.path.join(self.path, name)
+            if name in self._files:
+                # Drop bytes written after the last committed checkpoint
+                with open(file, "r+b") as f:
+                    f.truncate(self._files[name][0])
+            elif self._files and name in (STATE_FILE, PREV_STATE_FILE):
+                continue
+            elif name.endswith((".pkl", ".bin", ".tmp")):
+                os.remove(file)
+        self._last_time = time.monotonic()
+
+    def due(self, count: int) -> bool:
+        if self.every_ticks is not None and count % self.every_ticks == 0:
+            return True
+        return self.every_seconds is not None and \
+            time.monotonic() - self._last_time >= self.every_seconds
+
+    def save(self, strategy):
+        """Write a checkpoint of the strategy"""
+        files = dict(self._files)
+        for name, items in _history_lists(strategy).items():
+            name = name + ".pkl"
+            offset, count = files.get(name, (0, 0))
+            if len(items) > count:
+                offset = self._append(name, _dump_items(items[count:]))
+            files[name] = (offset, len(items))
+        ledger = getattr(strategy.market, "ledger", None)
+        if ledger is not None:
+            offset, count = files.get(LEDGER_FILE, (0, 0))
+            if len(ledger) > count:
+                offset = self._append(LEDGER_FILE,
+                                      ledger.fills[count:].tobytes())
+            files[LEDGER_FILE] = (offset, len(ledger))
+
+        state = {"snapshot": strategy.snapshot(history=False), "files": files}
+        state_file = os.path.join(self.path, STATE_FILE)
+        if os.path.exists(state_file):
+            os.replace(state_file, os.path.join(self.path, PREV_STATE_FILE))
+        _write_atomic(state_file, pickle.dumps(state))
+        self._files = files
+        self._last_time = time.monotonic()
+
+    def _append(self, name: str, data: bytes) -> int:
+        with open(os.path.join(self.path, name), "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
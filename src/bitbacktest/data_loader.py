@@ -1,13 +1,35 @@
 import numpy as np
 import os
 
-def read_prices_from_sheets(file_path: str, sheet_names: list, step: int = 1, use_cache: bool = True) -> list:
+from .storage import compact_prices
+
+def read_prices_from_sheets(file_path: str, sheet_names: list, step: int = 1, use_cache: bool = True, compact: bool = False) -> list:
+    """Read prices from the 2nd column of Excel sheets
+
+    Args:
+        file_path (str): Excel file
+        sheet_names (list): sheets to read
+        step (int, optional): use every "step"-th price. Defaults to 1.
+        use_cache (bool, optional): read the .npy cache next to the file if it exists. Defaults to True.
+        compact (bool, optional): return an int32 / float32 array (see
+            storage.compact_prices) instead of a list. The cache is then
+            also compact and memory-mapped, so processes share its pages.
+            Defaults to False.
+
+    Returns:
+        list: prices, np.ndarray if compact
+    """
     # キャッシュファイルのパス（Excelファイルと同じディレクトリに保存）
     cache_file = file_path.replace('.xlsx', '_cache.npy')
     
     # キャッシュを使用する場合
     if use_cache and os.path.exists(cache_file):
         print(f"Loading data from cache: {cache_file}")
+        if compact:
+            all_prices = np.load(cache_file, mmap_mode="r")
+            if all_prices.dtype.itemsize > 4:
+                all_prices = compact_prices(all_prices)
+            return all_prices[::step]
         all_prices = np.load(cache_file).tolist()
         return all_prices[::step]  # stepを考慮してデータを返す
 
@@ -21,7 +43,11 @@ def read_prices_from_sheets(file_path: str, sheet_names: list, step: int = 1, us
         all_prices.extend(df.iloc[:, 1].tolist())  # 2列目が価格データ
 
     # 読み込んだデータをキャッシュとして保存
-    np.save(cache_file, np.array(all_prices))
+    if compact:
+        all_prices = compact_prices(all_prices)
+        np.save(cache_file, all_prices)
+    else:
+        np.save(cache_file, np.array(all_prices))
     print(f"Data cached to: {cache_file}")
 
     return all_prices[::step]  # stepを考慮してデータを返す
\ No newline at end of file
@@ -1,26 +1,61 @@
 import numpy as np
 from ..strategy import MACDStrategy, MovingAverageCrossoverStrategy
+from ..kernel import MACDKernel, register_kernel
 
 
-class MACForcusBuyStrategy(MovingAverageCrossoverStrategy):
+class ForcusBuyMixin:
+    """Buy on the signal and place the exit order of the bought quantity
+
+    The exit is a take-profit limit sell at price * "profit". Optional params:
+    "stop_loss" (e.g. 0.99) adds a stop sell at price * "stop_loss" as an OCO
+    pair with the take-profit, "trailing_stop" (e.g. 0.01) replaces the
+    take-profit with a trailing stop sell.
+    """
 
     def execute_trade(self, price: float, signal: str):
         if signal == 'Buy':
             success = self.market.place_market_order(
                 'Buy', self.static["one_order_quantity"])
             if success:
-                self.market.place_limit_order(
-                    "Sell", self.static["one_order_quantity"],
-                    price * self.static["profit"])
+                self.place_exit_order(price, self.market.last_order_id)
 
+    def place_exit_order(self, price: float, parent_id):
+        quantity = self.static["one_order_quantity"]
+        if self.static.get("trailing_stop") is not None:
+            self.market.place_trailing_stop_order("Sell",
+                                                  quantity,
+                                                  self.static["trailing_stop"],
+                                                  parent_id=parent_id)
+        elif self.static.get("stop_loss") is not None:
+            self.market.place_oco_order("Sell",
+                                        quantity,
+                                        price * self.static["profit"],
+                                        price * self.static["stop_loss"],
+                                        parent_id=parent_id)
+        else:
+            self.market.place_limit_order("Sell",
+                                          quantity,
+                                          price * self.static["profit"],
+                                          parent_id=parent_id)
 
-class MACDForcusBuyStrategy(MACDStrategy):
 
-    def execute_trade(self, price: float, signal: str):
-        if signal == 'Buy':
-            success = self.market.place_market_order(
-                'Buy', self.static["one_order_quantity"])
-            if success:
-                self.market.place_limit_order(
-                    "Sell", self.static["one_order_quantity"],
-                    price * self.static["profit"])
+class MACForcusBuyStrategy(ForcusBuyMixin, MovingAverageCrossoverStrategy):
+    pass
+
+
+class MACDForcusBuyStrategy(ForcusBuyMixin, MACDStrategy):
+    pass
+
+
+class MACDForcusBuyKernel(MACDKernel):
+    """Kernel of MACDForcusBuyStrategy with a take-profit exit"""
+
+    def actions(self, strategy):
+        if strategy.static.get("trailing_stop") is not None or \
+           strategy.static.get("stop_loss") is not None:
+            return None
+        return strategy.static["one_order_quantity"], 0.0, \
+            strategy.static["profit"]
+
+
+register_kernel(MACDForcusBuyStrategy, MACDForcusBuyKernel())
@@ -0,0 +1,84 @@
+import itertools
+
+
+class ParamGrid:
+    """Lazy Cartesian product of parameter values
+
+    Parameter sets are generated one at a time, so the grid itself uses
+    constant memory however many points it has.
+
+    example,
+        grid = ParamGrid(
+            {
+                "short_window": range(30, 181, 30),
+                "long_window": [120, 720, 1440],
+                "one_order_quantity": 0.01
+            },
+            constraints=[lambda p: p["short_window"] < p["long_window"]])
+
+    Args:
+        space (dict): values of each key. A list, tuple or range is swept, any other value is fixed.
+        constraints (list, optional): predicates, parameter sets for which one returns False are dropped.
+        canonicalize (callable, optional): maps a parameter set to its canonical form.
+            Parameter sets with the same canonical form are backtested only once.
+    """
+
+    def __init__(self, space: dict, constraints: list = None,
+                 canonicalize=None):
+        self.space = space
+        self.constraints = list(constraints or [])
+        self.canonicalize = canonicalize
+        self.keys = list(space.keys())
+        self.axes = [
+            v if isinstance(v, (list, tuple, range)) else [v]
+            for v in space.values()
+        ]
+        self._len = None
+
+    def _valid(self, param: dict) -> bool:
+        return all(c(param) for c in self.constraints)
+
+    def _in_grid(self, param: dict) -> bool:
+        if set(param.keys()) != set(self.keys):
+            return False
+        for k, axis in zip(self.keys, self.axes):
+            if param[k] not in axis:
+                return False
+        return self._valid(param)
+
+    def __iter__(self):
+        # A parameter set whose canonical form is another point of the grid
+        # is skipped, as that point is generated on its own. Only canonical
+        # forms outside the grid need to be remembered.
+        seen = set()
+        for values in itertools.product(*self.axes):
+            param = dict(zip(self.keys, values))
+            if not self._valid(param):
+                continue
+            if self.canonicalize is not None:
+                canonical = self.canonicalize(dict(param))
+                if canonical != param:
+                    if self._in_grid(canonical):
+                        continue
+                    key = tuple(sorted(canonical.items()))
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    param = canonical
+            yield param
+
+    def __len__(self) -> int:
+        """Number of parameter sets after pruning and deduplication
+        Counted by one pass over the grid without backtesting, then cached.
+        """
+        if self._len is None:
+            self._len = sum(1 for _ in self)
+        return self._len
+
+    @property
+    def size(self) -> int:
+        """Number of points before pruning and deduplication"""
+        size = 1
+        for axis in self.axes:
+            size *= len(axis)
+        return size
@@ -0,0 +1,419 @@
+"""Compiled backtest kernels
+
+Strategy.backtest() calls generate_signals() and execute_trade() per tick
+in Python. A strategy class with a registered StrategyKernel can run the
+whole loop as one function instead:
+
+- the signal is a function f(price, params, state) -> 0 (Hold), 1 (Buy)
+  or 2 (Sell), with the parameters and the state in float64 arrays
+- orders are market orders on the signals and take-profit limit orders
+  of successful market orders
+
+When numba is installed, that loop and the signal function are compiled.
+Compiling the loop takes seconds in every process, so
+backtest(backend="auto") only uses the kernel once it is compiled (see
+warm_kernel()) or for at least KERNEL_MIN_TICKS ticks, and keeps using the
+Python loop without numba. backtest(backend="kernel") always runs the
+kernel, uncompiled without numba (for parity tests).
+Either way the result (portfolio, history, ledger, open orders and
+"self.dynamic") is the same as the Python loop on a BacktestMarket.
+"""
+import os
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from .ledger import BUY, SELL
+from .market import BacktestMarket, Order
+from .strategy import MACDStrategy
+
+# Ticks the Python loop runs in about the time of compiling the kernel
+KERNEL_MIN_TICKS = 1_000_000
+
+_compiled = {}
+# Signal functions the loop is compiled with in this process
+_warm = set()
+
+
+def _numba():
+    # numba is imported on first use, None if it is not installed
+    try:
+        import numba
+    except ImportError:
+        return None
+    return numba
+
+
+def _jit(func, cache: bool = True):
+    numba = _numba()
+    if numba is None:
+        return func
+    if func not in _compiled:
+        _compiled[func] = numba.njit(func, cache=cache)
+    return _compiled[func]
+
+
+def _fill(side, quantity, price, cash, position, fee_rate):
+    # BacktestMarket._execute_buy_order() / _execute_sell_order()
+    if side > 0:
+        if cash < quantity * price:
+            return False, cash, position
+        cash -= quantity * price
+        position += quantity
+    else:
+        if position < quantity:
+            return False, cash, position
+        cash += quantity * price
+        position -= quantity
+    position -= quantity * fee_rate
+    return True, cash, position
+
+
+def _record(events, n_events, index, side, quantity, price, order_id,
+            parent_id, ok):
+    if n_events == len(events):
+        grown = np.empty((2 * len(events) + 1, events.shape[1]))
+        grown[:n_events] = events[:n_events]
+        events = grown
+    events[n_events, 0] = index
+    events[n_events, 1] = side
+    events[n_events, 2] = quantity
+    events[n_events, 3] = price
+    events[n_events, 4] = order_id
+    events[n_events, 5] = parent_id
+    events[n_events, 6] = 1.0 if ok else 0.0
+    return events, n_events + 1
+
+
+def _levels(orders, n_open):
+    # Lowest limit sell and highest limit buy, the prices that cross an order
+    low_sell = np.inf
+    high_buy = -np.inf
+    for j in range(n_open):
+        if orders[j, 2] < 0:
+            low_sell = min(low_sell, orders[j, 4])
+        else:
+            high_buy = max(high_buy, orders[j, 4])
+    return low_sell, high_buy
+
+
+def _loop(signal, fill, record, levels, prices, start, params, state, cash,
+          position, trade_count, next_id, fee_rate, buy_quantity,
+          sell_quantity, take_profit, enabled, order_num_max, orders, n_open,
+          events):
+    # orders: open limit orders in placement order,
+    #     (order id, parent id or -1, side 1 Buy / -1 Sell, quantity, price)
+    # events: fill attempts,
+    #     (index, side, quantity, price, order id, parent id, 1 if filled)
+    n = len(prices)
+    values = np.empty(n - start)
+    positions = np.empty(n - start)
+    n_events = 0
+    low_sell, high_buy = levels(orders, n_open)
+    for i in range(start, n):
+        price = prices[i]
+        code = signal(price, params, state)
+        # Strategy.trade_limiter()
+        if code != 0 and enabled and order_num_max > n_open:
+            side = 1.0 if code == 1 else -1.0
+            quantity = buy_quantity if code == 1 else sell_quantity
+            if quantity > 0:
+                order_id = next_id
+                next_id += 1
+                ok, cash, position = fill(side, quantity, price, cash,
+                                          position, fee_rate)
+                events, n_events = record(events, n_events, i, side,
+                                          quantity, price, order_id, -1.0, ok)
+                if ok:
+                    trade_count += 1
+                    if take_profit > 0:
+                        if n_open == len(orders):
+                            grown = np.empty((2 * len(orders) + 1, 5))
+                            grown[:n_open] = orders[:n_open]
+                            orders = grown
+                        orders[n_open, 0] = next_id
+                        orders[n_open, 1] = order_id
+                        orders[n_open, 2] = -side
+                        orders[n_open, 3] = quantity
+                        orders[n_open, 4] = price * take_profit
+                        next_id += 1
+                        n_open += 1
+                        if side > 0:
+                            low_sell = min(low_sell, price * take_profit)
+                        else:
+                            high_buy = max(high_buy, price * take_profit)
+        # BacktestMarket.check_order(), crossed orders in placement order
+        if price >= low_sell or price <= high_buy:
+            kept = 0
+            for j in range(n_open):
+                keep = True
+                if orders[j, 2] < 0 and price >= orders[j, 4] or \
+                   orders[j, 2] > 0 and price <= orders[j, 4]:
+                    ok, cash, position = fill(orders[j, 2], orders[j, 3],
+                                              price, cash, position, fee_rate)
+                    events, n_events = record(events, n_events, i,
+                                              orders[j, 2], orders[j, 3],
+                                              price, orders[j, 0],
+                                              orders[j, 1], ok)
+                    if ok:
+                        trade_count += 1
+                        keep = False
+                if keep:
+                    orders[kept] = orders[j]
+                    kept += 1
+            n_open = kept
+            low_sell, high_buy = levels(orders, n_open)
+        values[i - start] = cash + position * price
+        positions[i - start] = position
+    return (cash, position, trade_count, next_id, orders, n_open, events,
+            n_events, values, positions)
+
+
+def _run_loop(signal, *args):
+    if _numba() is None:
+        return _loop(signal, _fill, _record, _levels, *args)
+    # The disk cache misses on the signal function argument
+    result = _jit(_loop, cache=False)(_jit(signal), _jit(_fill),
+                                      _jit(_record), _jit(_levels), *args)
+    _warm.add(signal)
+    return result
+
+
+class StrategyKernel(ABC):
+    """Kernel interface of a strategy class, see register_kernel()
+
+    Subclasses set "signal" and implement the conversion of the strategy's
+    parameters and state.
+    """
+    # f(price, params, state) -> signal code, updates "state" in place
+    signal = None
+
+    @abstractmethod
+    def params(self, strategy) -> np.ndarray:
+        """Parameters of "signal" from "strategy.static" """
+
+    @abstractmethod
+    def state(self, strategy) -> np.ndarray:
+        """State of "signal" from "strategy.dynamic" """
+
+    @abstractmethod
+    def load_state(self, strategy, state: np.ndarray):
+        """Set "strategy.dynamic" from the state after the loop"""
+
+    @abstractmethod
+    def actions(self, strategy):
+        """Orders of the signals
+
+        Returns:
+            tuple: (buy quantity, sell quantity, take-profit ratio), 0 for
+                no order. None if execute_trade() can not run as the kernel
+                with the current parameters.
+        """
+
+
+_kernels = {}
+
+
+def register_kernel(strategy_class: type, kernel: StrategyKernel):
+    """Use a kernel for backtests of a strategy class
+
+    The kernel is used for the class itself, not for its subclasses.
+    """
+    _kernels[strategy_class] = kernel
+
+
+def get_kernel(strategy):
+    """Registered kernel of a strategy, None if there is none"""
+    return _kernels.get(type(strategy))
+
+
+def run_kernel(strategy, required: bool = False) -> bool:
+    """Run the backtest loop of a strategy as its kernel
+
+    Called by Strategy.backtest(), from "strategy.dynamic['count']" to the
+    end of the market.
+
+    Args:
+        strategy (Strategy): strategy with a registered kernel
+        required (bool, optional): raise ValueError instead of returning
+            False if the kernel can not be used. Without it the kernel is
+            only used if numba is installed.
+
+    Returns:
+        bool: True if the backtest ran
+    """
+    market = strategy.market
+    kernel = get_kernel(strategy)
+    reason = None
+    if kernel is None:
+        reason = f"no kernel for {type(strategy).__name__}"
+    elif type(market) is not BacktestMarket or market.bar_mode:
+        reason = "the kernel needs a BacktestMarket not in bar mode"
+    elif any(o.order_type != "Limit" or o.oco_id is not None
+             for o in market.order.values()):
+        reason = "the kernel only keeps limit orders"
+    else:
+        actions = kernel.actions(strategy)
+        if actions is None:
+            reason = "the parameters are not supported by the kernel"
+    if reason is not None:
+        if required:
+            raise ValueError(f"Can not run the kernel: {reason}")
+        return False
+    start = strategy.dynamic["count"]
+    if not required and (_numba() is None or (
+            kernel.signal not in _warm and
+            len(market) - start < KERNEL_MIN_TICKS)):
+        return False
+    if start >= len(market):
+        return True
+    open_orders = list(market.order.values())
+    orders = np.empty((max(len(open_orders), 16), 5))
+    for j, o in enumerate(open_orders):
+        orders[j] = (o.order_id, -1 if o.parent_id is None else o.parent_id,
+                     1 if o.side == "Buy" else -1, o.quantity, o.price)
+    portfolio = market.portfolio
+    state = kernel.state(strategy)
+    (cash, position, trade_count, next_id, orders, n_open, events, n_events,
+     values, positions) = _run_loop(
+         kernel.signal, np.asarray(market.data, dtype=np.float64), start,
+         kernel.params(strategy), state, float(portfolio["cash"]),
+         float(portfolio["position"]), int(portfolio["trade_count"]),
+         int(market.order_count), float(market.fee_rate),
+         *(float(x) for x in actions), os.environ["TRADE_ENABLE"] == "1",
+         int(os.environ["ORDER_NUM_MAX"]), orders, len(open_orders),
+         np.empty((1024, 7)))
+
+    for row in events[:n_events]:
+        index, side, quantity, price, order_id, parent_id, ok = row
+        index, order_id, parent_id = int(index), int(order_id), int(parent_id)
+        side = "Buy" if side > 0 else "Sell"
+        market.hist["signals"][side].append((index, price))
+        if ok:
+            market.hist["execute_signals"][side].append((index, price))
+            market.ledger.append(index, BUY if side == "Buy" else SELL,
+                                 quantity, price,
+                                 quantity * market.fee_rate * price, order_id,
+                                 None if parent_id < 0 else parent_id)
+    market.hist["total_value_hist"].extend(values.tolist())
+    market.hist["total_pos_hist"].extend(positions.tolist())
+    portfolio["cash"] = cash
+    portfolio["position"] = position
+    portfolio["trade_count"] = int(trade_count)
+    portfolio["total_value"] = values[-1]
+    if next_id != market.order_count:
+        market.order_count = int(next_id)
+        market.last_order_id = market.order_count - 1
+    market._reset_orders()
+    for row in orders[:n_open]:
+        order_id, parent_id, side, quantity, price = row
+        market._add_order(
+            Order("Buy" if side > 0 else "Sell", quantity, price,
+                  int(order_id), None if parent_id < 0 else int(parent_id)))
+    market.set_current_index(len(market) - 1)
+    kernel.load_state(strategy, state)
+    strategy.dynamic["count"] = len(market)
+    return True
+
+
+def warm_kernel(strategy) -> bool:
+    """Compile the kernel loop of a strategy class in this process
+
+    Called by the worker processes of scheduler.CostAwareScheduler, so that
+    backtest(backend="auto") uses the kernel from the first task. The
+    compiled helper functions are cached on disk, the loop is compiled
+    again in every process as it takes the signal function as an argument.
+
+    Args:
+        strategy (Strategy): strategy, its parameters need not be set
+
+    Returns:
+        bool: True if the loop is compiled, False without numba or kernel
+    """
+    kernel = get_kernel(strategy)
+    if kernel is None or _numba() is None:
+        return False
+    if kernel.signal not in _warm:
+        # Same argument types as run_kernel(), on no prices
+        _run_loop(kernel.signal, np.empty(0), 0, np.zeros(8), np.zeros(16),
+                  0.0, 0.0, 0, 0, 0.0, 0.0, 0.0, 0.0, True, 0,
+                  np.empty((16, 5)), 0, np.empty((1024, 7)))
+    return True
+
+
+def macd_signal(price, params, state):
+    """MACDStrategy.generate_signals()
+
+    params: short_window, long_window, signal_window
+    state: started, price, emashort, emalong, macd, macd_old, signal_line,
+        signal_line_old, has_old
+    """
+    macd_old = state[4]
+    signal_old = state[6]
+    has_old = state[0] > 0
+    if not has_old:
+        emashort = emalong = price
+        macd = signal_line = 0.0
+    else:
+        alpha = 2 / (params[0] + 1.0)
+        emashort = alpha * price + (1 - alpha) * state[2]
+        alpha = 2 / (params[1] + 1.0)
+        emalong = alpha * price + (1 - alpha) * state[3]
+        macd = emashort - emalong
+        if macd_old == 0:
+            signal_line = macd
+        else:
+            alpha = 2 / (params[2] + 1.0)
+            signal_line = alpha * macd + (1 - alpha) * signal_old
+    state[0] = 1.0
+    state[1] = price
+    state[2] = emashort
+    state[3] = emalong
+    state[4] = macd
+    state[5] = macd_old
+    state[6] = signal_line
+    state[7] = signal_old
+    state[8] = 1.0 if has_old else 0.0
+    if has_old:
+        if macd_old <= signal_old and macd > signal_line:
+            return 1
+        if macd_old >= signal_old and macd < signal_line:
+            return 2
+    return 0
+
+
+class MACDKernel(StrategyKernel):
+    signal = staticmethod(macd_signal)
+
+    def params(self, strategy):
+        return np.array([
+            strategy.static["short_window"], strategy.static["long_window"],
+            strategy.static["signal_window"]
+        ], dtype=np.float64)
+
+    def state(self, strategy):
+        d = strategy.dynamic
+        state = np.zeros(9)
+        if d.prices is not None:
+            state[:5] = (1.0, d.prices, d.emashort_values, d.emalong_values,
+                         d.macd_values)
+            state[6] = d.signal_line_values
+        return state
+
+    def load_state(self, strategy, state):
+        d = strategy.dynamic
+        d.prices = state[1]
+        d.emashort_values = state[2]
+        d.emalong_values = state[3]
+        d.macd_values = state[4]
+        d.signal_line_values = state[6]
+        has_old = state[8] > 0
+        d.macd_values_old = state[5] if has_old else None
+        d.signal_line_values_old = state[7] if has_old else None
+
+    def actions(self, strategy):
+        quantity = strategy.static["one_order_quantity"]
+        return quantity, quantity, 0.0
+
+
+register_kernel(MACDStrategy, MACDKernel())
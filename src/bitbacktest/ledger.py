@@ -0,0 +1,185 @@
+"""Trade ledger and round-trip matching
+
+Executed fills are kept in a structured numpy array, so a backtest with
+hundreds of thousands of trades is analyzed with array operations.
+"""
+import numpy as np
+
+BUY = 1
+SELL = -1
+
+FILL_DTYPE = np.dtype([
+    ("index", np.int64),  # market index of the fill
+    ("side", np.int8),  # BUY or SELL
+    ("qty", np.float64),  # order quantity
+    ("price", np.float64),
+    ("fee", np.float64),  # fee in cash
+    ("order_id", np.int64),
+    ("parent_id", np.int64),  # order that caused this order, -1 if none
+])
+
+ROUND_TRIP_DTYPE = np.dtype([
+    ("entry_index", np.int64),
+    ("exit_index", np.int64),
+    ("qty", np.float64),
+    ("entry_price", np.float64),
+    ("exit_price", np.float64),
+    ("fee", np.float64),
+    ("pnl", np.float64),  # after fees
+    ("holding", np.int64),  # ticks between entry and exit
+    ("entry_id", np.int64),
+    ("exit_id", np.int64),
+])
+
+
+class TradeLedger:
+    """Growable array of fills
+
+    Args:
+        capacity (int, optional): initial number of rows. Defaults to 1024.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._data = np.zeros(capacity, dtype=FILL_DTYPE)
+        self._n = 0
+
+    @classmethod
+    def from_fills(cls, fills: np.ndarray):
+        """Create a ledger with the given FILL_DTYPE rows"""
+        ledger = cls(max(len(fills), 1))
+        ledger._data[:len(fills)] = fills
+        ledger._n = len(fills)
+        return ledger
+
+    def append(self,
+               index: int,
+               side: int,
+               qty: float,
+               price: float,
+               fee: float,
+               order_id: int,
+               parent_id: int = None):
+        if self._n == len(self._data):
+            data = np.zeros(max(len(self._data) * 2, 1), dtype=FILL_DTYPE)
+            data[:self._n] = self._data
+            self._data = data
+        self._data[self._n] = (index, side, qty, price, fee, order_id,
+                               -1 if parent_id is None else parent_id)
+        self._n += 1
+
+    def __len__(self) -> int:
+        return self._n
+
+    @property
+    def fills(self) -> np.ndarray:
+        """Fills in execution order, a view of FILL_DTYPE rows"""
+        return self._data[:self._n]
+
+
+def _round_trips(buys: np.ndarray, sells: np.ndarray, bi: np.ndarray,
+                 si: np.ndarray, qty: np.ndarray) -> np.ndarray:
+    trips = np.zeros(len(qty), dtype=ROUND_TRIP_DTYPE)
+    b = buys[bi]
+    s = sells[si]
+    trips["entry_index"] = b["index"]
+    trips["exit_index"] = s["index"]
+    trips["qty"] = qty
+    trips["entry_price"] = b["price"]
+    trips["exit_price"] = s["price"]
+    # Fees of partly matched fills are split by quantity
+    trips["fee"] = b["fee"] * qty / b["qty"] + s["fee"] * qty / s["qty"]
+    trips["pnl"] = qty * (s["price"] - b["price"]) - trips["fee"]
+    trips["holding"] = s["index"] - b["index"]
+    trips["entry_id"] = b["order_id"]
+    trips["exit_id"] = s["order_id"]
+    return trips
+
+
+def _match_fifo(buys: np.ndarray, sells: np.ndarray, start_position: float):
+    # Buy i covers [B[i-1], B[i]) of the cumulative bought quantity and
+    # sell j covers [S[j-1], S[j]) of the sold one. Every piece between
+    # two consecutive boundaries is one round trip. The start position is
+    # the oldest holding, so it is sold first and not matched.
+    bought = start_position + np.cumsum(buys["qty"])
+    sold = np.cumsum(sells["qty"])
+    total = min(bought[-1], sold[-1])
+    bounds = np.unique(np.concatenate(([start_position], bought, sold)))
+    bounds = bounds[(bounds >= start_position) & (bounds <= total)]
+    qty = np.diff(bounds)
+    mid = bounds[:-1] + qty / 2
+    bi = np.searchsorted(bought, mid, side="right")
+    si = np.searchsorted(sold, mid, side="right")
+    keep = qty > 1e-12
+    return bi[keep], si[keep], qty[keep]
+
+
+def _match_lifo(buys: np.ndarray, sells: np.ndarray, start_position: float):
+    bi, si, qty = [], [], []
+    # [buy row, remaining quantity], row -1 is the start position
+    stack = [[-1, start_position]] if start_position > 0 else []
+    b = 0
+    buy_index = buys["index"]
+    buy_qty = buys["qty"]
+    for j, (index, q) in enumerate(zip(sells["index"], sells["qty"])):
+        while b < len(buys) and buy_index[b] <= index:
+            stack.append([b, buy_qty[b]])
+            b += 1
+        while q > 1e-12 and stack:
+            top = stack[-1]
+            matched = min(q, top[1])
+            if top[0] >= 0:
+                bi.append(top[0])
+                si.append(j)
+                qty.append(matched)
+            q -= matched
+            top[1] -= matched
+            if top[1] <= 1e-12:
+                stack.pop()
+    return np.array(bi, dtype=np.int64), np.array(si, dtype=np.int64), \
+        np.array(qty, dtype=np.float64)
+
+
+def _match_linked(buys: np.ndarray, sells: np.ndarray):
+    order = np.argsort(buys["order_id"], kind="stable")
+    ids = buys["order_id"][order]
+    pos = np.searchsorted(ids, sells["parent_id"])
+    pos = np.minimum(pos, len(ids) - 1)
+    found = ids[pos] == sells["parent_id"]
+    si = np.nonzero(found)[0]
+    bi = order[pos[found]]
+    qty = np.minimum(buys["qty"][bi], sells["qty"][si])
+    return bi, si, qty
+
+
+def match_round_trips(fills: np.ndarray,
+                      method: str = "fifo",
+                      start_position: float = 0) -> np.ndarray:
+    """Match sells with buys into round trips
+
+    Args:
+        fills (np.ndarray): FILL_DTYPE rows in execution order, e.g. market.ledger.fills
+        method (str, optional): "fifo" closes the oldest open buy first,
+            "lifo" the newest one, "linked" matches each sell with the buy
+            of its "parent_id" (e.g. take-profit orders of the ForcusBuy
+            strategies). Defaults to "fifo".
+        start_position (float, optional): coin held before the first fill.
+            Sells of it are not matched by "fifo" and "lifo". Defaults to 0.
+            Sells must not exceed the open position (BacktestMarket rejects them).
+
+    Returns:
+        np.ndarray: ROUND_TRIP_DTYPE rows. Quantities are order quantities,
+            fees paid in coin are included in "fee" and "pnl".
+    """
+    buys = fills[fills["side"] == BUY]
+    sells = fills[fills["side"] == SELL]
+    if len(buys) == 0 or len(sells) == 0:
+        return np.zeros(0, dtype=ROUND_TRIP_DTYPE)
+    if method == "fifo":
+        bi, si, qty = _match_fifo(buys, sells, start_position)
+    elif method == "lifo":
+        bi, si, qty = _match_lifo(buys, sells, start_position)
+    elif method == "linked":
+        bi, si, qty = _match_linked(buys, sells)
+    else:
+        raise ValueError(f"Unknown method {method}")
+    return _round_trips(buys, sells, bi, si, qty)
@@ -1,30 +1,77 @@
 from abc import ABC, abstractmethod
 from typing import Literal
+import copy
+import heapq
 import numpy as np
 import json
-import requests
 import time
 import hashlib
 import hmac
 from datetime import datetime
 
+from .ledger import TradeLedger, BUY, SELL
+from .storage import HistoryBuffer, compact_prices
+
 
 class Order():
 
-    def __init__(self, side, quantity, price):
+    def __init__(self,
+                 side,
+                 quantity,
+                 price,
+                 order_id=None,
+                 parent_id=None,
+                 order_type: Literal["Limit", "Stop", "TrailingStop"] = "Limit",
+                 trail: float = None):
         self.side = side
         self.quantity = quantity
+        # Limit price, or trigger price of stop orders
         self.price = price
-        self.order_id = datetime.now().timestamp()
+        if order_id is None:
+            order_id = datetime.now().timestamp()
+        self.order_id = order_id
+        # Order that caused this order, e.g. the buy of a take-profit sell
+        self.parent_id = parent_id
+        self.order_type = order_type
+        # Trailing stops: distance from the best price as a ratio (0.02 is 2%)
+        self.trail = trail
+        self.extreme = None
+        # Other order of an OCO pair, cancelled when this order is filled
+        self.oco_id = None
+        # Incremented when "price" moves, older trigger entries are stale
+        self.version = 0
+
+    @property
+    def triggers_up(self) -> bool:
+        """True if the order triggers at price >= self.price, False if at price <= self.price"""
+        if self.order_type == "Limit":
+            return self.side == "Sell"
+        return self.side == "Buy"
+
+
+def _empty_history(value):
+    if isinstance(value, dict):
+        return {k: _empty_history(v) for k, v in value.items()}
+    return type(value)()
 
 
 class Market(ABC):
+    # True if prices are bars and resting orders are checked against the
+    # high and low of the bar before the signal on the close
+    bar_mode = False
+    # Attributes not included in snapshots, e.g. price data
+    _shared_attributes = ()
+    # Attributes emptied in snapshots without history
+    _history_attributes = ("hist", )
 
     def __init__(self):
         self.portfolio = {}
         self.hist = {}
         self.order = []
         self.index = 0
+        self.order_count = 0
+        # Id of the last placed order, e.g. to link a take-profit order to its buy
+        self.last_order_id = None
 
     @abstractmethod
     def get_current_price(self):
@@ -40,6 +87,8 @@ class Market(ABC):
             'position': start_coin,
             'total_value': start_cash
         }
+        # Used by metrics, e.g. the fees of the first tick
+        self.start_portfolio = dict(self.portfolio)
         self.hist = {
             "signals": {
                 "Buy": [],
@@ -54,6 +103,8 @@ class Market(ABC):
         }
         self.order = []
         self.index = 0
+        self.order_count = 0
+        self.last_order_id = None
 
     @abstractmethod
     def place_market_order(self, side: Literal['Buy', 'Sell'],
@@ -67,13 +118,71 @@ class Market(ABC):
         return True
 
     @abstractmethod
-    def place_limit_order(self, side: Literal['Buy', 'Sell'], quantity: float,
-                          price: float) -> bool:
+    def place_limit_order(self,
+                          side: Literal['Buy', 'Sell'],
+                          quantity: float,
+                          price: float,
+                          parent_id=None) -> bool:
         """
         Place a limit order
         :param side: Buy or Sell
         :param quantity: quantity of order
         :param price: price of order
+        :param parent_id: id of the order that caused this order
+        :return: True if success, False if failed
+        """
+        return True
+
+    @abstractmethod
+    def place_stop_order(self,
+                         side: Literal['Buy', 'Sell'],
+                         quantity: float,
+                         stop_price: float,
+                         parent_id=None) -> bool:
+        """
+        Place a stop order, executed at the market price when the price
+        falls to "stop_price" (Sell, e.g. stop-loss) or rises to it (Buy)
+        :param side: Buy or Sell
+        :param quantity: quantity of order
+        :param stop_price: trigger price
+        :param parent_id: id of the order that caused this order
+        :return: True if success, False if failed
+        """
+        return True
+
+    @abstractmethod
+    def place_trailing_stop_order(self,
+                                  side: Literal['Buy', 'Sell'],
+                                  quantity: float,
+                                  trail: float,
+                                  parent_id=None) -> bool:
+        """
+        Place a trailing stop order. A Sell triggers when the price falls
+        "trail" (e.g. 0.02 for 2%) below its highest price since the order
+        was placed, a Buy when it rises "trail" above the lowest price.
+        :param side: Buy or Sell
+        :param quantity: quantity of order
+        :param trail: distance from the best price as a ratio
+        :param parent_id: id of the order that caused this order
+        :return: True if success, False if failed
+        """
+        return True
+
+    @abstractmethod
+    def place_oco_order(self,
+                        side: Literal['Buy', 'Sell'],
+                        quantity: float,
+                        limit_price: float,
+                        stop_price: float,
+                        parent_id=None) -> bool:
+        """
+        Place a limit order and a stop order, one cancels the other.
+        e.g. take-profit and stop-loss of a position with side "Sell".
+        :param side: Buy or Sell
+        :param quantity: quantity of order
+        :param limit_price: price of the limit order
+        :param stop_price: trigger price of the stop order
+        :param parent_id: id of the order that caused these orders
         :return: True if success, False if failed
         """
         return True
@@ -94,6 +203,9 @@ class Market(ABC):
     def get_open_orders(self):
         return self.order
 
+    def open_order_count(self) -> int:
+        return len(self.get_open_orders())
+
     @abstractmethod
     def cancel_order(self, order_id: int) -> bool:
         """
@@ -103,6 +215,47 @@ class Market(ABC):
         """
         return True
 
+    def fork(self):
+        """Create an independent copy of the market
+        Immutable data (e.g. price data) is shared and only the mutable
+        state (portfolio, history and orders) is copied.
+
+        Returns:
+            Market: forked market
+        """
+        market = copy.copy(self)
+        market.portfolio = copy.deepcopy(self.portfolio)
+        market.hist = copy.deepcopy(self.hist)
+        market.order = copy.deepcopy(self.order)
+        return market
+
+    def snapshot(self, history: bool = True) -> dict:
+        """Copy of the mutable state (portfolio, orders and history)
+
+        Args:
+            history (bool, optional): include the history. Defaults to True.
+
+        Returns:
+            dict: state, set by restore()
+        """
+        state = {}
+        for k, v in self.__dict__.items():
+            if k in self._shared_attributes:
+                continue
+            if not history and k in self._history_attributes:
+                v = _empty_history(v)
+            state[k] = copy.deepcopy(v)
+        return state
+
+    def restore(self, state: dict):
+        """Set the state saved by snapshot()"""
+        self.__dict__.update(copy.deepcopy(state))
+
+    def _next_order_id(self) -> int:
+        self.last_order_id = self.order_count
+        self.order_count += 1
+        return self.last_order_id
+
     def save_history(self, price: float):
         self.portfolio['total_value'] = self.portfolio[
             'cash'] + self.portfolio['position'] * price
@@ -111,35 +264,186 @@ class Market(ABC):
 
 
 class BacktestMarket(Market):
-
-    def __init__(self, data: np.ndarray, fee_rate: float = 0.0015):
+    """Market of a backtest on price data
+
+    Open orders are kept by id in placement order. Their trigger prices are
+    indexed by two heaps: orders that trigger when the price rises to their
+    price (limit sells, stop buys) and orders that trigger when it falls to
+    it (limit buys, stop sells). check_order() pops only the crossed orders,
+    so the cost per tick does not grow with the number of open orders.
+    Cancelled or moved orders leave stale heap entries that are skipped when
+    popped.
+
+    With "high" and "low" the market runs in bar mode: "data" is the close
+    of each bar, signals and market orders use the close, and orders resting
+    from previous bars are filled at their own price (or the open if the bar
+    gaps over it) when the bar's intrabar path crosses them.
+
+    Args:
+        data (np.ndarray): prices, or close prices of bars
+        fee_rate (float, optional): fee rate, paid in coin. Defaults to 0.0015.
+        high (np.ndarray, optional): high prices of bars
+        low (np.ndarray, optional): low prices of bars
+        open (np.ndarray, optional): open prices of bars. Defaults to the previous close.
+        intrabar (str, optional): assumed path within a bar, "ohlc"
+            (open, high, low, close), "olhc", or "auto" (low first for a bar
+            that closes above its open, high first otherwise). Defaults to "auto".
+        compact (bool, optional): keep prices in int32 or float32 (see
+            storage.compact_prices) and "total_value_hist" / "total_pos_hist"
+            in float32. Prices are read as float64, so the portfolio is
+            computed as without it. Defaults to False.
+    """
+    _shared_attributes = ("data", "high", "low", "open")
+    _history_attributes = ("hist", "ledger")
+
+    def __init__(self,
+                 data: np.ndarray,
+                 fee_rate: float = 0.0015,
+                 high: np.ndarray = None,
+                 low: np.ndarray = None,
+                 open: np.ndarray = None,
+                 intrabar: Literal["ohlc", "olhc", "auto"] = "auto",
+                 compact: bool = False):
         super().__init__()
         self.data = data
         self.index = 0
         self.fee_rate = fee_rate
+        self.bar_mode = high is not None
+        if self.bar_mode:
+            if low is None or len(high) != len(data) or len(low) != len(data):
+                raise ValueError("high and low must have the length of data")
+            if intrabar not in ("ohlc", "olhc", "auto"):
+                raise ValueError(f"Unknown intrabar path {intrabar}")
+            if open is None:
+                open = np.concatenate((data[:1], data[:-1]))
+        self.compact = compact
+        if compact:
+            data = compact_prices(data)
+            if self.bar_mode:
+                # One dtype for the whole bar
+                bars = np.concatenate((data, high, low, open))
+                dtype = compact_prices(bars).dtype
+                data, high, low, open = (compact_prices(x, dtype)
+                                         for x in (data, high, low, open))
+            self.data = data
+        self.high = high
+        self.low = low
+        self.open = open
+        self.intrabar = intrabar
+        self._reset_orders()
+
+    @classmethod
+    def from_ohlc(cls,
+                  ohlc,
+                  fee_rate: float = 0.0015,
+                  intrabar: Literal["ohlc", "olhc", "auto"] = "auto",
+                  compact: bool = False):
+        """Create a bar mode market
+
+        Args:
+            ohlc: (n, 4) array of open, high, low and close, or a DataFrame with those columns
+            fee_rate (float, optional): fee rate. Defaults to 0.0015.
+            intrabar (str, optional): see BacktestMarket. Defaults to "auto".
+            compact (bool, optional): see BacktestMarket. Defaults to False.
+
+        Returns:
+            BacktestMarket: market
+        """
+        if hasattr(ohlc, "columns"):
+            columns = [ohlc[k].to_numpy(dtype=np.float64)
+                       for k in ("open", "high", "low", "close")]
+        else:
+            ohlc = np.asarray(ohlc, dtype=np.float64)
+            columns = [ohlc[:, i] for i in range(4)]
+        return cls(columns[3],
+                   fee_rate,
+                   high=columns[1],
+                   low=columns[2],
+                   open=columns[0],
+                   intrabar=intrabar,
+                   compact=compact)
+
+    def _reset_orders(self):
+        self.order = {}
+        # (price, order id, version), "_down" and "_troughs" with negated price
+        self._up = []
+        self._down = []
+        # Best price of trailing stops, sells by lowest peak, buys by highest trough
+        self._peaks = []
+        self._troughs = []
+
+    def fork(self, data: np.ndarray = None):
+        """Create an independent copy of the market
+
+        Args:
+            data (np.ndarray, optional): price data of the fork, e.g. a prefix
+                or decimated view of "self.data". Defaults to the same data.
+                Not supported in bar mode.
+
+        Returns:
+            BacktestMarket: forked market
+        """
+        if data is not None and self.bar_mode:
+            raise ValueError("data of a bar mode market can not be replaced")
+        market = super().fork()
+        if hasattr(self, "ledger"):
+            market.ledger = copy.deepcopy(self.ledger)
+        for name in ("_up", "_down", "_peaks", "_troughs"):
+            setattr(market, name, list(getattr(self, name)))
+        if data is not None:
+            market.data = compact_prices(data, self.data.dtype) \
+                if self.compact else data
+        return market
+
+    def snapshot(self, history: bool = True) -> dict:
+        state = super().snapshot(history)
+        if self.index < len(self.data):
+            # Checked by restore() to find a market with other data
+            state["_last_price"] = self.data[self.index]
+        return state
+
+    def restore(self, state: dict):
+        state = dict(state)
+        last_price = state.pop("_last_price", None)
+        if last_price is not None and (
+                state["index"] >= len(self.data) or
+                self.data[state["index"]] != last_price):
+            raise ValueError("The market data does not extend the snapshot")
+        super().restore(state)
+
+    def reset_portfolio(self, start_cash: float, start_coin: float):
+        super().reset_portfolio(start_cash, start_coin)
+        if self.compact:
+            self.hist["total_value_hist"] = HistoryBuffer()
+            self.hist["total_pos_hist"] = HistoryBuffer()
+        self._reset_orders()
+        # Executed fills, see ledger.match_round_trips()
+        self.ledger = TradeLedger()
 
     def set_current_index(self, index: int):
         self.index = index
 
     def get_current_price(self):
+        if self.compact:
+            return np.float64(self.data[self.index])
         return self.data[self.index]
 
     def get_price_hist(self):
+        if self.compact:
+            return self.data[:self.index].astype(np.float64)
         return self.data[:self.index]
 
     def __len__(self):
         return len(self.data)
 
     def get_open_orders(self):
-        return self.order
+        return list(self.order.values())
+
+    def open_order_count(self) -> int:
+        return len(self.order)
 
     def cancel_order(self, order_id: int) -> bool:
-        orders = self.get_open_orders()
-        for order in orders:
-            if order.order_id == order_id:
-                self.order.remove(order)
-                return True
-        return False
+        return self.order.pop(order_id, None) is not None
 
     def _execute_buy_order(self, quantity: float, price: float) -> bool:
         if self.portfolio['cash'] >= quantity * price:
@@ -161,9 +465,14 @@ class BacktestMarket(Market):
         else:
             return False  # Insufficient funds
 
-    def place_market_order(self, side: Literal['Buy', 'Sell'],
-                           quantity: float) -> bool:
-        price = self.get_current_price()
+    def _fill(self,
+              side: Literal['Buy', 'Sell'],
+              quantity: float,
+              order_id: int,
+              parent_id: int = None,
+              price: float = None) -> bool:
+        if price is None:
+            price = self.get_current_price()
         self.hist["signals"][side].append((self.index, price))
         if side == 'Buy':
             ret = self._execute_buy_order(quantity, price)
@@ -173,23 +482,194 @@ class BacktestMarket(Market):
             ret = False
         if ret:
             self.hist["execute_signals"][side].append((self.index, price))
+            # The fee is paid in coin, recorded in cash
+            self.ledger.append(self.index, BUY if side == 'Buy' else SELL,
+                               quantity, price,
+                               quantity * self.fee_rate * price, order_id,
+                               parent_id)
         return ret
 
-    def place_limit_order(self, side: Literal['Buy', 'Sell'], quantity: float,
-                          price: float) -> bool:
-        self.order.append(Order(side, quantity, price))
+    def place_market_order(self, side: Literal['Buy', 'Sell'],
+                           quantity: float) -> bool:
+        return self._fill(side, quantity, self._next_order_id())
+
+    def _add_order(self, order: Order):
+        self.order[order.order_id] = order
+        self._push_trigger(order)
+
+    def _push_trigger(self, order: Order):
+        entry = (order.price, order.order_id, order.version)
+        if order.triggers_up:
+            heapq.heappush(self._up, entry)
+        else:
+            heapq.heappush(self._down, (-order.price, ) + entry[1:])
+        # Moved trailing stops and cancelled orders leave stale entries
+        if len(self._up) + len(self._down) > 2 * len(self.order) + 16:
+            self._compact_triggers()
+
+    def _compact_triggers(self):
+        """Drop the entries of cancelled, filled or moved orders from the heaps"""
+        for name in ("_up", "_down", "_peaks", "_troughs"):
+            heap = [entry for entry in getattr(self, name)
+                    if self._is_live(entry[1], entry[2])]
+            heapq.heapify(heap)
+            setattr(self, name, heap)
+
+    def _is_live(self, order_id, version) -> bool:
+        order = self.order.get(order_id)
+        return order is not None and order.version == version
+
+    def place_limit_order(self,
+                          side: Literal['Buy', 'Sell'],
+                          quantity: float,
+                          price: float,
+                          parent_id=None) -> bool:
+        self._add_order(
+            Order(side, quantity, price, self._next_order_id(), parent_id))
+        return True
+
+    def place_stop_order(self,
+                         side: Literal['Buy', 'Sell'],
+                         quantity: float,
+                         stop_price: float,
+                         parent_id=None) -> bool:
+        self._add_order(
+            Order(side, quantity, stop_price, self._next_order_id(),
+                  parent_id, "Stop"))
         return True
 
+    def place_trailing_stop_order(self,
+                                  side: Literal['Buy', 'Sell'],
+                                  quantity: float,
+                                  trail: float,
+                                  parent_id=None) -> bool:
+        price = self.get_current_price()
+        order = Order(side, quantity, None, self._next_order_id(), parent_id,
+                      "TrailingStop", trail)
+        self.order[order.order_id] = order
+        self._move_trailing(order, price)
+        return True
+
+    def place_oco_order(self,
+                        side: Literal['Buy', 'Sell'],
+                        quantity: float,
+                        limit_price: float,
+                        stop_price: float,
+                        parent_id=None) -> bool:
+        # "last_order_id" is the id of the stop order
+        limit = Order(side, quantity, limit_price, self._next_order_id(),
+                      parent_id)
+        stop = Order(side, quantity, stop_price, self._next_order_id(),
+                     parent_id, "Stop")
+        limit.oco_id = stop.order_id
+        stop.oco_id = limit.order_id
+        self._add_order(limit)
+        self._add_order(stop)
+        return True
+
+    def _move_trailing(self, order: Order, price: float):
+        order.extreme = price
+        order.version += 1
+        if order.side == "Sell":
+            order.price = price * (1 - order.trail)
+            heapq.heappush(self._peaks, (price, order.order_id, order.version))
+        else:
+            order.price = price * (1 + order.trail)
+            heapq.heappush(self._troughs,
+                           (-price, order.order_id, order.version))
+        self._push_trigger(order)
+
+    def _update_trailing(self, price: float):
+        # Only trailing stops whose best price was passed are moved
+        while self._peaks and self._peaks[0][0] < price:
+            _, order_id, version = heapq.heappop(self._peaks)
+            if self._is_live(order_id, version):
+                self._move_trailing(self.order[order_id], price)
+        while self._troughs and -self._troughs[0][0] > price:
+            _, order_id, version = heapq.heappop(self._troughs)
+            if self._is_live(order_id, version):
+                self._move_trailing(self.order[order_id], price)
+
+    def _pop_crossed(self, price: float) -> list:
+        crossed = []
+        while self._up and self._up[0][0] <= price:
+            crossed.append(heapq.heappop(self._up))
+        while self._down and -self._down[0][0] >= price:
+            crossed.append(heapq.heappop(self._down))
+        return [
+            self.order[order_id] for _, order_id, version in crossed
+            if self._is_live(order_id, version)
+        ]
+
+    def _execute_orders(self, orders: list, prices: list) -> list:
+        """Fill triggered orders
+
+        Returns:
+            list: orders that could not be filled
+        """
+        failed = []
+        for order, price in zip(orders, prices):
+            if order.order_id not in self.order:
+                continue  # Cancelled by its OCO pair
+            if self._fill(order.side, order.quantity, order.order_id,
+                          order.parent_id, price):
+                del self.order[order.order_id]
+                if order.oco_id is not None:
+                    self.cancel_order(order.oco_id)
+            else:
+                failed.append(order)
+        return failed
+
     def check_order(self):
+        if self.bar_mode:
+            return self._check_bar()
         price = self.get_current_price()
-        for order in self.order:
-            if (order.side == "Sell" and price >= order.price) or \
-               (order.side == "Buy" and price <= order.price):
-                if self.place_market_order(order.side, order.quantity):
-                    self.order.remove(order)
+        self._update_trailing(price)
+        orders = self._pop_crossed(price)
+        # Fill in placement order, as the cash and position are shared
+        orders.sort(key=lambda order: order.order_id)
+        for order in self._execute_orders(orders, [None] * len(orders)):
+            # Stays open and is tried again on the next tick
+            self._push_trigger(order)
+
+    def _intrabar_path(self, index: int) -> tuple:
+        o, h, l, c = (self.open[index], self.high[index], self.low[index],
+                      self.data[index])
+        if self.compact:
+            o, h, l, c = (np.float64(x) for x in (o, h, l, c))
+        if self.intrabar == "ohlc" or (self.intrabar == "auto" and c < o):
+            return (o, h, l, c)
+        return (o, l, h, c)
+
+    def _check_bar(self):
+        # Walk the path of the bar. Orders crossed between two points are
+        # filled at their own price, or at the start point if it was already
+        # beyond their price (e.g. a gap at the open), in crossing order.
+        failed = []
+        path = self._intrabar_path(self.index)
+        start = path[0]
+        for point in path:
+            orders = self._pop_crossed(point)
+            prices = [
+                max(order.price, start) if order.triggers_up else min(
+                    order.price, start) for order in orders
+            ]
+            order_index = sorted(
+                range(len(orders)),
+                key=lambda i: (abs(prices[i] - start), orders[i].order_id))
+            failed += self._execute_orders([orders[i] for i in order_index],
+                                           [prices[i] for i in order_index])
+            self._update_trailing(point)
+            start = point
+        for order in failed:
+            self._push_trigger(order)
 
 
 class BitflyerMarket(Market):
+    _shared_attributes = ("apikey", "secret")
+    # HTTP session shared by all instances, its connections are kept alive
+    # between the invocations of a warm Lambda container
+    _session = None
 
     def __init__(self):
         super().__init__()
@@ -202,6 +682,15 @@ class BitflyerMarket(Market):
         self.apikey = apikey
         self.secret = secret
 
+    @property
+    def session(self):
+        """HTTP session with pooled connections"""
+        if BitflyerMarket._session is None:
+            # Imported on first use, backtests do not need it
+            import requests
+            BitflyerMarket._session = requests.Session()
+        return BitflyerMarket._session
+
     def place_market_order(self, side, quantity):
         # 成行注文を出す
         if self.apikey is None or self.secret is None:
@@ -220,14 +709,18 @@ class BitflyerMarket(Market):
         body = json.dumps(order_data)
         headers = self.header('POST', endpoint=endpoint, body=body)
 
-        res = requests.post(order_url, headers=headers, data=body)
-        if 'child_order_acceptance_id' in res.json():
+        res = self.session.post(order_url, headers=headers, data=body).json()
+        if 'child_order_acceptance_id' in res:
+            self.last_order_id = res['child_order_acceptance_id']
             return True
         else:
             return False
 
-    def place_limit_order(self, side: Literal['Buy', 'Sell'], quantity: float,
-                          price: float):
+    def place_limit_order(self,
+                          side: Literal['Buy', 'Sell'],
+                          quantity: float,
+                          price: float,
+                          parent_id=None):
         if self.apikey is None or self.secret is None:
             raise ValueError(
                 "API key and secret must be set before placing an order.")
@@ -246,12 +739,83 @@ class BitflyerMarket(Market):
         body = json.dumps(order_data)
         headers = self.header('POST', endpoint=endpoint, body=body)
 
-        res = requests.post(order_url, headers=headers, data=body)
-        if 'child_order_acceptance_id' in res.json():
+        res = self.session.post(order_url, headers=headers, data=body).json()
+        if 'child_order_acceptance_id' in res:
+            self.last_order_id = res['child_order_acceptance_id']
+            return True
+        else:
+            return False
+
+    def _send_parent_order(self, order_method: str, parameters: list):
+        # 特殊注文を出す
+        if self.apikey is None or self.secret is None:
+            raise ValueError(
+                "API key and secret must be set before placing an order.")
+
+        endpoint = '/v1/me/sendparentorder'
+        order_url = self.API_URL + endpoint
+
+        order_data = {
+            'order_method': order_method,
+            'time_in_force': 'GTC',
+            'parameters': [
+                dict(product_code=self.product_code, **p) for p in parameters
+            ],
+        }
+        body = json.dumps(order_data)
+        headers = self.header('POST', endpoint=endpoint, body=body)
+
+        res = self.session.post(order_url, headers=headers, data=body).json()
+        if 'parent_order_acceptance_id' in res:
+            self.last_order_id = res['parent_order_acceptance_id']
             return True
         else:
             return False
 
+    def place_stop_order(self,
+                         side: Literal['Buy', 'Sell'],
+                         quantity: float,
+                         stop_price: float,
+                         parent_id=None):
+        return self._send_parent_order('SIMPLE', [{
+            'condition_type': 'STOP',
+            'side': side.upper(),
+            'trigger_price': int(stop_price),
+            'size': quantity,
+        }])
+
+    def place_trailing_stop_order(self,
+                                  side: Literal['Buy', 'Sell'],
+                                  quantity: float,
+                                  trail: float,
+                                  parent_id=None):
+        # bitFlyer takes the trail as a price distance
+        offset = int(self.get_current_price() * trail)
+        return self._send_parent_order('SIMPLE', [{
+            'condition_type': 'TRAIL',
+            'side': side.upper(),
+            'offset': max(offset, 1),
+            'size': quantity,
+        }])
+
+    def place_oco_order(self,
+                        side: Literal['Buy', 'Sell'],
+                        quantity: float,
+                        limit_price: float,
+                        stop_price: float,
+                        parent_id=None):
+        return self._send_parent_order('OCO', [{
+            'condition_type': 'LIMIT',
+            'side': side.upper(),
+            'price': int(limit_price),
+            'size': quantity,
+        }, {
+            'condition_type': 'STOP',
+            'side': side.upper(),
+            'trigger_price': int(stop_price),
+            'size': quantity,
+        }])
+
     def cancel_order(self, order_id: int):
         return True
 
@@ -288,15 +852,15 @@ class BitflyerMarket(Market):
 
         headers = self.header('GET', endpoint=endpoint_for_header, body="")
 
-        response = requests.get(self.API_URL + endpoint,
-                                headers=headers,
-                                params=params)
+        response = self.session.get(self.API_URL + endpoint,
+                                    headers=headers,
+                                    params=params)
         orders = response.json()
         return orders
 
     def get_current_price(self):
         # 現在の市場価格を取得
         ticker_url = f'{self.API_URL}/v1/ticker?product_code={self.product_code}'
-        response = requests.get(ticker_url)
+        response = self.session.get(ticker_url)
         price = float(response.json()['ltp'])
         return price
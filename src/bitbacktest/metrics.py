@@ -0,0 +1,204 @@
+"""Performance metrics computed from the backtest history
+
+All metrics are computed with numpy over the history arrays kept by the
+market ("total_value_hist", "total_pos_hist" and the price data), so no
+backtest is re-run. Intermediate arrays (returns, cash, trades) are
+computed once on first use and shared by the requested metrics.
+"""
+from functools import cached_property
+
+import numpy as np
+
+
+class History:
+    """Arrays of a finished (or pruned) backtest
+
+    Args:
+        values (np.ndarray): total value of every tick
+        positions (np.ndarray): position of every tick
+        prices (np.ndarray): price of every tick
+        start_cash (float): cash before the first tick
+        start_position (float): position before the first tick
+    """
+
+    def __init__(self, values, positions, prices, start_cash: float,
+                 start_position: float):
+        self.values = np.asarray(values, dtype=np.float64)
+        self.positions = np.asarray(positions, dtype=np.float64)
+        self.prices = np.asarray(prices, dtype=np.float64)[:len(self.values)]
+        self.start_cash = start_cash
+        self.start_position = start_position
+
+    @classmethod
+    def from_market(cls, market):
+        hist = market.hist
+        n = len(hist["total_value_hist"])
+        if "price_hist" in hist:
+            prices = hist["price_hist"]
+        else:
+            prices = market.data[:n]
+        start = getattr(market, "start_portfolio", None) or {
+            "cash": market.portfolio["cash"],
+            "position": market.portfolio["position"]
+        }
+        return cls(hist["total_value_hist"], hist["total_pos_hist"], prices,
+                   start["cash"], start["position"])
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @cached_property
+    def start_value(self) -> float:
+        price = self.prices[0] if len(self.prices) else 0.0
+        return self.start_cash + self.start_position * price
+
+    @cached_property
+    def returns(self) -> np.ndarray:
+        """Per-tick returns, the first one against the start value"""
+        previous = np.concatenate(([self.start_value], self.values[:-1]))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            returns = self.values / previous - 1
+        return np.nan_to_num(returns, nan=0.0, posinf=0.0, neginf=0.0)
+
+    @cached_property
+    def cash(self) -> np.ndarray:
+        return self.values - self.positions * self.prices
+
+    @cached_property
+    def cash_change(self) -> np.ndarray:
+        return np.diff(self.cash, prepend=self.start_cash)
+
+    @cached_property
+    def position_change(self) -> np.ndarray:
+        return np.diff(self.positions, prepend=self.start_position)
+
+    @cached_property
+    def peaks(self) -> np.ndarray:
+        # The start value is the first peak
+        return np.maximum.accumulate(np.maximum(self.values, self.start_value))
+
+
+def max_drawdown(h: History) -> float:
+    """Largest fall from a peak of total value, as a ratio (0.2 is 20%)"""
+    if len(h) == 0:
+        return 0.0
+    return float(np.max(1 - h.values / h.peaks))
+
+
+def drawdown_duration(h: History) -> int:
+    """Longest number of ticks below a previous peak (or the start value)"""
+    if len(h) == 0:
+        return 0
+    index = np.arange(len(h))
+    peak_index = np.maximum.accumulate(
+        np.where(h.values >= h.peaks, index, -1))
+    return int(np.max(index - peak_index))
+
+
+def sharpe(h: History, periods_per_year: float = 1) -> float:
+    """Mean over standard deviation of per-tick returns, annualized by periods_per_year"""
+    std = np.std(h.returns)
+    if len(h) == 0 or std == 0:
+        return 0.0
+    return float(np.mean(h.returns) / std * np.sqrt(periods_per_year))
+
+
+def sortino(h: History, periods_per_year: float = 1) -> float:
+    """Mean over downside deviation of per-tick returns, annualized by periods_per_year"""
+    downside = np.sqrt(np.mean(np.minimum(h.returns, 0)**2)) if len(h) else 0
+    if downside == 0:
+        return 0.0
+    return float(np.mean(h.returns) / downside * np.sqrt(periods_per_year))
+
+
+def exposure(h: History) -> float:
+    """Average ratio of the value held as coin"""
+    if len(h) == 0:
+        return 0.0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = h.positions * h.prices / h.values
+    return float(np.mean(np.nan_to_num(ratio)))
+
+
+def turnover(h: History) -> float:
+    """Traded amount in cash over the start value"""
+    if len(h) == 0 or h.start_value == 0:
+        return 0.0
+    return float(np.sum(np.abs(h.cash_change)) / h.start_value)
+
+
+def fee_drag(h: History) -> float:
+    """Paid fees over the start value
+    BacktestMarket pays fees in coin, so the fee of a tick is the value
+    lost by its trades: -(position change * price + cash change).
+    """
+    if len(h) == 0 or h.start_value == 0:
+        return 0.0
+    fees = -(h.position_change * h.prices + h.cash_change)
+    return float(np.sum(np.maximum(fees, 0)) / h.start_value)
+
+
+METRICS = {
+    "max_drawdown": max_drawdown,
+    "drawdown_duration": drawdown_duration,
+    "sharpe": sharpe,
+    "sortino": sortino,
+    "exposure": exposure,
+    "turnover": turnover,
+    "fee_drag": fee_drag,
+}
+# Metrics scaled by the number of periods per year
+ANNUALIZED = {"sharpe", "sortino"}
+
+
+class Metrics:
+    """Selected metrics of a backtest
+
+    example,
+        metrics = Metrics(["max_drawdown", "sharpe"], periods_per_year=365 * 24 * 60)
+        result = strategy.backtest(metrics=metrics)
+        result["sharpe"]
+
+    Args:
+        names (list, optional): names in METRICS. Defaults to all.
+        periods_per_year (float, optional): ticks per year for sharpe and sortino. Defaults to 1 (not annualized).
+    """
+
+    def __init__(self, names: list = None, periods_per_year: float = 1):
+        self.names = list(names) if names is not None else list(METRICS)
+        for name in self.names:
+            if name not in METRICS:
+                raise ValueError(f"Unknown metric {name}")
+        self.periods_per_year = periods_per_year
+
+    def compute(self, market) -> dict:
+        """Compute the metrics from the history of the market
+
+        Returns:
+            dict: metric name and value
+        """
+        return self.compute_history(History.from_market(market))
+
+    def compute_history(self, history: History) -> dict:
+        result = {}
+        for name in self.names:
+            if name in ANNUALIZED:
+                result[name] = METRICS[name](history, self.periods_per_year)
+            else:
+                result[name] = METRICS[name](history)
+        return result
+
+
+def compute_metrics(market, names: list = None,
+                    periods_per_year: float = 1) -> dict:
+    """Compute metrics from the history of a finished backtest
+
+    Args:
+        market (Market): market used by the backtest
+        names (list, optional): names in METRICS. Defaults to all.
+        periods_per_year (float, optional): ticks per year for sharpe and sortino. Defaults to 1.
+
+    Returns:
+        dict: metric name and value
+    """
+    return Metrics(names, periods_per_year).compute(market)
@@ -0,0 +1,144 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+
+class PruneRule(ABC):
+    """Rule to stop a hopeless backtest early"""
+
+    def start(self):
+        """Reset the per-run state. Called before each backtest."""
+        pass
+
+    @abstractmethod
+    def check(self, index: int, values: np.ndarray, pruner, market) -> str:
+        """Check the run
+
+        Args:
+            index (int): current index of the market
+            values (np.ndarray): total values since the previous check
+            pruner (Pruner): pruner, holds the start value and the best curve
+            market (Market): market
+
+        Returns:
+            str: reason to prune, or None to continue
+        """
+        return None
+
+
+class MaxDrawdownRule(PruneRule):
+    """Prune if total value fell more than "max_drawdown" (e.g. 0.4) from its peak"""
+
+    def __init__(self, max_drawdown: float):
+        self.max_drawdown = max_drawdown
+
+    def start(self):
+        self.peak = -np.inf
+
+    def check(self, index, values, pruner, market):
+        peaks = np.maximum.accumulate(np.append(self.peak, values))[1:]
+        self.peak = peaks[-1]
+        drawdown = np.max(1 - values / peaks)
+        if drawdown > self.max_drawdown:
+            return f"drawdown {drawdown:.1%}"
+        return None
+
+
+class MinEquityRule(PruneRule):
+    """Prune if total value fell below "min_ratio" of the start value"""
+
+    def __init__(self, min_ratio: float):
+        self.min_ratio = min_ratio
+
+    def check(self, index, values, pruner, market):
+        value = values[-1]
+        if value < pruner.start_value * self.min_ratio:
+            return f"equity {value / pruner.start_value:.1%} of start"
+        return None
+
+
+class MaxTradeCountRule(PruneRule):
+    """Prune if more than "max_trades" trades were executed"""
+
+    def __init__(self, max_trades: int):
+        self.max_trades = max_trades
+
+    def check(self, index, values, pruner, market):
+        trade_count = market.portfolio["trade_count"]
+        if trade_count > self.max_trades:
+            return f"trade_count {trade_count}"
+        return None
+
+
+class BehindBestRule(PruneRule):
+    """Prune if total value is more than "max_behind" (e.g. 0.1) below the
+    best finished run at the same index"""
+
+    def __init__(self, max_behind: float):
+        self.max_behind = max_behind
+
+    def check(self, index, values, pruner, market):
+        best = pruner.best_curve
+        if best is None or index >= len(best):
+            return None
+        value = values[-1]
+        if value < best[index] * (1 - self.max_behind):
+            return f"{1 - value / best[index]:.1%} behind best"
+        return None
+
+
+class Pruner:
+    """Early termination of backtests for sweeps
+
+    Strategy.backtest(pruner=...) calls check() every "interval" ticks and
+    stops the backtest when a rule fires. The result is the partial
+    portfolio with "pruned", "pruned_at" and "prune_reason" keys.
+    GridBacktester passes the value history of the best finished run to
+    update_best() for BehindBestRule.
+
+    Args:
+        rules (list): PruneRule list
+        interval (int, optional): ticks between checks. Defaults to 1000.
+        warmup (int, optional): no check before this index. Defaults to 0.
+    """
+
+    def __init__(self, rules: list, interval: int = 1000, warmup: int = 0):
+        self.rules = rules
+        self.interval = interval
+        self.warmup = warmup
+        self.best_curve = None
+        self.best_value = -np.inf
+
+    def start(self, market):
+        """Reset the per-run state. Called at the start of a backtest."""
+        self.start_value = None
+        self._checked = 0
+        for rule in self.rules:
+            rule.start()
+
+    def check(self, market) -> str:
+        """Check all rules
+
+        Returns:
+            str: reason to prune, or None to continue
+        """
+        hist = market.hist["total_value_hist"]
+        if self.start_value is None:
+            self.start_value = hist[0]
+        index = len(hist) - 1
+        values = np.asarray(hist[self._checked:], dtype=np.float64)
+        self._checked = len(hist)
+        if len(values) == 0:
+            return None
+        for rule in self.rules:
+            # Rules always see the values to keep their state (e.g. peak)
+            reason = rule.check(index, values, self, market)
+            if reason is not None and index >= self.warmup:
+                return reason
+        return None
+
+    def update_best(self, value_hist):
+        """Keep the value history of the best finished run"""
+        if len(value_hist) > 0 and value_hist[-1] > self.best_value:
+            self.best_value = value_hist[-1]
+            self.best_curve = np.asarray(value_hist, dtype=np.float64)
@@ -0,0 +1,233 @@
+import glob
+import hashlib
+import heapq
+import itertools
+import json
+import os
+
+import numpy as np
+
+
+def _pyarrow():
+    # Imported when a sink is used, None if it is not installed
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def _json_default(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Type {type(obj)} is not JSON serializable")
+
+
+def param_key(param: dict) -> str:
+    """Canonical string of a parameter set"""
+    return json.dumps(param, sort_keys=True, default=_json_default)
+
+
+def param_hash(param: dict) -> int:
+    """64 bit hash of a parameter set, used to find finished runs"""
+    digest = hashlib.blake2b(param_key(param).encode("utf-8"),
+                             digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+class TopKResults:
+    """Bounded heap that keeps the best k runs by a metric
+
+    Args:
+        k (int): number of runs to keep
+        metric (str, optional): key of the result to rank by. Defaults to "total_value".
+        maximize (bool, optional): keep the largest values. Defaults to True.
+    """
+
+    def __init__(self, k: int, metric: str = "total_value",
+                 maximize: bool = True):
+        self.k = k
+        self.metric = metric
+        self.maximize = maximize
+        self._heap = []
+        self._counter = itertools.count()
+
+    def push(self, param: dict, result: dict) -> bool:
+        """Add a run
+
+        Returns:
+            bool: True if the run is kept
+        """
+        value = result[self.metric]
+        score = value if self.maximize else -value
+        # The counter keeps the order stable and avoids comparing dicts
+        item = (score, -next(self._counter), param, result)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, item)
+            return True
+        if score > self._heap[0][0]:
+            heapq.heapreplace(self._heap, item)
+            return True
+        return False
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def items(self) -> list:
+        """Kept runs, best first
+
+        Returns:
+            list: list of (param, result)
+        """
+        return [(p, r) for _, _, p, r in sorted(self._heap, reverse=True)]
+
+
+class ResultSink:
+    """Append-only columnar store of sweep results
+
+    Rows are buffered and written in batches, one file per batch, as
+    Parquet if pyarrow is installed and as ".npz" (one ".npy" array per
+    column) otherwise. Batch files are written atomically, so an
+    interrupted sweep leaves only complete batches and can be resumed by
+    skipping the parameter sets returned by completed().
+
+    Args:
+        path (str): directory of the batch files
+        batch_size (int, optional): number of rows per batch file. Defaults to 1000.
+        format (str, optional): "parquet" or "npz". Defaults to "parquet" if pyarrow is installed.
+    """
+
+    def __init__(self, path: str, batch_size: int = 1000, format: str = None):
+        if format is None:
+            format = "parquet" if _pyarrow() is not None else "npz"
+        if format == "parquet" and _pyarrow() is None:
+            raise ImportError("pyarrow is required for the parquet format")
+        self.path = path
+        self.batch_size = batch_size
+        self.format = format
+        self._rows = []
+        os.makedirs(path, exist_ok=True)
+        self._n_parts = len(self._part_files())
+
+    def _part_files(self) -> list:
+        files = glob.glob(os.path.join(self.path, "part-*.parquet"))
+        files += glob.glob(os.path.join(self.path, "part-*.npz"))
+        return sorted(files)
+
+    def append(self, param: dict, result: dict):
+        """Add the result of a run"""
+        row = {"_hash": param_hash(param), "_param": param_key(param)}
+        for k, v in param.items():
+            row[f"param.{k}"] = v
+        row.update(result)
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows as a new batch file"""
+        if not self._rows:
+            return
+        columns = {}
+        for i, row in enumerate(self._rows):
+            for k in row:
+                if k not in columns:
+                    columns[k] = [None] * i
+            for k, values in columns.items():
+                values.append(row.get(k))
+        self._rows = []
+
+        name = os.path.join(self.path, f"part-{self._n_parts:06d}")
+        tmp = name + ".tmp"
+        if self.format == "parquet":
+            pyarrow = _pyarrow()
+            table = pyarrow.table(columns)
+            pyarrow.parquet.write_table(table, tmp)
+            os.replace(tmp, name + ".parquet")
+        else:
+            arrays = {}
+            for k, values in columns.items():
+                array = np.asarray(values)
+                if array.dtype == object:
+                    # Mixed or missing values are stored as JSON strings
+                    array = np.array([
+                        json.dumps(v, default=_json_default) for v in values
+                    ])
+                    k = k + ":json"
+                arrays[k] = array
+            with open(tmp, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, name + ".npz")
+        self._n_parts += 1
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _read_part(self, file: str, columns: list = None) -> dict:
+        if file.endswith(".parquet"):
+            table = _pyarrow().parquet.read_table(file, columns=columns)
+            return {k: table.column(k).to_numpy(zero_copy_only=False)
+                    for k in table.column_names}
+        data = {}
+        with np.load(file) as npz:
+            for k in npz.files:
+                name = k[:-len(":json")] if k.endswith(":json") else k
+                if columns is not None and name not in columns:
+                    continue
+                if k.endswith(":json"):
+                    data[name] = [json.loads(v) for v in npz[k]]
+                else:
+                    data[name] = npz[k]
+        return data
+
+    def completed(self) -> np.ndarray:
+        """Hashes of the written parameter sets, sorted
+
+        Returns:
+            np.ndarray: int64 array, use is_completed() to look up a parameter set
+        """
+        hashes = [
+            np.asarray(self._read_part(f, ["_hash"])["_hash"], dtype=np.int64)
+            for f in self._part_files()
+        ]
+        if not hashes:
+            return np.array([], dtype=np.int64)
+        return np.sort(np.concatenate(hashes))
+
+    @staticmethod
+    def is_completed(completed: np.ndarray, param: dict) -> bool:
+        h = param_hash(param)
+        i = np.searchsorted(completed, h)
+        return i < len(completed) and completed[i] == h
+
+    def rows(self):
+        """Iterate over the written rows as (param, result)"""
+        for f in self._part_files():
+            data = self._read_part(f)
+            keys = [k for k in data if not k.startswith(("_", "param."))]
+            for i, p in enumerate(data["_param"]):
+                result = {}
+                for k in keys:
+                    v = data[k][i]
+                    result[k] = v.item() if isinstance(v, np.generic) else v
+                yield json.loads(str(p)), result
+
+    def to_dataframe(self):
+        """Read all rows into a pandas DataFrame"""
+        import pandas as pd
+        frames = []
+        for f in self._part_files():
+            data = self._read_part(f)
+            frames.append(pd.DataFrame(
+                {k: list(v) for k, v in data.items() if k != "_param"}))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
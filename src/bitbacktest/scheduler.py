@@ -0,0 +1,308 @@
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from .strategy import Strategy
+
+
+def default_cost(param: dict) -> float:
+    """Prior cost of a parameter set
+    Per-tick cost of the window based strategies grows with the window
+    length (e.g. np.mean over "long_window" prices), so the sum of the
+    "*window*" parameters is used.
+
+    Args:
+        param (dict): parameter
+
+    Returns:
+        float: relative cost
+    """
+    cost = 1.0
+    for k, v in param.items():
+        if "window" in k and isinstance(v, (int, float)):
+            cost += float(v)
+    return cost
+
+
+class CostModel:
+    """Run time estimator for sweep tasks
+
+    The estimate is a linear fit "seconds = a + b * cost_fn(param)" over
+    the observed run times. Parameter sets that were already timed use
+    their observed time directly. Until two different costs were observed,
+    the prior cost is used as is (only the order matters for scheduling).
+
+    Args:
+        cost_fn (callable, optional): prior cost of a parameter set. Defaults to default_cost.
+    """
+
+    def __init__(self, cost_fn=default_cost):
+        self.cost_fn = cost_fn
+        self.observed = {}
+        self._coef = None
+
+    @staticmethod
+    def _key(param: dict) -> str:
+        return json.dumps(param, sort_keys=True, default=str)
+
+    def observe(self, param: dict, seconds: float):
+        """Record the run time of a parameter set"""
+        self.observed[self._key(param)] = (self.cost_fn(param), seconds)
+        self._coef = None
+
+    def observe_queue(self, queue):
+        """Record the run times of finished tasks of a SweepQueue"""
+        for param, _, elapsed in queue.results():
+            if elapsed is not None:
+                self.observe(param, elapsed)
+
+    def _fit(self):
+        if self._coef is None:
+            x = np.array([v[0] for v in self.observed.values()])
+            y = np.array([v[1] for v in self.observed.values()])
+            if len(np.unique(x)) >= 2:
+                b, a = np.polyfit(x, y, 1)
+                if b > 0:
+                    self._coef = (max(a, 0.0), b)
+            if self._coef is None and len(x) > 0:
+                self._coef = (0.0, y.sum() / x.sum())
+        return self._coef
+
+    def coefficients(self) -> tuple:
+        """(a, b) of "seconds = a + b * cost_fn(param)", (0, 1) before any observation"""
+        coef = self._fit()
+        return (0.0, 1.0) if coef is None else coef
+
+    def observed_seconds(self, param: dict):
+        """Observed run time of a parameter set, None if it was not timed"""
+        observed = self.observed.get(self._key(param))
+        return None if observed is None else observed[1]
+
+    def estimate(self, param: dict) -> float:
+        """Estimated run time (or relative cost before any observation)"""
+        key = self._key(param)
+        if key in self.observed:
+            return self.observed[key][1]
+        coef = self._fit()
+        cost = self.cost_fn(param)
+        if coef is None:
+            return cost
+        return coef[0] + coef[1] * cost
+
+    def save(self, path: str):
+        """Save the observed run times to a JSON file"""
+        with open(path, "w") as f:
+            json.dump([[json.loads(k), v[1]] for k, v in self.observed.items()],
+                      f)
+
+    def load(self, path: str):
+        """Load observed run times saved by save()"""
+        with open(path) as f:
+            for param, seconds in json.load(f):
+                self.observe(param, seconds)
+        return self
+
+
+_worker_strategy = None
+_worker_pruner = None
+_worker_metrics = None
+
+
+def _init_worker(strategy: Strategy, pruner=None, metrics=None,
+                 warm: bool = False):
+    global _worker_strategy, _worker_pruner, _worker_metrics
+    _worker_strategy = strategy
+    _worker_pruner = pruner
+    _worker_metrics = metrics
+    if warm:
+        # Compile before the first task, not timed by the cost model
+        from .kernel import warm_kernel
+        warm_kernel(strategy)
+
+
+def _run_task(param: dict, start_cash: float, start_coin: float):
+    start = time.perf_counter()
+    strategy = _worker_strategy.clone()
+    strategy.reset_all(param, start_cash, start_coin)
+    result = strategy.backtest(pruner=_worker_pruner, metrics=_worker_metrics)
+    if _worker_pruner is not None and not result["pruned"]:
+        # The best run is shared only within the worker process
+        _worker_pruner.update_best(strategy.market.hist["total_value_hist"])
+    return result, time.perf_counter() - start
+
+
+def merge_reports(reports: list, n_workers: int) -> dict:
+    """Load balance report of several CostAwareScheduler.run() calls
+
+    Args:
+        reports (list): CostAwareScheduler.report of each run
+        n_workers (int): number of worker processes
+
+    Returns:
+        dict: report, as CostAwareScheduler.report
+    """
+    busy = np.zeros(n_workers)
+    for report in reports:
+        busy += report["busy"]
+    makespan = sum(r["makespan"] for r in reports)
+    return {
+        "n_tasks": sum(r["n_tasks"] for r in reports),
+        "n_workers": n_workers,
+        "makespan": makespan,
+        "busy": busy.tolist(),
+        "efficiency": float(busy.sum() / (n_workers * makespan))
+        if makespan > 0 else 1.0,
+        "steals": sum(r["steals"] for r in reports),
+    }
+
+
+class CostAwareScheduler:
+    """Parallel sweep runner with longest-first dispatch and work stealing
+
+    Tasks are sorted by estimated cost and assigned longest-first to the
+    least loaded worker (LPT). Each worker runs its own deque from the
+    front. A worker whose deque is empty steals the largest task of the
+    worker with the most estimated remaining work. Observed run times are
+    fed back into the cost model while the sweep runs.
+
+    Args:
+        n_workers (int, optional): number of worker processes. Defaults to os.cpu_count().
+        cost_model (CostModel, optional): cost model. Defaults to CostModel().
+    """
+
+    def __init__(self, n_workers: int = None, cost_model: CostModel = None):
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.cost_model = cost_model if cost_model is not None else CostModel()
+        self.report = None
+
+    def _assign(self, params: list) -> list:
+        estimates = [self.cost_model.estimate(p) for p in params]
+        order = sorted(range(len(params)), key=lambda i: -estimates[i])
+        queues = [deque() for _ in range(self.n_workers)]
+        loads = np.zeros(self.n_workers)
+        for i in order:
+            w = int(np.argmin(loads))
+            queues[w].append(i)
+            loads[w] += estimates[i]
+
+        # Remaining work of each queue as the observed seconds, the number
+        # and the prior cost of the other tasks, so that it is updated per
+        # task taken and its estimate follows the fit without a rescan
+        self._terms = []
+        for p in params:
+            seconds = self.cost_model.observed_seconds(p)
+            self._terms.append(
+                np.array([seconds, 0.0, 0.0]) if seconds is not None else
+                np.array([0.0, 1.0, self.cost_model.cost_fn(p)]))
+        self._remaining = np.zeros((self.n_workers, 3))
+        for w, q in enumerate(queues):
+            for i in q:
+                self._remaining[w] += self._terms[i]
+        return queues
+
+    def _pop(self, worker: int, queues: list) -> int:
+        i = queues[worker].popleft()
+        self._remaining[worker] -= self._terms[i]
+        return i
+
+    def _next_task(self, worker: int, queues: list):
+        if queues[worker]:
+            return self._pop(worker, queues), False
+        a, b = self.cost_model.coefficients()
+        remaining = self._remaining @ np.array([1.0, a, b])
+        remaining[[not q for q in queues]] = -np.inf
+        victim = int(np.argmax(remaining))
+        if not queues[victim]:
+            return None, False
+        return self._pop(victim, queues), True
+
+    def _warm_kernel(self, strategy: Strategy, n_tasks: int,
+                     pruner=None) -> bool:
+        # Compile the kernel in every worker if its share of the ticks pays
+        # for it, see kernel.KERNEL_MIN_TICKS. The pruner needs the Python loop.
+        from .kernel import KERNEL_MIN_TICKS
+        if pruner is not None or not hasattr(strategy.market, "__len__"):
+            return False
+        ticks = n_tasks * len(strategy.market) / self.n_workers
+        return ticks >= KERNEL_MIN_TICKS
+
+    def run(self,
+            strategy: Strategy,
+            params: list,
+            start_cash: float,
+            start_coin: float = 0,
+            callback=None,
+            pruner=None,
+            metrics=None) -> list:
+        """Backtest all parameter sets
+
+        Args:
+            strategy (Strategy): strategy, a clone is used for every task
+            params (list): parameter dicts
+            start_cash (float): start cash
+            start_coin (float, optional): start coin. Defaults to 0.
+            callback (callable, optional): called as callback(param, result) when a task finishes.
+                If given, results are passed to the callback and not kept.
+            pruner (Pruner, optional): stop hopeless runs early, see Strategy.backtest().
+            metrics (Metrics, optional): metrics added to every result, see Strategy.backtest().
+
+        Returns:
+            list: results in the order of "params", or [] if callback is given
+        """
+        params = list(params)
+        queues = self._assign(params)
+        results = [None] * len(params) if callback is None else []
+        busy = np.zeros(self.n_workers)
+        steals = 0
+        start = time.perf_counter()
+        warm = self._warm_kernel(strategy, len(params), pruner)
+
+        with ProcessPoolExecutor(max_workers=self.n_workers,
+                                 initializer=_init_worker,
+                                 initargs=(strategy, pruner, metrics,
+                                           warm)) as pool:
+            running = {}
+
+            def dispatch(worker):
+                nonlocal steals
+                i, stolen = self._next_task(worker, queues)
+                if i is None:
+                    return
+                steals += stolen
+                future = pool.submit(_run_task, params[i], start_cash,
+                                     start_coin)
+                running[future] = (worker, i)
+
+            for worker in range(self.n_workers):
+                dispatch(worker)
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    worker, i = running.pop(future)
+                    result, seconds = future.result()
+                    if callback is None:
+                        results[i] = result
+                    else:
+                        callback(params[i], result)
+                    busy[worker] += seconds
+                    self.cost_model.observe(params[i], seconds)
+                    print(f"Finished test {i+1}/{len(params)} "
+                          f"({seconds:.2f}s, worker {worker})")
+                    dispatch(worker)
+
+        makespan = time.perf_counter() - start
+        self.report = {
+            "n_tasks": len(params),
+            "n_workers": self.n_workers,
+            "makespan": makespan,
+            "busy": busy.tolist(),
+            # 1.0 means every worker was busy until the last task finished
+            "efficiency": float(busy.sum() / (self.n_workers * makespan))
+            if makespan > 0 else 1.0,
+            "steals": steals,
+        }
+        return results
@@ -0,0 +1,208 @@
+"""Search space definitions and quasi-random sampling
+
+Integer, Real and Categorical take the same arguments as the
+scikit-optimize classes and are used when scikit-optimize is not
+installed. Functions in this module accept both.
+"""
+import sys
+
+import numpy as np
+
+
+class Dimension:
+    name = None
+
+    def rvs(self, n_samples: int = 1, random_state=None) -> list:
+        rng = np.random.RandomState(random_state) if not isinstance(
+            random_state, np.random.RandomState) else random_state
+        return from_unit(self, rng.uniform(size=n_samples))
+
+
+class Integer(Dimension):
+
+    def __init__(self, low: int, high: int, prior: str = "uniform",
+                 name: str = None):
+        self.low = int(low)
+        self.high = int(high)
+        self.prior = prior
+        self.name = name
+
+    def __contains__(self, value) -> bool:
+        return self.low <= value <= self.high
+
+    def __repr__(self) -> str:
+        return f"Integer(low={self.low}, high={self.high}, prior='{self.prior}')"
+
+
+class Real(Dimension):
+
+    def __init__(self, low: float, high: float, prior: str = "uniform",
+                 name: str = None):
+        self.low = float(low)
+        self.high = float(high)
+        self.prior = prior
+        self.name = name
+
+    def __contains__(self, value) -> bool:
+        return self.low <= value <= self.high
+
+    def __repr__(self) -> str:
+        return f"Real(low={self.low}, high={self.high}, prior='{self.prior}')"
+
+
+class Categorical(Dimension):
+
+    def __init__(self, categories, name: str = None, **kwargs):
+        self.categories = tuple(categories)
+        self.name = name
+
+    def __contains__(self, value) -> bool:
+        return value in self.categories
+
+    def __repr__(self) -> str:
+        return f"Categorical(categories={self.categories})"
+
+
+def is_dimension(value) -> bool:
+    """True for Integer, Real and Categorical of this module or scikit-optimize"""
+    if isinstance(value, Dimension):
+        return True
+    # scikit-optimize is not imported here, it is if its classes are used
+    skopt_space = sys.modules.get("skopt.space")
+    return skopt_space is not None and isinstance(value, skopt_space.Dimension)
+
+
+def to_skopt(dim):
+    """scikit-optimize dimension of a dimension of this module
+
+    Dimensions of scikit-optimize are returned as they are.
+    """
+    if not isinstance(dim, Dimension):
+        return dim
+    import skopt.space
+    if isinstance(dim, Categorical):
+        return skopt.space.Categorical(dim.categories, name=dim.name)
+    return getattr(skopt.space, type(dim).__name__)(dim.low, dim.high,
+                                                    prior=dim.prior,
+                                                    name=dim.name)
+
+
+def from_unit(dim, u: np.ndarray) -> list:
+    """Map points of [0, 1) to values of a dimension
+
+    Args:
+        dim: Integer, Real or Categorical
+        u (np.ndarray): points in [0, 1)
+
+    Returns:
+        list: values
+    """
+    u = np.clip(np.asarray(u, dtype=np.float64), 0.0, np.nextafter(1.0, 0.0))
+    if hasattr(dim, "categories"):
+        categories = list(dim.categories)
+        return [categories[i] for i in (u * len(categories)).astype(int)]
+    log = getattr(dim, "prior", "uniform") == "log-uniform"
+    is_int = type(dim).__name__ == "Integer"
+    if is_int and not log:
+        values = dim.low + np.floor(u * (dim.high - dim.low + 1))
+        return [int(v) for v in values]
+    if log:
+        values = np.exp(np.log(dim.low) + u * (np.log(dim.high) - np.log(dim.low)))
+    else:
+        values = dim.low + u * (dim.high - dim.low)
+    if is_int:
+        return [int(v) for v in np.clip(np.round(values), dim.low, dim.high)]
+    return [float(v) for v in values]
+
+
+def _primes(n: int) -> list:
+    primes = []
+    k = 2
+    while len(primes) < n:
+        if all(k % p for p in primes):
+            primes.append(k)
+        k += 1
+    return primes
+
+
+def _halton(n: int, d: int, rng: np.random.RandomState) -> np.ndarray:
+    points = np.zeros((n, d))
+    index = np.arange(1, n + 1)
+    for j, base in enumerate(_primes(d)):
+        i = index.copy()
+        f = 1.0
+        while np.any(i > 0):
+            f /= base
+            points[:, j] += f * (i % base)
+            i //= base
+    # Random shift keeps the low discrepancy and avoids the same points for every seed
+    return (points + rng.uniform(size=d)) % 1.0
+
+
+def _latin_hypercube(n: int, d: int, rng: np.random.RandomState) -> np.ndarray:
+    points = np.empty((n, d))
+    for j in range(d):
+        points[:, j] = (rng.permutation(n) + rng.uniform(size=n)) / n
+    return points
+
+
+def sample_unit(n: int, d: int, method: str = "sobol",
+                random_state: int = None) -> np.ndarray:
+    """Sample n points of the unit hypercube [0, 1)^d
+
+    Args:
+        n (int): number of points
+        d (int): number of dimensions
+        method (str, optional): "sobol" (needs scipy, falls back to "halton"),
+            "halton", "lhs" (Latin hypercube) or "random". Defaults to "sobol".
+        random_state (int, optional): random state
+
+    Returns:
+        np.ndarray: (n, d) array
+    """
+    rng = np.random.RandomState(random_state)
+    if method == "sobol":
+        try:
+            from scipy.stats import qmc
+        except ImportError:
+            method = "halton"
+        else:
+            sampler = qmc.Sobol(d, scramble=True, seed=random_state)
+            return sampler.random(n)
+    if method == "halton":
+        return _halton(n, d, rng)
+    if method == "lhs":
+        return _latin_hypercube(n, d, rng)
+    if method == "random":
+        return rng.uniform(size=(n, d))
+    raise ValueError(f"Unknown method {method}")
+
+
+def sample_params(target_params: dict, n: int, method: str = "sobol",
+                  random_state: int = None) -> list:
+    """Sample parameter sets from a dict of dimensions and fixed values
+
+    Args:
+        target_params (dict): Integer, Real or Categorical for optimized keys, fixed values for others
+        n (int): number of parameter sets
+        method (str, optional): see sample_unit(). Defaults to "sobol".
+        random_state (int, optional): random state
+
+    Returns:
+        list: parameter dicts
+    """
+    keys = [k for k, v in target_params.items() if is_dimension(v)]
+    if not keys:
+        return [dict(target_params)]
+    unit = sample_unit(n, len(keys), method, random_state)
+    columns = {
+        k: from_unit(target_params[k], unit[:, j])
+        for j, k in enumerate(keys)
+    }
+    samples = []
+    for i in range(n):
+        param = dict(target_params)
+        for k in keys:
+            param[k] = columns[k][i]
+        samples.append(param)
+    return samples
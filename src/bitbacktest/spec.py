@@ -0,0 +1,300 @@
+"""Declarative strategy specs
+
+A spec is a dict (e.g. read with json.load) of parameters, indicators,
+rules and actions:
+
+    {
+        "name": "MACrossSpec",
+        "params": {"short_window": 30, "long_window": 120,
+                   "one_order_quantity": 0.01, "profit": 1.01},
+        "indicators": {
+            "short": {"type": "sma", "input": "price", "window": "short_window"},
+            "long": {"type": "sma", "input": "price", "window": "long_window"}
+        },
+        "rules": {
+            "Buy": {"cross_above": ["short", "long"]},
+            "Sell": {"cross_below": ["short", "long"]}
+        },
+        "actions": {
+            "Buy": {"side": "Buy", "quantity": "one_order_quantity",
+                    "take_profit": "profit"}
+        }
+    }
+
+Indicators:
+    sma, ema, std (population): "input" (default "price") and "window"
+    add, sub, mul: "inputs", two operands
+An operand is "price", an indicator defined above, a parameter name or a number.
+
+Rules are checked in order and the first true one is the signal, "Hold"
+if none is:
+    cross_above / cross_below: [a, b], a crosses b on this tick
+    above / below: [a, b]
+    rising / falling: a, compared with its previous value
+    all / any: list of rules
+
+Actions place a market order of "quantity" on "side" for a signal. With
+"take_profit", a successful order also places a limit order on the other
+side at price * take_profit, linked to it by parent_id.
+
+The same spec runs as SpecStrategy (make_strategy_class(), per tick with
+constant state, also in the Lambda handler, see app/aws_build) and as
+vectorize.BatchEvaluator (whole price arrays, for parameter sweeps).
+"""
+import copy
+import math
+
+from .strategy import Strategy
+
+INDICATOR_TYPES = ("sma", "ema", "std", "add", "sub", "mul")
+WINDOW_TYPES = ("sma", "ema", "std")
+RULE_TYPES = ("cross_above", "cross_below", "above", "below", "rising",
+              "falling", "all", "any")
+# Keys of "self.dynamic" used by Strategy, and of the Lambda handler's item
+RESERVED_NAMES = ("price", "count", "id", "version")
+
+
+def _check_operand(spec: dict, operand, defined: list, where: str):
+    if isinstance(operand, bool) or not isinstance(operand, (str, int, float)):
+        raise ValueError(f"{where}: invalid operand {operand!r}")
+    if isinstance(operand, str) and operand != "price" and \
+       operand not in defined and operand not in spec["params"]:
+        raise ValueError(f"{where}: unknown operand {operand!r}")
+
+
+def _check_rule(spec: dict, rule, where: str):
+    if not isinstance(rule, dict) or len(rule) != 1:
+        raise ValueError(f"{where}: a rule is a dict with one key")
+    kind, args = next(iter(rule.items()))
+    if kind not in RULE_TYPES:
+        raise ValueError(f"{where}: unknown rule {kind!r}")
+    defined = list(spec["indicators"])
+    if kind in ("all", "any"):
+        if not isinstance(args, list) or not args:
+            raise ValueError(f"{where}: {kind} needs a list of rules")
+        for r in args:
+            _check_rule(spec, r, where)
+    elif kind in ("rising", "falling"):
+        _check_operand(spec, args, defined, where)
+    else:
+        if not isinstance(args, list) or len(args) != 2:
+            raise ValueError(f"{where}: {kind} needs two operands")
+        for a in args:
+            _check_operand(spec, a, defined, where)
+
+
+def validate_spec(spec: dict) -> dict:
+    """Check a spec and fill in the defaults
+
+    Args:
+        spec (dict): strategy spec, see the module docstring
+
+    Returns:
+        dict: checked copy of the spec
+
+    Raises:
+        ValueError: if the spec is invalid
+    """
+    spec = copy.deepcopy(spec)
+    for key in ("indicators", "rules", "actions"):
+        if not isinstance(spec.get(key), dict):
+            raise ValueError(f"spec needs a dict {key!r}")
+    spec.setdefault("name", "CustomSpecStrategy")
+    spec.setdefault("params", {})
+    if not str(spec["name"]).isidentifier():
+        raise ValueError(f"name {spec['name']!r} is not a class name")
+    for name, value in spec["params"].items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"param {name}: value must be a number")
+
+    defined = []
+    for name, ind in spec["indicators"].items():
+        where = f"indicator {name}"
+        if name in RESERVED_NAMES or name in spec["params"]:
+            raise ValueError(f"{where}: name is reserved or a param")
+        if not isinstance(ind, dict) or ind.get("type") not in INDICATOR_TYPES:
+            raise ValueError(f"{where}: type must be one of {INDICATOR_TYPES}")
+        if ind["type"] in WINDOW_TYPES:
+            ind.setdefault("input", "price")
+            _check_operand(spec, ind["input"], defined, where)
+            window = ind.get("window")
+            if isinstance(window, str):
+                window = spec["params"].get(window)
+            if isinstance(window, bool) or \
+               not isinstance(window, (int, float)) or window < 1:
+                raise ValueError(f"{where}: window must be a param or number >= 1")
+        else:
+            inputs = ind.get("inputs")
+            if not isinstance(inputs, list) or len(inputs) != 2:
+                raise ValueError(f"{where}: inputs must be two operands")
+            for operand in inputs:
+                _check_operand(spec, operand, defined, where)
+        defined.append(name)
+
+    for signal, rule in spec["rules"].items():
+        if signal == "Hold":
+            raise ValueError("rule Hold: Hold is the signal without a rule")
+        _check_rule(spec, rule, f"rule {signal}")
+
+    for signal, action in spec["actions"].items():
+        where = f"action {signal}"
+        if signal not in spec["rules"]:
+            raise ValueError(f"{where}: no rule for the signal")
+        if not isinstance(action, dict) or \
+           action.get("side") not in ("Buy", "Sell"):
+            raise ValueError(f"{where}: side must be Buy or Sell")
+        for key in ("quantity", "take_profit"):
+            value = action.get(key)
+            if key == "take_profit" and value is None:
+                continue
+            if isinstance(value, str) and value not in spec["params"]:
+                raise ValueError(f"{where}: unknown param {value!r}")
+            if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                raise ValueError(f"{where}: {key} must be a param or number")
+    return spec
+
+
+class SpecStrategy(Strategy):
+    """Strategy running a spec tick by tick
+
+    Subclasses set "spec", see make_strategy_class(). The state of each
+    indicator is a dict in "self.dynamic" that is updated in constant time
+    per price: moving windows keep a running sum and a ring of the last
+    "window" sums. It only has numbers, None and lists, so the Lambda
+    handler saves it to DynamoDB as is.
+    """
+    # Checked spec, see validate_spec()
+    spec = None
+
+    def reset_param(self, param):
+        static = dict(self.spec["params"])
+        static.update(param)
+        super().reset_param(static)
+        self.dynamic = {"price": {"value": None, "prev": None}}
+        for name, ind in self.spec["indicators"].items():
+            state = {"value": None, "prev": None}
+            if ind["type"] in ("sma", "std"):
+                window = self._window(ind)
+                state.update(n=0, csum=0.0, ring=[0.0] * window)
+                if ind["type"] == "std":
+                    state.update(csq=0.0, ring2=[0.0] * window)
+            self.dynamic[name] = state
+
+    def _window(self, ind: dict) -> int:
+        # Values of AWS env are floats
+        return int(self._operand(ind["window"]))
+
+    def _operand(self, operand, key: str = "value"):
+        if isinstance(operand, str):
+            if operand == "price" or operand in self.spec["indicators"]:
+                return self.dynamic[operand][key]
+            return self.static[operand]
+        return operand
+
+    def _update(self, state: dict, value):
+        state["prev"] = state["value"]
+        state["value"] = value
+
+    def _update_window(self, state: dict, ind: dict, x: float):
+        window = self._window(ind)
+        for key in ("ring", "ring2"):
+            if key in state and not isinstance(state[key], list):
+                # Read back from DynamoDB as a read-only array
+                state[key] = [float(v) for v in state[key]]
+        state["n"] += 1
+        state["csum"] += x
+        k = state["n"] % window
+        # ring[k] is the sum of the first n - window inputs
+        s = state["csum"] - state["ring"][k]
+        state["ring"][k] = state["csum"]
+        if ind["type"] == "sma":
+            return s / window if state["n"] >= window else None
+        state["csq"] += x * x
+        q = state["csq"] - state["ring2"][k]
+        state["ring2"][k] = state["csq"]
+        if state["n"] < window:
+            return None
+        mean = s / window
+        return math.sqrt(max(q / window - mean * mean, 0.0))
+
+    def _indicator(self, name: str, ind: dict):
+        state = self.dynamic[name]
+        kind = ind["type"]
+        if kind in ("add", "sub", "mul"):
+            a, b = (self._operand(x) for x in ind["inputs"])
+            if a is None or b is None:
+                return None
+            if kind == "add":
+                return a + b
+            if kind == "sub":
+                return a - b
+            return a * b
+        x = self._operand(ind.get("input", "price"))
+        if x is None:
+            return None
+        if kind == "ema":
+            if state["value"] is None:
+                return x
+            alpha = 2 / (self._window(ind) + 1.0)
+            return alpha * x + (1 - alpha) * state["value"]
+        return self._update_window(state, ind, x)
+
+    def _rule(self, rule: dict) -> bool:
+        kind, args = next(iter(rule.items()))
+        if kind == "all":
+            return all(self._rule(r) for r in args)
+        if kind == "any":
+            return any(self._rule(r) for r in args)
+        if kind in ("rising", "falling"):
+            a, a_prev = self._operand(args), self._operand(args, "prev")
+            if a is None or a_prev is None:
+                return False
+            return a > a_prev if kind == "rising" else a < a_prev
+        a, b = (self._operand(x) for x in args)
+        if a is None or b is None:
+            return False
+        if kind == "above":
+            return a > b
+        if kind == "below":
+            return a < b
+        a_prev, b_prev = (self._operand(x, "prev") for x in args)
+        if a_prev is None or b_prev is None:
+            return False
+        if kind == "cross_above":
+            return a_prev <= b_prev and a > b
+        return a_prev >= b_prev and a < b
+
+    def generate_signals(self, price):
+        self._update(self.dynamic["price"], price)
+        for name, ind in self.spec["indicators"].items():
+            self._update(self.dynamic[name], self._indicator(name, ind))
+        for signal, rule in self.spec["rules"].items():
+            if self._rule(rule):
+                return signal
+        return "Hold"
+
+    def execute_trade(self, price, signal):
+        action = self.spec["actions"].get(signal)
+        if action is None:
+            return
+        quantity = self._operand(action["quantity"])
+        success = self.market.place_market_order(action["side"], quantity)
+        if success and action.get("take_profit") is not None:
+            self.market.place_limit_order(
+                "Sell" if action["side"] == "Buy" else "Buy",
+                quantity,
+                price * self._operand(action["take_profit"]),
+                parent_id=self.market.last_order_id)
+
+
+def make_strategy_class(spec: dict) -> type:
+    """Create the SpecStrategy subclass of a spec
+
+    Args:
+        spec (dict): strategy spec
+
+    Returns:
+        type: subclass named spec["name"]
+    """
+    spec = validate_spec(spec)
+    return type(spec["name"], (SpecStrategy, ), {"spec": spec})
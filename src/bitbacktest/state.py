@@ -0,0 +1,100 @@
+class StrategyState:
+    """Typed container for ``Strategy.dynamic``
+
+    Subclasses declare their fields once with ``__slots__``. Fields are
+    accessed as attributes in the hot loop (``state.macd_values``), while
+    dict-style access (``state["macd_values"]``) keeps working for the
+    backtest loop, ``hold_params`` and the DynamoDB helpers.
+    Keys that are not declared (e.g. the partition key returned by
+    ``read_from_dynamodb``) are kept in ``_extra`` so that
+    ``from_dict(to_dict())`` is lossless.
+
+    example,
+        >>> class MACDState(StrategyState):
+        ...     __slots__ = ("prices", "macd_values")
+    """
+    __slots__ = ("count", "_extra")
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = cls._collect_fields()
+        cls._field_set = frozenset(cls._fields)
+
+    @classmethod
+    def _collect_fields(cls) -> tuple:
+        names = []
+        for klass in reversed(cls.__mro__):
+            for name in klass.__dict__.get("__slots__", ()):
+                if name != "_extra" and name not in names:
+                    names.append(name)
+        return tuple(names)
+
+    def __init__(self, **kwargs):
+        for name in self._fields:
+            object.__setattr__(self, name, None)
+        self.count = 0
+        self._extra = {}
+        for k, v in kwargs.items():
+            self[k] = v
+
+    @classmethod
+    def fields(cls) -> tuple:
+        """Declared field names, base class first"""
+        return cls._fields
+
+    def __getitem__(self, key: str):
+        if key in self._field_set:
+            return getattr(self, key)
+        return self._extra[key]
+
+    def __setitem__(self, key: str, value):
+        if key in self._field_set:
+            setattr(self, key, value)
+        else:
+            self._extra[key] = value
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._field_set or key in self._extra
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self._fields) + list(self._extra.keys())
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def update(self, data: dict):
+        for k, v in data.items():
+            self[k] = v
+
+    def to_dict(self) -> dict:
+        """Convert to the plain dict form used by save_to_dynamodb
+
+        Returns:
+            dict: state
+        """
+        return dict(self.items())
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """Create state from the dict form returned by read_from_dynamodb
+
+        Args:
+            data (dict): state
+
+        Returns:
+            StrategyState: state
+        """
+        return cls(**data)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()})"
+
+
+StrategyState._fields = StrategyState._collect_fields()
+StrategyState._field_set = frozenset(StrategyState._fields)
@@ -0,0 +1,348 @@
+"""Stores of live strategy state
+
+A StateStore saves the states of strategies (Strategy.dump_dynamic()) by
+key, e.g. the PARAMS_KEY of each Lambda function, and loads them back for
+Strategy.load_dynamic(). Every key of a state is encoded on its own in the
+binary format of utils/dynamodb.py, so the stores read the items written
+by the Lambda handler and the handler reads theirs. States that did not
+change since they were loaded or saved are not written again.
+
+    DynamoDBStateStore: a DynamoDB table, read with batch_get_item and
+        written with batch_writer, for many strategies at once
+    SQLiteStateStore: a SQLite file, for local paper trading
+    FileStateStore: one file per state in a directory
+"""
+import contextlib
+import os
+import random
+import sqlite3
+import struct
+import threading
+import time
+import urllib.parse
+from abc import ABC, abstractmethod
+
+from .utils.dynamodb import encode_binary, revert_attribute
+
+
+class StateStore(ABC):
+    """Base class of state stores
+
+    Subclasses implement _read() and _write() of encoded attributes.
+
+    Args:
+        compression (str, optional): "zlib", "lz4" or "none". Defaults to "zlib".
+    """
+
+    def __init__(self, compression: str = "zlib"):
+        self.compression = compression
+        # Encoded attributes of the last loaded or saved state by key
+        self._saved = {}
+
+    @abstractmethod
+    def _read(self, keys: list) -> dict:
+        """Attributes of the saved states
+
+        Returns:
+            dict: {key: {name: encoded value}}, without keys that are not saved
+        """
+
+    @abstractmethod
+    def _write(self, items: dict):
+        """Save states, replacing the saved ones
+
+        Args:
+            items (dict): {key: {name: encoded value}}
+        """
+
+    def _encode(self, state: dict) -> dict:
+        return {
+            k: encode_binary(v, self.compression)
+            for k, v in state.items()
+        }
+
+    def load_many(self, keys) -> dict:
+        """Load states
+
+        Args:
+            keys (iterable): keys of the states
+
+        Returns:
+            dict: states by key, without keys that are not saved
+        """
+        states = {}
+        for key, attributes in self._read(list(keys)).items():
+            state = {k: revert_attribute(v) for k, v in attributes.items()}
+            states[key] = state
+            self._saved[key] = {
+                k: bytes(getattr(v, "value", v)) if not isinstance(v, dict)
+                else encode_binary(state[k], self.compression)
+                for k, v in attributes.items()
+            }
+        return states
+
+    def save_many(self, states: dict) -> list:
+        """Save the states that changed since they were loaded or saved
+
+        Args:
+            states (dict): states by key
+
+        Returns:
+            list: keys of the saved states
+        """
+        items = {}
+        for key, state in states.items():
+            attributes = self._encode(state)
+            if attributes != self._saved.get(key):
+                items[key] = attributes
+        if items:
+            self._write(items)
+            self._saved.update(items)
+        return list(items)
+
+    def load(self, key) -> dict:
+        """Load a state, None if it is not saved"""
+        return self.load_many([key]).get(key)
+
+    def save(self, key, state: dict) -> bool:
+        """Save a state if it changed, returns True if saved"""
+        return bool(self.save_many({key: state}))
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DynamoDBStateStore(StateStore):
+    """States in a DynamoDB table, one item per key
+
+    States are written with batch_writer(), which puts whole items. Each
+    item is written with the "version" of the Lambda handler, the read one
+    plus 1, so the conditional write of a handler with a cached state is
+    rejected and it reads the state again. batch_writer() has no conditions though:
+    a state saved by a handler after the store read it is overwritten, so
+    a key should not be written by a handler at the same time.
+
+    Args:
+        table (object): DynamoDB table, see utils.dynamodb.get_dynamodb_table()
+        partition_key (str, optional): partition key of the table. Defaults to "id".
+        compression (str, optional): "zlib", "lz4" or "none". Defaults to "zlib".
+    """
+    # Maximum number of keys of a batch_get_item request
+    BATCH_GET_SIZE = 100
+    # Keys that DynamoDB did not read are requested again after a random
+    # sleep of up to BACKOFF_BASE * 2**n seconds (at most BACKOFF_MAX), n
+    # the number of retries without progress, up to MAX_RETRIES of them
+    BACKOFF_BASE = 0.05
+    BACKOFF_MAX = 5.0
+    MAX_RETRIES = 8
+
+    def __init__(self,
+                 table: object,
+                 partition_key: str = "id",
+                 compression: str = "zlib"):
+        super().__init__(compression)
+        self.table = table
+        self.partition_key = partition_key
+        # Version of each read or written item, 0 if it has none
+        self._versions = {}
+
+    def _batch_get(self, keys: list, versions_only: bool = False) -> dict:
+        from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+        serializer, deserializer = TypeSerializer(), TypeDeserializer()
+        client = self.table.meta.client
+        items = {}
+        for i in range(0, len(keys), self.BATCH_GET_SIZE):
+            request = {
+                self.table.name: {
+                    "Keys": [{
+                        self.partition_key: serializer.serialize(key)
+                    } for key in keys[i:i + self.BATCH_GET_SIZE]]
+                }
+            }
+            if versions_only:
+                request[self.table.name].update(
+                    ProjectionExpression="#k, #v",
+                    ExpressionAttributeNames={
+                        "#k": self.partition_key,
+                        "#v": "version"
+                    })
+            retries = 0
+            while True:
+                response = client.batch_get_item(RequestItems=request)
+                for item in response["Responses"].get(self.table.name, []):
+                    item = {k: deserializer.deserialize(v)
+                            for k, v in item.items()}
+                    key = item.pop(self.partition_key)
+                    self._versions[key] = int(item.pop("version", 0))
+                    items[key] = item
+                # Keys not read because of the throughput limit
+                unprocessed = response.get("UnprocessedKeys")
+                if not unprocessed:
+                    break
+                if len(unprocessed[self.table.name]["Keys"]) < len(
+                        request[self.table.name]["Keys"]):
+                    retries = 0
+                elif retries == self.MAX_RETRIES:
+                    raise RuntimeError(
+                        f"DynamoDB did not read {self.table.name} items "
+                        f"after {retries} retries")
+                else:
+                    retries += 1
+                time.sleep(random.uniform(
+                    0, min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2**retries)))
+                request = unprocessed
+        return items
+
+    def _read(self, keys: list) -> dict:
+        return self._batch_get(keys)
+
+    def _write(self, items: dict):
+        unknown = [key for key in items if key not in self._versions]
+        if unknown:
+            self._batch_get(unknown, versions_only=True)
+        with self.table.batch_writer(
+                overwrite_by_pkeys=[self.partition_key]) as batch:
+            for key, attributes in items.items():
+                version = self._versions.get(key, 0) + 1
+                item = dict(attributes)
+                item[self.partition_key] = key
+                item["version"] = version
+                batch.put_item(Item=item)
+                self._versions[key] = version
+
+
+class SQLiteStateStore(StateStore):
+    """States in a SQLite file, one row per key of a state
+
+    Args:
+        path (str): path of the SQLite file, ":memory:" for a temporary store
+        compression (str, optional): "zlib", "lz4" or "none". Defaults to "zlib".
+        timeout (float, optional): seconds to wait for the database lock. Defaults to 60.
+    """
+
+    def __init__(self,
+                 path: str,
+                 compression: str = "zlib",
+                 timeout: float = 60):
+        super().__init__(compression)
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS states (
+                    key TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    PRIMARY KEY (key, name)
+                )""")
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread and per process
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path,
+                                   timeout=self.timeout,
+                                   isolation_level=None)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _read(self, keys: list) -> dict:
+        items = {}
+        # SQLite limits the number of parameters of a query
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = self._conn.execute(
+                "SELECT key, name, value FROM states WHERE key IN "
+                f"({', '.join('?' * len(chunk))})", chunk)
+            for key, name, value in rows:
+                items.setdefault(key, {})[name] = value
+        return items
+
+    def _write(self, items: dict):
+        with self._transaction() as conn:
+            conn.executemany("DELETE FROM states WHERE key = ?",
+                             [(key, ) for key in items])
+            conn.executemany(
+                "INSERT INTO states (key, name, value) VALUES (?, ?, ?)",
+                [(key, name, value)
+                 for key, attributes in items.items()
+                 for name, value in attributes.items()])
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class FileStateStore(StateStore):
+    """States in a directory, one file per key
+
+    A file has the name and the encoded value of each key of the state, each
+    after its length. Files are replaced atomically.
+
+    Args:
+        directory (str): directory of the files, created if it does not exist
+        compression (str, optional): "zlib", "lz4" or "none". Defaults to "zlib".
+    """
+
+    def __init__(self, directory: str, compression: str = "zlib"):
+        super().__init__(compression)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key) -> str:
+        return os.path.join(self.directory,
+                            urllib.parse.quote(str(key), safe="") + ".state")
+
+    def _read(self, keys: list) -> dict:
+        items = {}
+        for key in keys:
+            try:
+                with open(self._path(key), "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            attributes = {}
+            pos = 0
+            while pos < len(data):
+                size = struct.unpack_from("<I", data, pos)[0]
+                name = data[pos + 4:pos + 4 + size].decode("utf-8")
+                pos += 4 + size
+                size = struct.unpack_from("<I", data, pos)[0]
+                attributes[name] = data[pos + 4:pos + 4 + size]
+                pos += 4 + size
+            items[key] = attributes
+        return items
+
+    def _write(self, items: dict):
+        for key, attributes in items.items():
+            parts = []
+            for name, value in attributes.items():
+                name = name.encode("utf-8")
+                parts += [struct.pack("<I", len(name)), name,
+                          struct.pack("<I", len(value)), value]
+            path = self._path(key)
+            with open(path + ".tmp", "wb") as f:
+                f.write(b"".join(parts))
+            os.replace(path + ".tmp", path)
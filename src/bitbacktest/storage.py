@@ -0,0 +1,126 @@
+"""Compact storage of prices and history
+
+BTC_JPY prices are integers below 2^31, so they fit in int32, and other
+prices in float32, half the memory of float64. The history of a backtest
+(total value and position per tick) can be kept in float32 too. Values
+are converted to float64 when they are read for computations, so the
+portfolio and running sums keep float64 precision.
+
+float32 has 24 significant bits: prices that it can not represent, e.g.
+fractional prices above 2^23 or integers above 2^24, would be rounded.
+Such prices are kept in float64 instead, with a warning, so that a
+compact backtest is always the backtest of the same prices.
+"""
+import warnings
+
+import numpy as np
+
+INT32_MAX = np.iinfo(np.int32).max
+
+
+def _fits_int32(prices: np.ndarray) -> bool:
+    return not len(prices) or (prices.max() <= INT32_MAX and
+                               prices.min() >= -INT32_MAX)
+
+
+def _fits_float32(prices: np.ndarray) -> bool:
+    return np.array_equal(prices.astype(np.float32), prices, equal_nan=True)
+
+
+def compact_prices(prices, dtype=None) -> np.ndarray:
+    """Prices in a 4 byte dtype
+
+    Args:
+        prices: prices
+        dtype (optional): np.int32 or np.float32. Defaults to int32 if all
+            prices are integers that fit in it, float32 if it represents
+            them exactly, and float64 (with a warning) otherwise.
+
+    Raises:
+        ValueError: the prices do not fit in "dtype"
+
+    Returns:
+        np.ndarray: prices
+    """
+    prices = np.asarray(prices)
+    if dtype is None:
+        integral = prices.dtype.kind in "iu" or (
+            prices.dtype.kind == "f" and
+            np.array_equal(prices, np.round(prices)))
+        if integral and _fits_int32(prices):
+            dtype = np.int32
+        elif _fits_float32(prices):
+            dtype = np.float32
+        else:
+            warnings.warn("float32 would round the prices, they are kept "
+                          "in float64")
+            dtype = np.float64
+    dtype = np.dtype(dtype)
+    if prices.dtype == dtype:
+        return prices
+    if dtype.kind == "i" and not _fits_int32(prices):
+        raise ValueError("prices do not fit in int32")
+    if dtype == np.float32 and not _fits_float32(prices):
+        raise ValueError("float32 would round the prices")
+    return prices.astype(dtype)
+
+
+class HistoryBuffer:
+    """Growable float32 array used like a list for history values
+
+    Supports append(), extend(), len(), iteration and indexing. Slices
+    are numpy arrays.
+
+    Args:
+        values (optional): initial values
+        dtype (optional): dtype of the values. Defaults to np.float32.
+    """
+
+    def __init__(self, values=(), dtype=np.float32):
+        values = np.asarray(values, dtype=dtype)
+        self._data = np.empty(max(len(values), 1024), dtype=dtype)
+        self._data[:len(values)] = values
+        self._n = len(values)
+
+    def _reserve(self, n: int):
+        if n > len(self._data):
+            data = np.empty(max(n, 2 * len(self._data)), dtype=self._data.dtype)
+            data[:self._n] = self._data[:self._n]
+            self._data = data
+
+    def append(self, value):
+        self._reserve(self._n + 1)
+        self._data[self._n] = value
+        self._n += 1
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self._data.dtype)
+        self._reserve(self._n + len(values))
+        self._data[self._n:self._n + len(values)] = values
+        self._n += len(values)
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.values
+        return self.values.astype(dtype)
+
+    def __eq__(self, other):
+        return len(self) == len(other) and \
+            bool(np.all(self.values == np.asarray(other)))
+
+    def tolist(self) -> list:
+        return self.values.tolist()
+
+    @property
+    def values(self) -> np.ndarray:
+        """Values as an array, a view of the buffer"""
+        return self._data[:self._n]
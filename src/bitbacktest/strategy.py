@@ -1,10 +1,11 @@
 import numpy as np
-from tqdm import tqdm
 from abc import ABC, abstractmethod
 from typing import Literal
+import copy
 import os
 
 from .market import *
+from .state import StrategyState
 
 
 class Strategy(ABC):
@@ -13,23 +14,27 @@ class Strategy(ABC):
     Args:
         ABC (_type_): _description_
     """
+    # StrategyState subclass used for "self.dynamic". None means plain dict.
+    state_class = None
 
     def __init__(self, market: Market):
         self.market = market
 
-    @abstractmethod
     def reset_param(self, param: dict):
         """Reset parameter
-        Reset parameters. Implement the process of setting parameters in this method.
+        Reset parameters. Override this method to set other initial values.
         "self.static" are values to set as AWS env.
-        "self.dynamic" are values to save to DynamoDB.
+        "self.dynamic" are values to save to DynamoDB, an instance of
+        "state_class" (None values) or an empty dict.
 
         Args:
             param (dict): parameter
         """
         self.static = param
-        self.dynamic = {}
-        pass
+        if self.state_class is None:
+            self.dynamic = {}
+        else:
+            self.dynamic = self.state_class()
 
     def reset_all(self, param: dict, start_cash: int, start_coin: float = 0):
         """Reset parameter and portfolio
@@ -44,6 +49,80 @@ class Strategy(ABC):
         self.market.reset_portfolio(start_cash, start_coin)
         self.dynamic["count"] = 0
 
+    def clone(self, market: Market = None):
+        """Create an independent copy of the strategy
+        The market is forked (price data is shared) unless "market" is given,
+        and "self.static" / "self.dynamic" are copied.
+        Use a clone per evaluation to run backtests concurrently.
+
+        Args:
+            market (Market, optional): market for the clone. Defaults to a fork of self.market.
+
+        Returns:
+            Strategy: cloned strategy
+        """
+        strategy = copy.copy(self)
+        strategy.market = self.market.fork() if market is None else market
+        for name in ("static", "dynamic", "hold_params"):
+            if name in self.__dict__:
+                setattr(strategy, name, copy.deepcopy(self.__dict__[name]))
+        return strategy
+
+    def snapshot(self, history: bool = True) -> dict:
+        """Get the full state after a backtest
+        Restore it with restore() on a market with more data and call
+        backtest(resume=True) to backtest only the new data. The result is
+        the same as a backtest of all data. The snapshot can be pickled.
+
+        Args:
+            history (bool, optional): include the history (market.hist, ledger
+                and hold_params). If False, the resumed history has only the new data.
+
+        Returns:
+            dict: snapshot
+        """
+        hold_params = self.__dict__.get("hold_params", {})
+        if not history:
+            hold_params = {k: [] for k in hold_params}
+        return {
+            "static": copy.deepcopy(self.static),
+            "dynamic": copy.deepcopy(self.dynamic),
+            "hold_params": copy.deepcopy(hold_params),
+            "market": self.market.snapshot(history),
+        }
+
+    def restore(self, snapshot: dict):
+        """Set the state saved by snapshot()
+
+        Args:
+            snapshot (dict): snapshot
+        """
+        self.static = copy.deepcopy(snapshot["static"])
+        self.dynamic = copy.deepcopy(snapshot["dynamic"])
+        self.hold_params = copy.deepcopy(snapshot["hold_params"])
+        self.market.restore(snapshot["market"])
+
+    def load_dynamic(self, data: dict):
+        """Set "self.dynamic" from the dict form read from DynamoDB
+
+        Args:
+            data (dict): dynamic values
+        """
+        if self.state_class is None:
+            self.dynamic = data
+        else:
+            self.dynamic = self.state_class.from_dict(data)
+
+    def dump_dynamic(self) -> dict:
+        """Get "self.dynamic" as the dict form saved to DynamoDB
+
+        Returns:
+            dict: dynamic values
+        """
+        if isinstance(self.dynamic, dict):
+            return self.dynamic
+        return self.dynamic.to_dict()
+
     @abstractmethod
     def generate_signals(self, price: float) -> str:
         """Generate Trade Signal
@@ -69,45 +148,137 @@ class Strategy(ABC):
         """
         pass
 
-    def trade_limiter(self) -> bool:
-        orders = self.market.get_open_orders()
-        ret = (os.environ["TRADE_ENABLE"] == "1"
-               and int(os.environ["ORDER_NUM_MAX"]) > len(orders))
-        return ret
+    def trade_limiter(self, orders: list = None) -> bool:
+        """Whether trading is enabled and the open orders are below the limit
+
+        Args:
+            orders (list, optional): open orders if they were already fetched,
+                see market.get_open_orders(). Defaults to fetching the count.
 
-    def backtest(self, hold_params=[]):
+        Returns:
+            bool: True if execute_trade() may place orders
+        """
+        if os.environ["TRADE_ENABLE"] != "1":
+            return False
+        order_num_max = int(os.environ["ORDER_NUM_MAX"])
+        if orders is None:
+            return order_num_max > self.market.open_order_count()
+        return order_num_max > len(orders)
+
+    def backtest(self,
+                 hold_params=[],
+                 pruner=None,
+                 metrics=None,
+                 resume: bool = False,
+                 checkpoint=None,
+                 resume_from: str = None,
+                 backend: Literal["auto", "python", "kernel"] = "auto"):
         """Running a back test
         Backtest flow is
         1. get current price
         2. generate_signals() method
         3. execute_trade() method
-        4. save data and go to next
+        4. check open orders (in bar mode before 2., against the high and low of the bar)
+        5. save data and go to next
+
+        Args:
+            hold_params (list, optional): keys of "self.dynamic" to record every tick
+            pruner (Pruner, optional): stop early when a prune rule fires.
+                The result then has "pruned", "pruned_at" and "prune_reason" keys.
+            metrics (list or Metrics, optional): metric names (see metrics.METRICS)
+                or Metrics to add to the result, computed from the history.
+            resume (bool, optional): continue from the current state (see restore())
+                at the first index not backtested yet, instead of from the start.
+                "hold_params" of the previous run are kept.
+            checkpoint (Checkpointer, optional): write checkpoints while running
+                and at the end, see checkpoint.Checkpointer.
+            resume_from (str, optional): checkpoint directory to restore and resume from.
+            backend (str, optional): "kernel" runs the loop as the strategy's
+                registered kernel (see kernel.py), compiled if numba is
+                installed. "auto" does so only if numba is installed, the
+                kernel supports the strategy, without hold_params, pruner
+                and checkpoint, and the kernel is already compiled or the run
+                is long enough to pay for compiling it (see
+                kernel.KERNEL_MIN_TICKS). "python" always runs the Python loop.
+                Defaults to "auto".
 
         Returns:
             _type_: Result of backtest
         """
-        self.dynamic["count"] = 0
-        self.market.set_current_index(0)
-        self.hold_params = {}
-        for p in hold_params:
-            self.hold_params[p] = []
+        if resume_from is not None:
+            from .checkpoint import load_checkpoint
+            self.restore(load_checkpoint(resume_from))
+            resume = True
+        if resume:
+            hold_params = list(self.hold_params.keys())
+        else:
+            self.dynamic["count"] = 0
+            self.market.set_current_index(0)
+            self.hold_params = {}
+            for p in hold_params:
+                self.hold_params[p] = []
         if not "TRADE_ENABLE" in os.environ.keys():
             os.environ["TRADE_ENABLE"] = "1"
         if not "ORDER_NUM_MAX" in os.environ.keys():
             os.environ["ORDER_NUM_MAX"] = "99999"
-
-        for _ in tqdm(range(len(self.market))):
+        if pruner is not None:
+            pruner.start(self.market)
+        if metrics is not None and not hasattr(metrics, "compute"):
+            from .metrics import Metrics
+            metrics = Metrics(metrics)
+        if checkpoint is not None:
+            checkpoint.start(resume_from)
+        if backend != "python":
+            from .kernel import run_kernel
+            if hold_params or pruner is not None or checkpoint is not None:
+                if backend == "kernel":
+                    raise ValueError(
+                        "hold_params, pruner and checkpoint need the Python loop")
+            elif run_kernel(self, required=backend == "kernel"):
+                return self._result(metrics)
+
+        from tqdm import tqdm
+        for _ in tqdm(range(self.dynamic["count"], len(self.market))):
             self.dynamic["count"] += 1
             self.market.set_current_index(self.dynamic["count"] - 1)
             price = self.market.get_current_price()
+            if self.market.bar_mode:
+                # Resting orders are filled within the bar, before its close
+                self.market.check_order()
             signal = self.generate_signals(price)
             if self.trade_limiter():
                 self.execute_trade(price, signal)
-            self.market.check_order()
+            if not self.market.bar_mode:
+                self.market.check_order()
             self.market.save_history(price)
             for p in hold_params:
                 self.hold_params[p].append(self.dynamic[p]) 
-        return self.market.portfolio
+            if checkpoint is not None and checkpoint.due(self.dynamic["count"]):
+                checkpoint.save(self)
+            if pruner is not None and \
+               self.dynamic["count"] % pruner.interval == 0:
+                reason = pruner.check(self.market)
+                if reason is not None:
+                    return self._result(metrics,
+                                        pruned=True,
+                                        pruned_at=self.dynamic["count"] - 1,
+                                        prune_reason=reason)
+        if checkpoint is not None:
+            checkpoint.save(self)
+        if pruner is not None:
+            return self._result(metrics,
+                                pruned=False,
+                                pruned_at=None,
+                                prune_reason=None)
+        return self._result(metrics)
+
+    def _result(self, metrics=None, **kwargs):
+        if metrics is None and not kwargs:
+            return self.market.portfolio
+        result = dict(self.market.portfolio, **kwargs)
+        if metrics is not None:
+            result.update(metrics.compute(self.market))
+        return result
 
     @property
     def backtest_history(self):
@@ -259,31 +430,33 @@ class Strategy(ABC):
         return
 
 
+class MovingAverageCrossoverState(StrategyState):
+    __slots__ = ("price_hist", )
+
+
 class MovingAverageCrossoverStrategy(Strategy):
+    state_class = MovingAverageCrossoverState
 
     def reset_param(self, param):
         super().reset_param(param)
-        self.dynamic["price_hist"] = np.array([])
+        self.dynamic.price_hist = np.array([])
 
     def generate_signals(self, price):
-        self.dynamic["price_hist"] = np.append(self.dynamic["price_hist"],
-                                               price)
-        if len(self.dynamic["price_hist"]) < (self.static["long_window"] + 1):
+        dynamic = self.dynamic
+        dynamic.price_hist = np.append(dynamic.price_hist, price)
+        price_hist = dynamic.price_hist
+        if len(price_hist) < (self.static["long_window"] + 1):
             return "Hold"  # Not enough data for calculation
 
-        short_mavg = np.mean(
-            self.dynamic["price_hist"][-self.static["short_window"]:])
-        long_mavg = np.mean(
-            self.dynamic["price_hist"][-self.static["long_window"]:])
+        short_window = self.static["short_window"]
+        long_window = self.static["long_window"]
+        short_mavg = np.mean(price_hist[-short_window:])
+        long_mavg = np.mean(price_hist[-long_window:])
 
-        short_mavg_old = np.mean(
-            self.dynamic["price_hist"][-1 *
-                                       (self.static["short_window"] + 1):-1])
-        long_mavg_old = np.mean(
-            self.dynamic["price_hist"][-1 *
-                                       (self.static["long_window"] + 1):-1])
+        short_mavg_old = np.mean(price_hist[-1 * (short_window + 1):-1])
+        long_mavg_old = np.mean(price_hist[-1 * (long_window + 1):-1])
 
-        self.dynamic["price_hist"] = np.delete(self.dynamic["price_hist"], 0)
+        dynamic.price_hist = np.delete(price_hist, 0)
 
         if short_mavg > long_mavg and short_mavg_old < long_mavg_old and long_mavg > long_mavg_old:
             return 'Buy'
@@ -298,64 +471,59 @@ class MovingAverageCrossoverStrategy(Strategy):
                                            self.static["one_order_quantity"])
 
 
-class MACDStrategy(Strategy):
+class MACDState(StrategyState):
+    __slots__ = ("prices", "emashort_values", "emalong_values", "macd_values",
+                 "macd_values_old", "signal_line_values",
+                 "signal_line_values_old")
 
-    def reset_param(self, param):
-        super().reset_param(param)
-        self.dynamic["count"] = 0
-        self.dynamic["prices"] = None
-        self.dynamic["emashort_values"] = None
-        self.dynamic["emalong_values"] = None
-        self.dynamic["macd_values"] = None
-        self.dynamic["signal_line_values"] = None
+
+class MACDStrategy(Strategy):
+    state_class = MACDState
 
     def _calculate_ema(self, current_price, previous_ema, window):
         alpha = 2 / (window + 1.0)
         return alpha * current_price + (1 - alpha) * previous_ema
 
     def generate_signals(self, price):
-        if self.dynamic["prices"] is None:
+        dynamic = self.dynamic
+        if dynamic.prices is None:
             # Initialize
             emashort = emalong = price
             macd = signal_line = 0.0
         else:
             # calcurate EMA
-            emashort = self._calculate_ema(price,
-                                           self.dynamic["emashort_values"],
+            emashort = self._calculate_ema(price, dynamic.emashort_values,
                                            self.static["short_window"])
-            emalong = self._calculate_ema(price,
-                                          self.dynamic["emalong_values"],
+            emalong = self._calculate_ema(price, dynamic.emalong_values,
                                           self.static["long_window"])
 
             # calcurate MACD
             macd = emashort - emalong
 
             # calucurate signal line
-            if self.dynamic["macd_values"] == 0:
+            if dynamic.macd_values == 0:
                 signal_line = macd
             else:
                 signal_line = self._calculate_ema(
-                    macd, self.dynamic["signal_line_values"],
+                    macd, dynamic.signal_line_values,
                     self.static["signal_window"])
 
-        self.dynamic["prices"] = price
+        dynamic.prices = price
 
-        self.dynamic["emashort_values"] = emashort
-        self.dynamic["emalong_values"] = emalong
-        self.dynamic["macd_values_old"] = self.dynamic["macd_values"]
-        self.dynamic["macd_values"] = macd
-        self.dynamic["signal_line_values_old"] = self.dynamic[
-            "signal_line_values"]
-        self.dynamic["signal_line_values"] = signal_line
+        dynamic.emashort_values = emashort
+        dynamic.emalong_values = emalong
+        macd_values_old = dynamic.macd_values_old = dynamic.macd_values
+        dynamic.macd_values = macd
+        signal_line_values_old = dynamic.signal_line_values_old = \
+            dynamic.signal_line_values
+        dynamic.signal_line_values = signal_line
 
         # generate signal
         signal = "Hold"
-        if self.dynamic["macd_values_old"] is not None:
-            if self.dynamic["macd_values_old"] <= self.dynamic[
-                    "signal_line_values_old"] and macd > signal_line:
+        if macd_values_old is not None:
+            if macd_values_old <= signal_line_values_old and macd > signal_line:
                 signal = "Buy"
-            elif self.dynamic["macd_values_old"] >= self.dynamic[
-                    "signal_line_values_old"] and macd < signal_line:
+            elif macd_values_old >= signal_line_values_old and macd < signal_line:
                 signal = "Sell"
         return signal
 
@@ -0,0 +1,434 @@
+import contextlib
+import itertools
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+
+from .backtester import GridBacktester
+from .results import _json_default
+from .strategy import Strategy
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, sort_keys=True, default=_json_default)
+
+
+class SweepQueue:
+    """Durable work queue of backtest tasks backed by a SQLite file
+
+    The file can be put on shared storage so that workers on several hosts
+    claim tasks from the same queue. A claimed task is leased to a worker for
+    "lease_seconds". Workers renew the lease while running, and a task whose
+    lease expired (e.g. the worker crashed) is handed out again.
+
+    Args:
+        path (str): path of the SQLite file
+        lease_seconds (float, optional): lease time of a claimed task. Defaults to 600.
+        max_attempts (int, optional): a task is marked "failed" after this many claims. Defaults to 3.
+        timeout (float, optional): seconds to wait for the database lock. Defaults to 60.
+    """
+
+    def __init__(self,
+                 path: str,
+                 lease_seconds: float = 600,
+                 max_attempts: int = 3,
+                 timeout: float = 60):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT UNIQUE NOT NULL,
+                    params TEXT NOT NULL,
+                    start_cash REAL NOT NULL,
+                    start_coin REAL NOT NULL,
+                    priority REAL NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    worker TEXT,
+                    lease_until REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    elapsed REAL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_status "
+                         "ON tasks (status, priority)")
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread and per process
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path,
+                                   timeout=self.timeout,
+                                   isolation_level=None)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so that two workers
+        # never claim the same task
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    @staticmethod
+    def task_key(param: dict, start_cash: float, start_coin: float) -> str:
+        return _dumps([param, float(start_cash), float(start_coin)])
+
+    def submit(self,
+               params,
+               start_cash: float,
+               start_coin: float = 0,
+               priorities=None) -> int:
+        """Add parameter sets to the queue
+        Parameter sets already in the queue are ignored, so a sweep can be
+        submitted again after an interruption.
+
+        Args:
+            params (iterable): parameter dicts
+            start_cash (float): start cash
+            start_coin (float, optional): start coin. Defaults to 0.
+            priorities (iterable, optional): priority of each task, higher is claimed first.
+
+        Returns:
+            int: number of newly added tasks
+        """
+        if priorities is None:
+            priorities = itertools.repeat(0.0)
+        added = 0
+        with self._transaction() as conn:
+            for param, priority in zip(params, priorities):
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO tasks "
+                    "(key, params, start_cash, start_coin, priority) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (self.task_key(param, start_cash, start_coin),
+                     _dumps(param), float(start_cash), float(start_coin),
+                     float(priority)))
+                added += cur.rowcount
+        return added
+
+    def claim(self, worker_id: str):
+        """Claim the next pending task or a task whose lease expired
+
+        Args:
+            worker_id (str): id of the worker
+
+        Returns:
+            dict: task ("id", "params", "start_cash", "start_coin"), or None if there is no task
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = 'failed', "
+                "error = COALESCE(error, 'lease expired too many times') "
+                "WHERE status = 'running' AND lease_until < ? "
+                "AND attempts >= ?", (now, self.max_attempts))
+            row = conn.execute(
+                "SELECT id, params, start_cash, start_coin FROM tasks "
+                "WHERE status = 'pending' "
+                "OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY priority DESC, id LIMIT 1", (now, )).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE tasks SET status = 'running', worker = ?, "
+                "lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                (worker_id, now + self.lease_seconds, row[0]))
+        return {
+            "id": row[0],
+            "params": json.loads(row[1]),
+            "start_cash": row[2],
+            "start_coin": row[3]
+        }
+
+    def renew(self, task_id: int, worker_id: str) -> bool:
+        """Extend the lease of a running task
+
+        Returns:
+            bool: False if the task is no longer leased to the worker
+        """
+        with self._transaction() as conn:
+            cur = conn.execute(
+                "UPDATE tasks SET lease_until = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time() + self.lease_seconds, task_id, worker_id))
+        return cur.rowcount == 1
+
+    def complete(self,
+                 task_id: int,
+                 worker_id: str,
+                 result: dict,
+                 elapsed: float = None) -> bool:
+        """Write the result of a task
+
+        Returns:
+            bool: False if the task was reclaimed by another worker
+        """
+        with self._transaction() as conn:
+            cur = conn.execute(
+                "UPDATE tasks SET status = 'done', result = ?, elapsed = ?, "
+                "lease_until = NULL WHERE id = ? AND worker = ? "
+                "AND status = 'running'",
+                (_dumps(result), elapsed, task_id, worker_id))
+        return cur.rowcount == 1
+
+    def fail(self, task_id: int, worker_id: str, error: str):
+        """Release a task after an error
+        The task is retried until it has been claimed "max_attempts" times.
+        """
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET "
+                "status = CASE WHEN attempts >= ? THEN 'failed' "
+                "ELSE 'pending' END, "
+                "error = ?, worker = NULL, lease_until = NULL "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (self.max_attempts, error, task_id, worker_id))
+
+    def counts(self) -> dict:
+        """Number of tasks per status"""
+        rows = self._conn.execute(
+            "SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+        counts = {"pending": 0, "running": 0, "done": 0, "failed": 0}
+        counts.update(dict(rows))
+        return counts
+
+    def is_finished(self) -> bool:
+        counts = self.counts()
+        return counts["pending"] == 0 and counts["running"] == 0
+
+    def results(self, keys=None) -> list:
+        """Finished tasks in submission order
+
+        Args:
+            keys (iterable, optional): task keys (task_key()) to return. Defaults to all tasks.
+
+        Returns:
+            list: list of (params, result, elapsed)
+        """
+        rows = self._conn.execute(
+            "SELECT key, params, result, elapsed FROM tasks "
+            "WHERE status = 'done' ORDER BY id").fetchall()
+        if keys is not None:
+            keys = set(keys)
+            rows = [row for row in rows if row[0] in keys]
+        return [(json.loads(p), json.loads(r), e) for _, p, r, e in rows]
+
+
+class SweepWorker:
+    """Worker that claims tasks from a SweepQueue and backtests them
+
+    Run any number of workers, on any host that can open the queue file.
+
+    Args:
+        queue (SweepQueue): work queue
+        strategy (Strategy): strategy, a clone is used for every task
+        worker_id (str, optional): id of the worker. Defaults to "<hostname>-<pid>".
+    """
+
+    def __init__(self,
+                 queue: SweepQueue,
+                 strategy: Strategy,
+                 worker_id: str = None):
+        self.queue = queue
+        self.strategy = strategy
+        if worker_id is None:
+            worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.worker_id = worker_id
+
+    def _heartbeat(self, task_id: int, stop: threading.Event):
+        interval = max(self.queue.lease_seconds / 3, 0.01)
+        while not stop.wait(interval):
+            if not self.queue.renew(task_id, self.worker_id):
+                return
+
+    def run_task(self, task: dict) -> dict:
+        strategy = self.strategy.clone()
+        strategy.reset_all(task["params"], task["start_cash"],
+                           task["start_coin"])
+        return dict(strategy.backtest())
+
+    def run(self,
+            max_tasks: int = None,
+            poll_interval: float = 1.0,
+            exit_when_empty: bool = True) -> int:
+        """Claim and run tasks
+
+        Args:
+            max_tasks (int, optional): stop after this many tasks. Defaults to None.
+            poll_interval (float, optional): seconds to wait when no task can be claimed. Defaults to 1.0.
+            exit_when_empty (bool, optional): stop when no task is pending or running. Defaults to True.
+
+        Returns:
+            int: number of finished tasks
+        """
+        finished = 0
+        while max_tasks is None or finished < max_tasks:
+            task = self.queue.claim(self.worker_id)
+            if task is None:
+                if exit_when_empty and self.queue.is_finished():
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            print(f"[{self.worker_id}] Running task {task['id']}")
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat,
+                                         args=(task["id"], stop),
+                                         daemon=True)
+            heartbeat.start()
+            start = time.perf_counter()
+            try:
+                result = self.run_task(task)
+            except Exception:
+                self.queue.fail(task["id"], self.worker_id,
+                                traceback.format_exc())
+                continue
+            finally:
+                stop.set()
+                heartbeat.join()
+            if self.queue.complete(task["id"], self.worker_id, result,
+                                   time.perf_counter() - start):
+                finished += 1
+        return finished
+
+
+def run_worker(queue_path: str, strategy: Strategy, **kwargs) -> int:
+    """Run a SweepWorker on the queue file
+    Entry point for worker processes. Keyword arguments are passed to SweepWorker.run().
+
+    Args:
+        queue_path (str): path of the SQLite file
+        strategy (Strategy): strategy
+
+    Returns:
+        int: number of finished tasks
+    """
+    lease_seconds = kwargs.pop("lease_seconds", 600)
+    queue = SweepQueue(queue_path, lease_seconds=lease_seconds)
+    try:
+        return SweepWorker(queue, strategy).run(**kwargs)
+    finally:
+        queue.close()
+
+
+class DistributedGridBacktester(GridBacktester):
+    """GridBacktester that distributes the parameter sets through a SweepQueue
+
+    The coordinator writes the parameter sets into the queue, optionally
+    starts local worker processes, waits for the queue to drain and collects
+    the results. Workers on other hosts join by calling run_worker() with
+    the same queue file.
+
+    Args:
+        strategy (Strategy): strategy
+        queue_path (str): path of the SQLite file
+        lease_seconds (float, optional): lease time of a claimed task. Defaults to 600.
+    """
+
+    def __init__(self,
+                 strategy: Strategy,
+                 queue_path: str,
+                 lease_seconds: float = 600):
+        super().__init__(strategy)
+        self.queue = SweepQueue(queue_path, lease_seconds=lease_seconds)
+
+    def backtest(self,
+                 params,
+                 start_cash: int,
+                 start_coin: float = 0,
+                 n_workers: int = None,
+                 poll_interval: float = 1.0,
+                 cost_model=None):
+        """Run the sweep
+
+        Args:
+            params (iterable): parameter dicts
+            start_cash (int): start cash
+            start_coin (float, optional): start coin. Defaults to 0.
+            n_workers (int, optional): number of local worker processes. Defaults to os.cpu_count(). 0 only waits for external workers.
+            poll_interval (float, optional): seconds between progress checks. Defaults to 1.0.
+            cost_model (CostModel, optional): if given, tasks are claimed longest-first by estimated run time.
+
+        Returns:
+            list: results of finished tasks of "params" in submission order
+        """
+        priorities = None
+        if cost_model is not None:
+            params = list(params)
+            priorities = [cost_model.estimate(p) for p in params]
+        # Tasks of earlier sweeps in the same queue are not returned
+        keys = set()
+
+        def submitted(params):
+            for param in params:
+                keys.add(self.queue.task_key(param, start_cash, start_coin))
+                yield param
+
+        added = self.queue.submit(submitted(params), start_cash, start_coin,
+                                  priorities)
+        print(f"Submitted {added} tasks to {self.queue.path}")
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+
+        processes = []
+        for _ in range(n_workers):
+            process = multiprocessing.Process(
+                target=run_worker,
+                args=(self.queue.path, self.strategy),
+                kwargs={
+                    "lease_seconds": self.queue.lease_seconds,
+                    "poll_interval": poll_interval
+                })
+            process.start()
+            processes.append(process)
+
+        while not self.queue.is_finished():
+            if processes and not any(p.is_alive() for p in processes):
+                # All local workers are gone, take over the remaining tasks
+                SweepWorker(self.queue, self.strategy,
+                            f"{socket.gethostname()}-{os.getpid()}-coordinator"
+                            ).run(poll_interval=poll_interval)
+                break
+            print(f"Sweep progress: {self.queue.counts()}")
+            time.sleep(poll_interval)
+        for process in processes:
+            process.join()
+
+        results = self.queue.results(keys)
+        self.grid_backtest_params = [r[0] for r in results]
+        self.test_results = [r[1] for r in results]
+        return self.test_results
@@ -1,6 +1,9 @@
-import boto3
 import base64
 import math
+import array
+import struct
+import zlib
+import itertools
 import numpy as np
 
 def convert_numpy_array_to_dynamodb(np_array, chunk_size_kb=400):
@@ -22,8 +25,9 @@ def convert_numpy_array_to_dynamodb(np_array, chunk_size_kb=400):
     return data, np_array.dtype
 
 def revert_numpy_array_from_dynamodb(data, dtype):
-    # パートを結合
-    combined_base64 = b''.join([data[str(i)].value for i in range(len(data))])
+    # パートを結合 (Binary of convert_numpy_array_to_dynamodb(), or str of the Lambda handler)
+    chunks = [getattr(data[str(i)], "value", data[str(i)]) for i in range(len(data))]
+    combined_base64 = b''.join([c.encode('utf-8') if isinstance(c, str) else bytes(c) for c in chunks])
 
     # Base64デコード
     array_bytes = base64.b64decode(combined_base64)
@@ -81,6 +85,182 @@ def revert_from_dynamodb(data):
     else:
         raise TypeError(f"Type {data.keys()} is not supported")
 
+# Lists and arrays of numbers, saved as their int64 / float64 bytes
+ARRAY_TYPES = (list, np.ndarray)
+
+def array_bytes(data):
+    np_array = np.array(data)
+    if "int" in str(np_array.dtype):
+        return "LI", np_array.astype(np.int64).tobytes()
+    elif "float" in str(np_array.dtype):
+        return "LF", np_array.astype(np.float64).tobytes()
+    return None
+
+def bytes_to_array(raw, key):
+    dtype = np.int64 if key == "LI" else np.float64
+    return np.frombuffer(raw, dtype=dtype)
+
+def integral_deltas(key, raw):
+    # int64 bytes of the first value and the differences, None if the values
+    # are not integers (-0.0 is not, its sign would be lost) or they overflow
+    values = bytes_to_array(raw, key)
+    if key == "LF":
+        if not np.all((values == np.round(values)) & (np.abs(values) < 2**53)) or \
+           np.any((values == 0) & np.signbit(values)):
+            return None
+        values = values.astype(np.int64)
+    deltas = values.copy()
+    np.subtract(values[1:], values[:-1], out=deltas[1:])
+    # The sign of a wrapped difference is not the one of values[1:]
+    if np.any((values[1:] ^ values[:-1]) & (values[1:] ^ deltas[1:]) < 0):
+        return None
+    return deltas.tobytes()
+
+# Binary format: a byte of the compression ("r" none, "z" zlib, "4" lz4) and
+# the value, written as a tag byte and its data:
+#   0 None, T / f bool, N int64, n larger int (decimal), F float64, S str,
+#   I / D int64 / float64 array, i / d the same as int64 deltas,
+#   L list, M dict
+COMPRESSION_FLAGS = {"none": b"r", "zlib": b"z", "lz4": b"4"}
+
+def _encode_array(key, raw):
+    # Arrays of integer values (e.g. prices) are saved as deltas, which
+    # compress better than the values
+    count = len(raw) // 8
+    deltas = integral_deltas(key, raw)
+    tag = b"I" if key == "LI" else b"D"
+    if deltas is not None and count > 1:
+        tag, raw = tag.lower(), deltas
+    return tag + struct.pack("<I", count) + raw
+
+def _encode(value, out):
+    if value is None:
+        out.append(b"0")
+    elif isinstance(value, bool):
+        out.append(b"T" if value else b"f")
+    elif isinstance(value, int):
+        if -2**63 <= value < 2**63:
+            out.append(b"N" + struct.pack("<q", value))
+        else:
+            text = str(value).encode()
+            out.append(b"n" + struct.pack("<I", len(text)) + text)
+    elif isinstance(value, float):
+        out.append(b"F" + struct.pack("<d", value))
+    elif isinstance(value, str):
+        text = value.encode("utf-8")
+        out.append(b"S" + struct.pack("<I", len(text)) + text)
+    elif isinstance(value, ARRAY_TYPES):
+        encoded = array_bytes(value)
+        if encoded is not None:
+            out.append(_encode_array(*encoded))
+            return
+        out.append(b"L" + struct.pack("<I", len(value)))
+        for item in value:
+            _encode(item, out)
+    elif isinstance(value, dict):
+        out.append(b"M" + struct.pack("<I", len(value)))
+        for k, v in value.items():
+            text = k.encode("utf-8")
+            out.append(struct.pack("<I", len(text)) + text)
+            _encode(v, out)
+    else:
+        raise TypeError(f"Type {type(value)} is not supported")
+
+def _decode(data, pos):
+    tag = data[pos:pos + 1]
+    pos += 1
+    if tag == b"0":
+        return None, pos
+    elif tag in (b"T", b"f"):
+        return tag == b"T", pos
+    elif tag == b"N":
+        return struct.unpack_from("<q", data, pos)[0], pos + 8
+    elif tag == b"F":
+        return struct.unpack_from("<d", data, pos)[0], pos + 8
+    elif tag in (b"n", b"S"):
+        size = struct.unpack_from("<I", data, pos)[0]
+        text = data[pos + 4:pos + 4 + size].decode("utf-8")
+        return int(text) if tag == b"n" else text, pos + 4 + size
+    elif tag in (b"I", b"D", b"i", b"d"):
+        count = struct.unpack_from("<I", data, pos)[0]
+        raw = data[pos + 4:pos + 4 + 8 * count]
+        key = "LI" if tag in (b"I", b"i") else "LF"
+        if tag in (b"i", b"d"):
+            deltas = array.array("q")
+            deltas.frombytes(raw)
+            values = list(itertools.accumulate(deltas))
+            raw = array.array("q" if key == "LI" else "d", values).tobytes()
+        return bytes_to_array(raw, key), pos + 4 + 8 * count
+    elif tag == b"L":
+        count = struct.unpack_from("<I", data, pos)[0]
+        pos += 4
+        items = []
+        for _ in range(count):
+            item, pos = _decode(data, pos)
+            items.append(item)
+        return items, pos
+    elif tag == b"M":
+        count = struct.unpack_from("<I", data, pos)[0]
+        pos += 4
+        items = {}
+        for _ in range(count):
+            size = struct.unpack_from("<I", data, pos)[0]
+            k = data[pos + 4:pos + 4 + size].decode("utf-8")
+            items[k], pos = _decode(data, pos + 4 + size)
+        return items, pos
+    raise ValueError(f"Unknown tag {tag!r}")
+
+def encode_binary(data, compression="zlib"):
+    """encode data to the bytes of a DynamoDB Binary attribute
+
+    Args:
+        data: data, the types of convert_for_dynamodb()
+        compression (str, optional): "zlib", "lz4" or "none". Defaults to "zlib".
+
+    Returns:
+        bytes: encoded data
+    """
+    if compression not in COMPRESSION_FLAGS:
+        raise ValueError(f"Unknown compression {compression!r}")
+    out = []
+    _encode(data, out)
+    payload = b"".join(out)
+    if compression != "none" and len(payload) > 64:
+        if compression == "zlib":
+            packed = zlib.compress(payload)
+        else:
+            import lz4.frame
+            packed = lz4.frame.compress(payload)
+        if len(packed) < len(payload):
+            return COMPRESSION_FLAGS[compression] + packed
+    return COMPRESSION_FLAGS["none"] + payload
+
+def decode_binary(data):
+    """decode data encoded by encode_binary()
+
+    Args:
+        data: bytes, or Binary read from DynamoDB
+
+    Returns:
+        data
+    """
+    data = bytes(getattr(data, "value", data))
+    flag, payload = data[:1], data[1:]
+    if flag == COMPRESSION_FLAGS["zlib"]:
+        payload = zlib.decompress(payload)
+    elif flag == COMPRESSION_FLAGS["lz4"]:
+        import lz4.frame
+        payload = lz4.frame.decompress(payload)
+    elif flag != COMPRESSION_FLAGS["none"]:
+        raise ValueError(f"Unknown compression {flag!r}")
+    return _decode(payload, 0)[0]
+
+def revert_attribute(data):
+    """Revert an attribute saved in the binary or the map format"""
+    if isinstance(data, dict):
+        return revert_from_dynamodb(data)
+    return decode_binary(data)
+
 def save_to_dynamodb(table: object, item: dict, partition_key: str):
     """save to dynamoDB
 
@@ -113,6 +293,119 @@ def read_from_dynamodb(table: object, key_value, partition_key: str) -> dict:
     else:
         return None
 
+def read_versioned_from_dynamodb(table: object, key_value, partition_key: str) -> tuple:
+    """read from dynamoDB with the version of the data
+
+    Attributes may be in the binary or the map format.
+
+    Args:
+        table (object): DynamoDB table
+        key_value : partition key value of your data
+        partition_key (str): partition key of yuor table
+
+    Returns:
+        tuple: data (None if not saved yet), version (0 if not saved yet)
+    """
+    response = table.get_item(Key={partition_key: key_value})
+    item = response.get('Item')
+    if not item:
+        return None, 0
+    version = int(item.get("version", 0))
+    data = {k: revert_attribute(v) for k, v in item.items()
+            if k not in (partition_key, "version")}
+    return data, version
+
+def update_versioned_in_dynamodb(table: object, changed: dict, removed: list, key_value, partition_key: str, version: int) -> int:
+    """update attributes in dynamoDB if the data there is still "version"
+
+    Args:
+        table (object): DynamoDB table
+        changed (dict): attributes to set, encoded by encode_binary()
+        removed (list): attributes to remove
+        key_value : partition key value of your data
+        partition_key (str): partition key of yuor table
+        version (int): version of the data that the changes were made from
+
+    Returns:
+        int: version of the saved data
+
+    Raises:
+        ConditionalCheckFailedException: if another writer saved a newer version
+    """
+    names = {"#v": "version"}
+    values = {":v": version, ":next": version + 1}
+    sets = ["#v = :next"]
+    for i, (k, v) in enumerate(changed.items()):
+        names[f"#s{i}"] = k
+        values[f":s{i}"] = v
+        sets.append(f"#s{i} = :s{i}")
+    expression = "SET " + ", ".join(sets)
+    if removed:
+        for i, k in enumerate(removed):
+            names[f"#r{i}"] = k
+        expression += " REMOVE " + ", ".join(f"#r{i}" for i in range(len(removed)))
+    table.update_item(
+        Key={partition_key: key_value},
+        UpdateExpression=expression,
+        ConditionExpression="attribute_not_exists(#v) OR #v = :v",
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values)
+    return version + 1
+
+class DynamoDBState:
+    """State of one item, saved in the binary format
+
+    Only the keys that changed since the last load or save are written, with
+    a conditional UpdateItem (see update_versioned_in_dynamodb()). Items in
+    the map format of save_to_dynamodb() are read, and their keys are
+    rewritten in the binary format when they change.
+
+    Args:
+        table (object): DynamoDB table
+        key_value : partition key value of your data
+        partition_key (str, optional): partition key of yuor table. Defaults to "id".
+        compression (str, optional): "zlib", "lz4" or "none". Defaults to "zlib".
+    """
+
+    def __init__(self, table: object, key_value, partition_key: str = "id", compression: str = "zlib"):
+        self.table = table
+        self.key_value = key_value
+        self.partition_key = partition_key
+        self.compression = compression
+        self.attributes = {}
+        self.version = 0
+
+    def load(self) -> dict:
+        """read the state
+
+        Returns:
+            dict: data, None if not saved yet
+        """
+        data, self.version = read_versioned_from_dynamodb(self.table, self.key_value, self.partition_key)
+        self.attributes = {k: encode_binary(v, self.compression) for k, v in (data or {}).items()}
+        return data
+
+    def save(self, data: dict) -> list:
+        """save the keys that changed
+
+        Args:
+            data (dict): state
+
+        Returns:
+            list: saved and removed keys
+
+        Raises:
+            ConditionalCheckFailedException: if another writer saved a newer version
+        """
+        attributes = {k: encode_binary(v, self.compression) for k, v in data.items()
+                      if k not in (self.partition_key, "version")}
+        changed = {k: v for k, v in attributes.items() if self.attributes.get(k) != v}
+        removed = [k for k in self.attributes if k not in attributes]
+        if changed or removed:
+            self.version = update_versioned_in_dynamodb(self.table, changed, removed, self.key_value, self.partition_key, self.version)
+            self.attributes = attributes
+        return list(changed) + removed
+
 def get_dynamodb_table(table_name: str, aws_access_key_id: str, aws_secret_access_key: str, region_name: str = 'ap-northeast-1') -> object:
     """get dynamobd table
 
@@ -125,6 +418,8 @@ def get_dynamodb_table(table_name: str, aws_access_key_id: str, aws_secret_acces
     Returns:
         object: dynamodb table
     """
+    # Imported on first use, the codecs do not need it
+    import boto3
     dynamodb = boto3.resource('dynamodb', region_name=region_name,
                             aws_access_key_id=aws_access_key_id,
                             aws_secret_access_key=aws_secret_access_key)
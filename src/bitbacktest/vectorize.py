@@ -0,0 +1,342 @@
+"""Vectorized evaluation of strategy specs
+
+BatchEvaluator computes the indicators and rules of a spec (see spec.py)
+on whole price arrays and simulates its orders on BacktestMarket's rules,
+so a parameter sweep does not run a Python loop per tick. Indicators are
+shared by the parameter sets of a sweep that use the same windows.
+
+The results are the same as SpecStrategy.backtest() on a BacktestMarket
+with the same prices (not in bar mode): the indicators use the same
+running sums, and fills and fees the same arithmetic.
+"""
+import heapq
+import os
+
+import numpy as np
+
+from .spec import validate_spec
+
+
+class _CrossFinder:
+    """First index at or after a start where the price crosses a level
+
+    The maximum of each block of prices is kept, so a search checks one
+    block and the block maxima instead of every price.
+    """
+
+    def __init__(self, prices: np.ndarray, block: int = 1024):
+        self.block = block
+        self.n = len(prices)
+        nb = max(-(-self.n // block), 1)
+        padded = np.full(nb * block, -np.inf)
+        self._arrays = {}
+        for up, x in ((True, prices), (False, -prices)):
+            padded[:self.n] = x
+            self._arrays[up] = (x, padded.reshape(nb, block).max(axis=1))
+
+    def find(self, level: float, start: int, up: bool) -> int:
+        """Index of the first price >= level (up) or <= level, len(prices) if none"""
+        x, bmax = self._arrays[up]
+        if not up:
+            level = -level
+        b = start // self.block
+        end = min((b + 1) * self.block, self.n)
+        hit = np.flatnonzero(x[start:end] >= level)
+        if len(hit):
+            return start + int(hit[0])
+        crossed = bmax[b + 1:] >= level
+        k = int(crossed.argmax()) if len(crossed) else 0
+        if not len(crossed) or not crossed[k]:
+            return self.n
+        b += 1 + k
+        return b * self.block + int(
+            np.argmax(x[b * self.block:(b + 1) * self.block] >= level))
+
+
+def _lfilter():
+    # scipy is imported on first use, None if it is not installed
+    try:
+        from scipy.signal import lfilter
+    except ImportError:
+        return None
+    return lfilter
+
+
+def _valid_part(x: np.ndarray):
+    # Indicators of indicators start after the first valid input
+    valid = ~np.isnan(x)
+    start = int(valid.argmax()) if valid.any() else len(x)
+    return start, x[start:]
+
+
+def _window_sum(x: np.ndarray, window: int) -> np.ndarray:
+    # Sums of the last "window" values, as the running sums of SpecStrategy
+    c = np.concatenate(([0.0], np.cumsum(x)))
+    return c[window:] - c[:-window]
+
+
+def _sma(x: np.ndarray, window: int) -> np.ndarray:
+    out = np.full(len(x), np.nan)
+    start, x = _valid_part(x)
+    if len(x) >= window:
+        out[start + window - 1:] = _window_sum(x, window) / window
+    return out
+
+
+def _std(x: np.ndarray, window: int) -> np.ndarray:
+    out = np.full(len(x), np.nan)
+    start, x = _valid_part(x)
+    if len(x) >= window:
+        mean = _window_sum(x, window) / window
+        var = _window_sum(x * x, window) / window - mean * mean
+        out[start + window - 1:] = np.sqrt(np.maximum(var, 0.0))
+    return out
+
+
+def _ema(x: np.ndarray, window: int) -> np.ndarray:
+    out = np.full(len(x), np.nan)
+    start, x = _valid_part(x)
+    if len(x) == 0:
+        return out
+    alpha = 2 / (window + 1.0)
+    out[start] = x[0]
+    lfilter = _lfilter()
+    if lfilter is not None:
+        # y[i] = alpha * x[i] + (1 - alpha) * y[i - 1], seeded with x[0]
+        out[start + 1:], _ = lfilter([alpha], [1.0, -(1 - alpha)], x[1:],
+                                     zi=[(1 - alpha) * x[0]])
+    else:
+        y = x[0]
+        for i in range(1, len(x)):
+            y = alpha * x[i] + (1 - alpha) * y
+            out[start + i] = y
+    return out
+
+
+def _previous(value):
+    if np.ndim(value) == 0:
+        return value
+    prev = np.empty_like(value)
+    prev[0] = np.nan
+    prev[1:] = value[:-1]
+    return prev
+
+
+class BatchEvaluator:
+    """Backtests of a spec on whole price arrays
+
+    example,
+        evaluator = BatchEvaluator(spec)
+        results = evaluator.sweep(prices, [{"short_window": 10}, {"short_window": 20}], 1e6)
+
+    Args:
+        spec (dict): strategy spec, see spec.py
+    """
+
+    def __init__(self, spec: dict):
+        self.spec = validate_spec(spec)
+        self.signal_names = ["Hold"] + list(self.spec["rules"])
+
+    def _params(self, param: dict) -> dict:
+        params = dict(self.spec["params"])
+        params.update(param)
+        return params
+
+    def _key(self, operand, params: dict):
+        # Cache key of the values of an operand
+        if isinstance(operand, str):
+            if operand == "price":
+                return ("price", )
+            ind = self.spec["indicators"].get(operand)
+            if ind is None:
+                return ("const", float(params[operand]))
+            if "inputs" in ind:
+                return (ind["type"], ) + tuple(
+                    self._key(x, params) for x in ind["inputs"])
+            return (ind["type"], int(self._value(ind["window"], params)),
+                    self._key(ind["input"], params))
+        return ("const", float(operand))
+
+    def _value(self, operand, params: dict):
+        if isinstance(operand, str):
+            return params[operand]
+        return operand
+
+    def _compute(self, key: tuple, cache: dict):
+        if key in cache:
+            return cache[key]
+        kind = key[0]
+        if kind == "const":
+            value = key[1]
+        elif kind in ("add", "sub", "mul"):
+            a, b = (self._compute(k, cache) for k in key[1:])
+            value = a + b if kind == "add" else a - b if kind == "sub" \
+                else a * b
+        else:
+            x = np.asarray(self._compute(key[2], cache), dtype=np.float64)
+            value = {"sma": _sma, "ema": _ema, "std": _std}[kind](x, key[1])
+        cache[key] = value
+        return value
+
+    def _rule(self, rule: dict, params: dict, cache: dict):
+        kind, args = next(iter(rule.items()))
+        if kind in ("all", "any"):
+            masks = [self._rule(r, params, cache) for r in args]
+            reduce = np.logical_and if kind == "all" else np.logical_or
+            return reduce.reduce(np.broadcast_arrays(*masks))
+        if kind in ("rising", "falling"):
+            a = self._compute(self._key(args, params), cache)
+            a_prev = _previous(a)
+            return a > a_prev if kind == "rising" else a < a_prev
+        a, b = (self._compute(self._key(x, params), cache) for x in args)
+        if kind == "above":
+            return a > b
+        if kind == "below":
+            return a < b
+        a_prev, b_prev = _previous(a), _previous(b)
+        if kind == "cross_above":
+            return (a_prev <= b_prev) & (a > b)
+        return (a_prev >= b_prev) & (a < b)
+
+    def _signals(self, params: dict, cache: dict, n: int) -> np.ndarray:
+        codes = np.zeros(n, dtype=np.int16)
+        rules = list(self.spec["rules"].values())
+        # Earlier rules win, so they are written last
+        for code in range(len(rules), 0, -1):
+            mask = np.broadcast_to(self._rule(rules[code - 1], params, cache),
+                                   (n, ))
+            codes[mask] = code
+        return codes
+
+    def signals(self, prices: np.ndarray, param: dict = {}) -> np.ndarray:
+        """Signal of every tick
+
+        Args:
+            prices (np.ndarray): prices
+            param (dict, optional): parameters, added to the spec's params
+
+        Returns:
+            np.ndarray: index of the signal in self.signal_names per tick
+        """
+        prices = np.asarray(prices, dtype=np.float64)
+        return self._signals(self._params(param), {("price", ): prices},
+                             len(prices))
+
+    def backtest(self,
+                 prices: np.ndarray,
+                 param: dict,
+                 start_cash: float,
+                 start_coin: float = 0,
+                 fee_rate: float = 0.0015) -> dict:
+        """Backtest one parameter set
+
+        Returns:
+            dict: portfolio, as Strategy.backtest()
+        """
+        return self.sweep(prices, [param], start_cash, start_coin,
+                          fee_rate)[0]
+
+    def sweep(self,
+              prices: np.ndarray,
+              params: list,
+              start_cash: float,
+              start_coin: float = 0,
+              fee_rate: float = 0.0015) -> list:
+        """Backtest many parameter sets on the same prices
+
+        Args:
+            prices (np.ndarray): prices
+            params (list): parameter dicts, added to the spec's params
+            start_cash (float): start cash
+            start_coin (float, optional): start coin. Defaults to 0.
+            fee_rate (float, optional): fee rate of BacktestMarket. Defaults to 0.0015.
+
+        Returns:
+            list: portfolio per parameter set
+        """
+        prices = np.asarray(prices, dtype=np.float64)
+        cache = {("price", ): prices}
+        finder = _CrossFinder(prices)
+        results = []
+        for param in params:
+            params_ = self._params(param)
+            codes = self._signals(params_, cache, len(prices))
+            results.append(
+                self._simulate(prices, codes, params_, finder, start_cash,
+                               start_coin, fee_rate))
+        return results
+
+    def _simulate(self, prices, codes, params, finder, start_cash,
+                  start_coin, fee_rate) -> dict:
+        n = len(prices)
+        actions = {}
+        for code, signal in enumerate(self.signal_names):
+            action = self.spec["actions"].get(signal)
+            if action is not None:
+                tp = action.get("take_profit")
+                actions[code] = (action["side"],
+                                 self._value(action["quantity"], params),
+                                 None if tp is None else self._value(tp, params))
+        ticks = np.flatnonzero(np.isin(codes, list(actions)))
+        # Strategy.trade_limiter()
+        enabled = os.environ.get("TRADE_ENABLE", "1") == "1"
+        order_num_max = int(os.environ.get("ORDER_NUM_MAX", "99999"))
+
+        portfolio = {"trade_count": 0, "cash": start_cash,
+                     "position": start_coin, "total_value": start_cash}
+
+        def fill(side, quantity, price):
+            # BacktestMarket._execute_buy_order() / _execute_sell_order()
+            if side == "Buy":
+                if portfolio["cash"] < quantity * price:
+                    return False
+                portfolio["cash"] -= quantity * price
+                portfolio["position"] += quantity
+            else:
+                if portfolio["position"] < quantity:
+                    return False
+                portfolio["cash"] += quantity * price
+                portfolio["position"] -= quantity
+            portfolio["position"] -= quantity * fee_rate
+            portfolio["trade_count"] += 1
+            return True
+
+        # Open limit orders by the tick they are crossed next and placement
+        # order: (tick, order id, side, quantity, price)
+        events = []
+        open_orders = 0
+        order_id = 0
+
+        def check_orders(until):
+            nonlocal open_orders
+            while events and events[0][0] <= until:
+                tick, oid, side, quantity, level = heapq.heappop(events)
+                if fill(side, quantity, prices[tick]):
+                    open_orders -= 1
+                    continue
+                # Failed orders stay open and are tried at the next crossing
+                tick = finder.find(level, tick + 1, side == "Sell")
+                if tick < n:
+                    heapq.heappush(events, (tick, oid, side, quantity, level))
+
+        for t in ticks:
+            t = int(t)
+            check_orders(t - 1)
+            if enabled and order_num_max > open_orders:
+                side, quantity, take_profit = actions[codes[t]]
+                price = prices[t]
+                if fill(side, quantity, price) and take_profit is not None:
+                    exit_side = "Sell" if side == "Buy" else "Buy"
+                    level = price * take_profit
+                    order_id += 1
+                    open_orders += 1
+                    tick = finder.find(level, t, exit_side == "Sell")
+                    if tick < n:
+                        heapq.heappush(events, (tick, order_id, exit_side,
+                                                quantity, level))
+            check_orders(t)
+        check_orders(n - 1)
+        if n:
+            portfolio["total_value"] = portfolio["cash"] + \
+                portfolio["position"] * prices[-1]
+        return portfolio
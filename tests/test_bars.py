@@ -0,0 +1,91 @@
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.append(".")
+from src.bitbacktest.market import BacktestMarket
+from src.bitbacktest.develop.strategy_cust import MACDForcusBuyStrategy
+from src.bitbacktest.data_generater import random_data
+from src.bitbacktest.ledger import SELL
+
+price_data = random_data(1e7, 0.002, 6000, 111)
+
+
+def to_bars(prices, size):
+    n = len(prices) // size
+    ticks = prices[:n * size].reshape(n, size)
+    return np.column_stack(
+        (ticks[:, 0], ticks.max(axis=1), ticks.min(axis=1), ticks[:, -1]))
+
+
+def run_bar(market, place):
+    market.reset_portfolio(1000, 1)
+    market.set_current_index(0)
+    place(market)
+    market.set_current_index(1)
+    market.check_order()
+    return market.ledger.fills
+
+
+class TestBars(unittest.TestCase):
+
+    def test_fill_at_order_price(self):
+        ohlc = [[100, 100, 100, 100], [101, 106, 99, 102]]
+        fills = run_bar(BacktestMarket.from_ohlc(ohlc),
+                        lambda m: m.place_limit_order("Sell", 0.5, 105))
+        self.assertEqual(fills["price"].tolist(), [105])
+        self.assertEqual(fills["index"].tolist(), [1])
+        # The open gapped over the limit price
+        ohlc = [[100, 100, 100, 100], [107, 108, 104, 104]]
+        fills = run_bar(BacktestMarket.from_ohlc(ohlc),
+                        lambda m: m.place_limit_order("Sell", 0.5, 105))
+        self.assertEqual(fills["price"].tolist(), [107])
+
+    def test_intrabar_path(self):
+        ohlc = [[100, 100, 100, 100], [100, 106, 94, 101]]
+        expected = {"ohlc": 105, "olhc": 95, "auto": 95}
+        for intrabar, price in expected.items():
+            fills = run_bar(
+                BacktestMarket.from_ohlc(ohlc, intrabar=intrabar),
+                lambda m: m.place_oco_order("Sell", 0.5, 105, 95))
+            self.assertEqual(fills["price"].tolist(), [price])
+        with self.assertRaises(ValueError):
+            BacktestMarket(np.ones(3), high=np.ones(3), low=np.ones(2))
+
+    def test_trailing_stop_in_bar(self):
+        # Peak 110 in the bar, then falls through 110 * 0.95
+        ohlc = [[100, 100, 100, 100], [100, 110, 90, 92]]
+        fills = run_bar(
+            BacktestMarket.from_ohlc(ohlc, intrabar="ohlc"),
+            lambda m: m.place_trailing_stop_order("Sell", 0.5, 0.05))
+        self.assertAlmostEqual(fills["price"][0], 104.5)
+
+    def test_strategy_on_bars(self):
+        bars = to_bars(price_data, 20)
+        strategy = MACDForcusBuyStrategy(BacktestMarket.from_ohlc(bars))
+        strategy.reset_all(
+            {
+                "short_window": 12,
+                "long_window": 26,
+                "signal_window": 9,
+                "one_order_quantity": 0.01,
+                "profit": 1.003
+            }, 1e6)
+        strategy.backtest()
+        market = strategy.market
+        self.assertEqual(len(market.hist["total_value_hist"]), len(bars))
+        fills = market.ledger.fills
+        sells = fills[fills["side"] == SELL]
+        self.assertGreater(len(sells), 0)
+        # Take-profits fill at their price, after the bar of their buy
+        buys = {f["order_id"]: f for f in fills}
+        for sell in sells:
+            buy = buys[sell["parent_id"]]
+            self.assertGreater(sell["index"], buy["index"])
+            self.assertGreaterEqual(sell["price"], buy["price"] * 1.003 - 1e-6)
+            self.assertLessEqual(sell["price"], bars[sell["index"], 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
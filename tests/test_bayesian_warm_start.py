@@ -0,0 +1,89 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(".")
+from src.bitbacktest.strategy import MACDStrategy
+from src.bitbacktest.market import BacktestMarket
+from src.bitbacktest.backtester import GridBacktester, BayesianBacktester
+from src.bitbacktest.data_generater import random_data
+from skopt.space import Integer
+
+price_data = random_data(1e7, 0.002, 300, 111)
+target_params = {
+    "short_window": Integer(4, 20, name="short_window"),
+    "long_window": 26,
+    "signal_window": 9,
+    "one_order_quantity": 0.01
+}
+
+
+class TestBayesianWarmStart(unittest.TestCase):
+
+    def setUp(self):
+        self.strategy = MACDStrategy(BacktestMarket(price_data))
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "checkpoint.jsonl")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_prior_results_seed_optimizer(self):
+        grid = GridBacktester(self.strategy)
+        params = [dict(target_params, short_window=s) for s in range(4, 21, 2)]
+        # Out of the space or with other fixed params, ignored
+        params.append(dict(target_params, short_window=40))
+        params.append(dict(target_params, short_window=6, long_window=30))
+        grid.backtest(params, 1e6)
+        best_grid = max(r["total_value"] for r in grid.test_results[:-2])
+
+        backtester = BayesianBacktester(self.strategy)
+        best_value, _ = backtester.backtest(
+            target_params, 1e6, n_calls=3,
+            prior_results=zip(grid.grid_backtest_params, grid.test_results))
+        self.assertEqual(backtester.count, 3)
+        self.assertGreaterEqual(best_value, best_grid)
+
+    def test_checkpoint_resume(self):
+        backtester = BayesianBacktester(self.strategy)
+        first_value, _ = backtester.backtest(target_params, 1e6, n_calls=10,
+                                             checkpoint_path=self.path)
+        self.assertEqual(len(BayesianBacktester.read_checkpoint(self.path)), 10)
+
+        # A killed run leaves a broken last line
+        with open(self.path, "a") as f:
+            f.write('{"params": {"short')
+        backtester = BayesianBacktester(self.strategy)
+        value, _ = backtester.backtest(target_params, 1e6, n_calls=12,
+                                       checkpoint_path=self.path)
+        self.assertEqual(backtester.count, 12)
+        self.assertEqual(len(BayesianBacktester.read_checkpoint(self.path)), 12)
+        self.assertGreaterEqual(value, first_value)
+
+        # Nothing left to run
+        backtester = BayesianBacktester(self.strategy)
+        again, _ = backtester.backtest(target_params, 1e6, n_calls=12,
+                                       checkpoint_path=self.path)
+        self.assertEqual(again, value)
+
+    def test_checkpoint_resume_narrower_space(self):
+        backtester = BayesianBacktester(self.strategy)
+        backtester.backtest(target_params, 1e6, n_calls=10,
+                            checkpoint_path=self.path)
+        done = BayesianBacktester.read_checkpoint(self.path)
+        n_inside = sum(4 <= p["short_window"] <= 12 for p, _ in done)
+
+        # Evaluations out of the new space do not count as done
+        narrow = dict(target_params,
+                      short_window=Integer(4, 12, name="short_window"))
+        backtester = BayesianBacktester(self.strategy)
+        backtester.backtest(narrow, 1e6, n_calls=n_inside + 2,
+                            checkpoint_path=self.path)
+        self.assertEqual(backtester.count, n_inside + 2)
+        self.assertEqual(len(BayesianBacktester.read_checkpoint(self.path)),
+                         12)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.append(".")
+from src.bitbacktest.develop.strategy_cust import MACDForcusBuyStrategy
+from src.bitbacktest.strategy import MovingAverageCrossoverStrategy
+from src.bitbacktest.market import BacktestMarket
+from src.bitbacktest.data_generater import random_data
+from src.bitbacktest.checkpoint import Checkpointer, load_checkpoint
+
+price_data = random_data(1e7, 0.002, 3000, 111)
+param = {
+    "short_window": 12,
+    "long_window": 26,
+    "signal_window": 9,
+    "one_order_quantity": 0.01,
+    "profit": 1.004,
+    "stop_loss": 0.996
+}
+
+
+class Crash(Exception):
+    pass
+
+
+class CrashingCheckpointer(Checkpointer):
+    """Stops the backtest after "crash_after" checkpoints"""
+
+    def __init__(self, *args, crash_after=2, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.crash_after = crash_after
+
+    def save(self, strategy):
+        super().save(strategy)
+        self.crash_after -= 1
+        if self.crash_after == 0:
+            raise Crash()
+
+
+def new_strategy():
+    strategy = MACDForcusBuyStrategy(BacktestMarket(price_data))
+    strategy.reset_all(param, 1e6, 0.1)
+    return strategy
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "ckpt")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_resume_after_crash(self):
+        full = new_strategy()
+        expected = dict(full.backtest(hold_params=["count"]))
+
+        strategy = new_strategy()
+        with self.assertRaises(Crash):
+            strategy.backtest(hold_params=["count"],
+                              checkpoint=CrashingCheckpointer(self.path,
+                                                              every_ticks=700))
+        # Bytes of a checkpoint that was not committed are ignored
+        with open(os.path.join(self.path, "hist.total_value_hist.pkl"),
+                  "ab") as f:
+            f.write(b"partial")
+        self.assertEqual(
+            len(load_checkpoint(self.path)["market"]["hist"]
+                ["total_value_hist"]), 1400)
+
+        resumed = MACDForcusBuyStrategy(BacktestMarket(price_data))
+        result = resumed.backtest(checkpoint=Checkpointer(self.path,
+                                                          every_ticks=700),
+                                  resume_from=self.path)
+        self.assertEqual(result, expected)
+        self.assertEqual(resumed.market.hist, full.market.hist)
+        self.assertEqual(resumed.hold_params, full.hold_params)
+        self.assertEqual(resumed.market.ledger.fills.tolist(),
+                         full.market.ledger.fills.tolist())
+
+        # The final checkpoint has the full run
+        snapshot = load_checkpoint(self.path)
+        self.assertEqual(snapshot["market"]["hist"], full.market.hist)
+        self.assertEqual(snapshot["dynamic"]["count"], len(price_data))
+
+    def test_array_hold_params(self):
+        # "price_hist" is an array of a different length every tick
+        def new_ma_strategy():
+            strategy = MovingAverageCrossoverStrategy(
+                BacktestMarket(price_data[:500]))
+            strategy.reset_all({"short_window": 5, "long_window": 20,
+                                "one_order_quantity": 0.01}, 1e6)
+            return strategy
+
+        full = new_ma_strategy()
+        expected = dict(full.backtest(hold_params=["price_hist"]))
+        strategy = new_ma_strategy()
+        with self.assertRaises(Crash):
+            strategy.backtest(hold_params=["price_hist"],
+                              checkpoint=CrashingCheckpointer(self.path,
+                                                              every_ticks=100))
+        resumed = MovingAverageCrossoverStrategy(
+            BacktestMarket(price_data[:500]))
+        result = resumed.backtest(checkpoint=Checkpointer(self.path,
+                                                          every_ticks=100),
+                                  resume_from=self.path)
+        self.assertEqual(result, expected)
+        hist = resumed.hold_params["price_hist"]
+        self.assertEqual(len(hist), len(full.hold_params["price_hist"]))
+        for a, b in zip(hist, full.hold_params["price_hist"]):
+            np.testing.assert_array_equal(a, b)
+
+    def test_incremental_history(self):
+        strategy = new_strategy()
+        checkpoint = Checkpointer(self.path, every_ticks=1000)
+        sizes = []
+        save = checkpoint.save
+
+        def save_and_measure(s):
+            save(s)
+            sizes.append(
+                os.path.getsize(
+                    os.path.join(self.path, "hist.total_value_hist.pkl")))
+
+        checkpoint.save = save_and_measure
+        strategy.backtest(checkpoint=checkpoint)
+        # Each checkpoint appends only the new 1000 values
+        growth = [b - a for a, b in zip(sizes, sizes[1:]) if b > a]
+        self.assertTrue(all(g < 1000 * 8 + 200 for g in growth))
+
+    def test_previous_state(self):
+        strategy = new_strategy()
+        strategy.backtest(checkpoint=Checkpointer(self.path, every_ticks=800))
+        with open(os.path.join(self.path, "state.pkl"), "wb") as f:
+            f.write(b"broken")
+        snapshot = load_checkpoint(self.path)
+        self.assertEqual(snapshot["dynamic"]["count"], 2400)
+        self.assertEqual(
+            snapshot["market"]["hist"]["total_value_hist"],
+            strategy.market.hist["total_value_hist"][:2400])
+        with self.assertRaises(ValueError):
+            Checkpointer(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import sys
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(".")
+from src.bitbacktest.strategy import MACDStrategy
+from src.bitbacktest.market import BacktestMarket
+from src.bitbacktest.backtester import GridBacktester, BayesianBacktester
+from src.bitbacktest.data_generater import random_data
+from skopt.space import Integer
+
+price_data = random_data(1e7, 0.002, 300, 111)
+params = [{"short_window": s, "long_window": 26, "signal_window": 9,
+           "one_order_quantity": 0.01} for s in (4, 8, 12)]
+start_cash = 1e6
+
+
+class TestClone(unittest.TestCase):
+
+    def test_clone_shares_data_and_copies_state(self):
+        strategy = MACDStrategy(BacktestMarket(price_data))
+        strategy.reset_all(params[0], start_cash)
+        clone = strategy.clone()
+        self.assertIs(clone.market.data, strategy.market.data)
+        self.assertIsNot(clone.market, strategy.market)
+        self.assertIsNot(clone.dynamic, strategy.dynamic)
+
+        clone.backtest()
+        self.assertEqual(strategy.dynamic.count, 0)
+        self.assertEqual(strategy.market.hist["total_value_hist"], [])
+        self.assertEqual(strategy.market.portfolio["cash"], start_cash)
+
+    def test_concurrent_clones_match_sequential(self):
+        strategy = MACDStrategy(BacktestMarket(price_data))
+        expected = GridBacktester(strategy).backtest(params, start_cash)
+
+        def run(param):
+            clone = strategy.clone()
+            clone.reset_all(param, start_cash)
+            return clone.backtest()
+
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            results = list(pool.map(run, params))
+        self.assertEqual(results, expected)
+
+    def test_bayesian_does_not_mutate_target_params(self):
+        strategy = MACDStrategy(BacktestMarket(price_data))
+        target_params = {
+            "short_window": Integer(4, 12, name="short_window"),
+            "long_window": 26,
+            "signal_window": 9,
+            "one_order_quantity": 0.01
+        }
+        _, best_params = BayesianBacktester(strategy).backtest(
+            target_params, start_cash, n_calls=10)
+        self.assertIsInstance(target_params["short_window"], Integer)
+        self.assertIsNot(best_params, target_params)
+        self.assertIn(best_params["short_window"], range(4, 13))
+
+
+if __name__ == "__main__":
+    unittest.main()
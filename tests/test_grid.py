@@ -0,0 +1,99 @@
+import sys
+import unittest
+from unittest import mock
+
+sys.path.append(".")
+from src.bitbacktest.grid import ParamGrid
+from src.bitbacktest.strategy import MovingAverageCrossoverStrategy
+from src.bitbacktest.market import BacktestMarket
+from src.bitbacktest.backtester import GridBacktester
+from src.bitbacktest.scheduler import CostAwareScheduler
+from src.bitbacktest.data_generater import random_data
+
+
+class TestParamGrid(unittest.TestCase):
+
+    def test_product_and_fixed_values(self):
+        grid = ParamGrid({"a": [1, 2], "b": range(3), "c": 0.5})
+        points = list(grid)
+        self.assertEqual(len(grid), 6)
+        self.assertEqual(grid.size, 6)
+        self.assertEqual(points[0], {"a": 1, "b": 0, "c": 0.5})
+        self.assertTrue(all(p["c"] == 0.5 for p in points))
+
+    def test_constraints(self):
+        grid = ParamGrid({"short_window": [10, 20, 30],
+                          "long_window": [20, 30]},
+                         constraints=[lambda p: p["short_window"] < p["long_window"]])
+        self.assertEqual(list(grid), [
+            {"short_window": 10, "long_window": 20},
+            {"short_window": 10, "long_window": 30},
+            {"short_window": 20, "long_window": 30},
+        ])
+        self.assertEqual(len(grid), 3)
+
+    def test_canonicalize_drops_duplicates(self):
+        # "window" is ignored when "use_filter" is False
+        def canonical(p):
+            if not p["use_filter"]:
+                p["window"] = 10
+            return p
+
+        grid = ParamGrid({"use_filter": [False, True], "window": [10, 20, 30]},
+                         canonicalize=canonical)
+        self.assertEqual(list(grid), [
+            {"use_filter": False, "window": 10},
+            {"use_filter": True, "window": 10},
+            {"use_filter": True, "window": 20},
+            {"use_filter": True, "window": 30},
+        ])
+
+    def test_canonical_form_outside_grid(self):
+        grid = ParamGrid({"a": [1, 2, 3]}, canonicalize=lambda p: {"a": 0})
+        self.assertEqual(list(grid), [{"a": 0}])
+
+    def test_large_grid_is_lazy(self):
+        grid = ParamGrid({k: range(100) for k in "abc"})
+        self.assertEqual(grid.size, 10**6)
+        self.assertEqual(next(iter(grid)), {"a": 0, "b": 0, "c": 0})
+
+    def test_grid_backtester_consumes_grid(self):
+        data = random_data(1e7, 0.002, 200, 111)
+        grid = ParamGrid({"short_window": [5, 50], "long_window": [20, 40],
+                          "one_order_quantity": 0.01},
+                         constraints=[lambda p: p["short_window"] < p["long_window"]])
+        backtester = GridBacktester(
+            MovingAverageCrossoverStrategy(BacktestMarket(data)))
+        results = backtester.backtest(grid, 1e6)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(backtester.grid_backtest_params, list(grid))
+
+        results = backtester.backtest(iter(grid), 1e6)
+        self.assertEqual(len(results), 2)
+
+    def test_parallel_grid_is_scheduled_in_chunks(self):
+        data = random_data(1e7, 0.002, 200, 111)
+        grid = ParamGrid({"short_window": [5, 10, 15], "long_window": [20, 40],
+                          "one_order_quantity": 0.01})
+        backtester = GridBacktester(
+            MovingAverageCrossoverStrategy(BacktestMarket(data)))
+        expected = backtester.backtest(grid, 1e6)
+
+        chunks = []
+        run = CostAwareScheduler.run
+
+        def run_chunk(scheduler, strategy, params, *args, **kwargs):
+            chunks.append(len(params))
+            return run(scheduler, strategy, params, *args, **kwargs)
+
+        with mock.patch.object(CostAwareScheduler, "run", run_chunk):
+            results = backtester.backtest(iter(grid), 1e6, n_workers=2,
+                                          chunk_size=4)
+        self.assertEqual(chunks, [4, 2])
+        self.assertEqual(results, expected)
+        self.assertEqual(backtester.grid_backtest_params, list(grid))
+        self.assertEqual(backtester.schedule_report["n_tasks"], 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import json
+import subprocess
+import sys
+import unittest
+
+HEAVY = ("pandas", "skopt", "sklearn", "scipy", "IPython", "requests",
+         "tqdm", "matplotlib", "plotly", "numba", "boto3", "pyarrow")
+MODULES = ("backtester", "strategy", "market", "sweep", "scheduler",
+           "metrics", "checkpoint", "spec", "vectorize", "kernel",
+           "state_store", "develop.strategy_cust")
+
+CODE = """
+import json, sys, time
+start = time.perf_counter()
+import src.bitbacktest.{module}
+seconds = time.perf_counter() - start
+print(json.dumps([seconds, [m for m in {heavy!r} if m in sys.modules]]))
+"""
+
+
+def import_module(module):
+    out = subprocess.run([sys.executable, "-c",
+                          CODE.format(module=module, heavy=HEAVY)],
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out)
+
+
+class TestImports(unittest.TestCase):
+
+    def test_no_heavy_imports(self):
+        for module in MODULES:
+            seconds, heavy = import_module(module)
+            self.assertEqual(heavy, [], module)
+            # About 0.1s, was more than 2s with pandas and skopt
+            self.assertLess(seconds, 1.0, module)
+
+    def test_features_still_import(self):
+        sys.path.append(".")
+        from src.bitbacktest import backtester
+        from src.bitbacktest.space import is_dimension
+        self.assertTrue(is_dimension(backtester.Integer(1, 3)))
+        with self.assertRaises(AttributeError):
+            backtester.gp_minimize
+
+    def test_star_import(self):
+        names = {}
+        exec("from src.bitbacktest.backtester import *", names)
+        for name in ("Integer", "Real", "Categorical", "GridBacktester",
+                     "MACDStrategy", "BacktestMarket"):
+            self.assertIn(name, names)
+        self.assertEqual(names["Integer"](1, 3).low, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
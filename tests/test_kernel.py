@@ -0,0 +1,138 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.append(".")
+from src.bitbacktest.market import BacktestMarket
+from src.bitbacktest.strategy import MACDStrategy, MovingAverageCrossoverStrategy
+from src.bitbacktest.develop.strategy_cust import MACDForcusBuyStrategy
+from src.bitbacktest.data_generater import random_data
+from src.bitbacktest import kernel
+
+price_data = random_data(1e7, 0.002, 5000, 111)
+param = {
+    "short_window": 12,
+    "long_window": 26,
+    "signal_window": 9,
+    "one_order_quantity": 0.01,
+    "profit": 1.002
+}
+
+
+def run(cls, backend, prices=price_data, split=None, start_coin=0.1):
+    strategy = cls(BacktestMarket(prices))
+    strategy.reset_all(param, 1e6, start_coin)
+    if split is not None:
+        strategy.market = BacktestMarket(prices[:split])
+        strategy.market.reset_portfolio(1e6, start_coin)
+        strategy.backtest(backend="python")
+        snapshot = strategy.snapshot()
+        strategy = cls(BacktestMarket(prices))
+        strategy.restore(snapshot)
+        strategy.backtest(resume=True, backend=backend)
+    else:
+        strategy.backtest(backend=backend)
+    return strategy
+
+
+def state_of(strategy):
+    market = strategy.market
+    return {
+        "portfolio": market.portfolio,
+        "hist": market.hist,
+        "fills": market.ledger.fills.tolist(),
+        "orders": [(o.order_id, o.parent_id, o.side, o.quantity, o.price)
+                   for o in market.get_open_orders()],
+        "order_count": market.order_count,
+        "last_order_id": market.last_order_id,
+        "index": market.index,
+        "dynamic": strategy.dynamic.to_dict(),
+    }
+
+
+class TestKernel(unittest.TestCase):
+
+    def assertSameRun(self, cls, **kwargs):
+        expected = state_of(run(cls, "python", **kwargs))
+        actual = state_of(run(cls, "kernel", **kwargs))
+        self.assertEqual(actual, expected)
+        return actual
+
+    def test_parity(self):
+        for cls in (MACDStrategy, MACDForcusBuyStrategy):
+            state = self.assertSameRun(cls)
+            self.assertGreater(state["portfolio"]["trade_count"], 100)
+        # Open take-profit orders are left at the end
+        self.assertGreater(len(state["orders"]), 0)
+
+    def test_parity_resume(self):
+        for cls in (MACDStrategy, MACDForcusBuyStrategy):
+            self.assertSameRun(cls, split=2000)
+
+    def test_parity_limits(self):
+        # Failed orders without cash or coin, and ORDER_NUM_MAX
+        self.assertSameRun(MACDStrategy, start_coin=0)
+        with mock.patch.dict(os.environ, {"ORDER_NUM_MAX": "3"}):
+            self.assertSameRun(MACDForcusBuyStrategy)
+        with mock.patch.dict(os.environ, {"TRADE_ENABLE": "0"}):
+            self.assertSameRun(MACDForcusBuyStrategy)
+
+    def test_fallback(self):
+        # No kernel for the class, or parameters it does not support
+        strategy = MovingAverageCrossoverStrategy(BacktestMarket(price_data))
+        strategy.reset_all({"short_window": 5, "long_window": 20,
+                            "one_order_quantity": 0.01}, 1e6)
+        self.assertFalse(kernel.run_kernel(strategy))
+        with self.assertRaises(ValueError):
+            strategy.backtest(backend="kernel")
+        strategy = MACDForcusBuyStrategy(BacktestMarket(price_data))
+        strategy.reset_all(dict(param, stop_loss=0.99), 1e6)
+        with self.assertRaises(ValueError):
+            kernel.run_kernel(strategy, required=True)
+        with self.assertRaises(ValueError):
+            strategy.backtest(hold_params=["macd_values"], backend="kernel")
+
+    def test_auto_without_numba(self):
+        strategy = MACDStrategy(BacktestMarket(price_data))
+        strategy.reset_all(param, 1e6)
+        with mock.patch.object(kernel, "_numba", lambda: None):
+            self.assertFalse(kernel.run_kernel(strategy))
+
+    @unittest.skipIf(kernel._numba() is None, "numba is not installed")
+    def test_compiled(self):
+        self.assertSameRun(MACDForcusBuyStrategy)
+        self.assertSameRun(MACDStrategy, split=2000)
+        # The loop is compiled in nopython mode with the signal function
+        # as an argument
+        for func in (kernel._loop, kernel.macd_signal):
+            self.assertGreater(len(kernel._compiled[func].nopython_signatures),
+                               0)
+
+    @unittest.skipIf(kernel._numba() is None, "numba is not installed")
+    def test_auto_compiles_long_runs(self):
+        strategy = MACDStrategy(BacktestMarket(price_data))
+        strategy.reset_all(param, 1e6)
+        with mock.patch.object(kernel, "_warm", set()):
+            # A short run is not worth compiling the loop for
+            strategy.backtest()
+            self.assertNotIn(kernel.macd_signal, kernel._warm)
+            with mock.patch.object(kernel, "KERNEL_MIN_TICKS", len(price_data)):
+                strategy.backtest()
+            self.assertIn(kernel.macd_signal, kernel._warm)
+        with mock.patch.object(kernel, "_warm", set()):
+            self.assertTrue(kernel.warm_kernel(strategy))
+            # The warm-up compiles the signature of the backtests
+            loop = kernel._compiled[kernel._loop]
+            n_signatures = len(loop.signatures)
+            strategy.reset_all(param, 1000000, 1)
+            strategy.backtest()
+            self.assertEqual(len(loop.signatures), n_signatures)
+        strategy = MovingAverageCrossoverStrategy(BacktestMarket(price_data))
+        self.assertFalse(kernel.warm_kernel(strategy))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,360 @@
+import ast
+import copy
+import inspect
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+
+sys.path.append(".")
+sys.path.append("app/aws_build")
+from build_lambda_src import (STATE_CODEC_NAMES, find_module_uses,
+                               select_imports)
+from src.bitbacktest.data_generater import random_data
+from src.bitbacktest.utils import dynamodb
+
+STATE = {
+    "ints": [1, 2, 3],
+    "floats": [1.5, 2, -3.25],
+    "empty": [],
+    "flags": [True, False],
+    "names": ["a", "b"],
+    "value": 0.5,
+    "nested": {"ring": [0.0, 1.0]},
+}
+
+
+ENV = {
+    "API_KEY": "key",
+    "API_SECRET": "secret",
+    "TABLE_NAME": "state",
+    "PARAMS_KEY": "MACD",
+    "TRADE_ENABLE": "0",
+    "ORDER_NUM_MAX": "1",
+    "short_window": "12",
+    "long_window": "26",
+    "signal_window": "9",
+    "one_order_quantity": "0.001",
+    "profit": "1.01",
+}
+
+
+class StubTable:
+    """DynamoDB table with the conditions of update_versioned_in_dynamodb()"""
+
+    class ConditionalCheckFailedException(Exception):
+        pass
+
+    def __init__(self):
+        self.items = {}
+        self.gets = 0
+        self.writes = 0
+        self.meta = SimpleNamespace(client=SimpleNamespace(exceptions=self))
+
+    def get_item(self, Key):
+        item = self.items.get(Key["id"])
+        self.gets += 1
+        return {"Item": copy.deepcopy(item)} if item else {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression,
+                    ExpressionAttributeNames, ExpressionAttributeValues):
+        names, values = ExpressionAttributeNames, ExpressionAttributeValues
+        item = copy.deepcopy(self.items.get(Key["id"], Key))
+        if item.get("version", values[":v"]) != values[":v"]:
+            raise self.ConditionalCheckFailedException()
+        sets, _, removes = UpdateExpression[len("SET "):].partition(" REMOVE ")
+        for assignment in sets.split(", "):
+            name, value = assignment.split(" = ")
+            item[names[name]] = values[value]
+        for name in removes.split(", ") if removes else []:
+            del item[names[name]]
+        self.writes += 1
+        self.items[Key["id"]] = item
+
+
+class StubMarket:
+    price = 100.0
+
+    def set_apikey(self, apikey, secret):
+        pass
+
+    def get_current_price(self):
+        return StubMarket.price
+
+
+class SlowTable(StubTable):
+
+    def get_item(self, Key, **kwargs):
+        time.sleep(0.2)
+        return super().get_item(Key, **kwargs)
+
+
+class SlowMarket(StubMarket):
+    orders = []
+
+    def get_current_price(self):
+        time.sleep(0.2)
+        return super().get_current_price()
+
+    def get_open_orders(self):
+        time.sleep(0.2)
+        return SlowMarket.orders
+
+    def open_order_count(self):
+        raise AssertionError("open orders were prefetched")
+
+
+def build(tmp, strategy_class, *options):
+    out_file = os.path.join(tmp, strategy_class + "_".join(options) + ".py")
+    result = subprocess.run([
+        sys.executable, "app/aws_build/build_lambda_src.py", "-d", "src/",
+        "-s", strategy_class, "-o", out_file, *options
+    ],
+                            capture_output=True,
+                            text=True)
+    return result, out_file
+
+
+def load(file_path):
+    with open(file_path) as f:
+        source = f.read()
+    module = {}
+    exec(compile(source, file_path, "exec"), module)
+    return source, module
+
+
+def imported_modules(source):
+    modules = set()
+    for node in ast.parse(source).body:
+        if isinstance(node, ast.Import):
+            modules.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            modules.add(node.module)
+    return modules
+
+
+class TestLambdaBuild(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        result, cls.numpy_file = build(cls.tmp.name, "MACDForcusBuyStrategy")
+        assert result.returncode == 0, result.stderr
+        cls.report = result.stdout
+        result, cls.python_file = build(cls.tmp.name, "MACDForcusBuyStrategy",
+                                        "--no-numpy")
+        assert result.returncode == 0, result.stderr
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_select_imports(self):
+        source = ("import os\nimport json\nimport numpy as np\n"
+                  "from abc import ABC, abstractmethod\nimport os\n"
+                  "class A(ABC):\n    def f(self):\n"
+                  "        return os.path, np.zeros(1)\n")
+        slim, removed = select_imports(source)
+        self.assertEqual(removed, ["import json", "import os"])
+        self.assertEqual(imported_modules(slim), {"os", "numpy", "abc"})
+        slim, removed = select_imports(source, drop_modules=("numpy", ))
+        self.assertNotIn("numpy", imported_modules(slim))
+        self.assertEqual(find_module_uses(source, "np"), ["A.f"])
+
+    def test_imports(self):
+        source, _ = load(self.numpy_file)
+        modules = imported_modules(source)
+        self.assertIn("numpy", modules)
+        self.assertNotIn("datetime", modules)
+        source, _ = load(self.python_file)
+        self.assertNotIn("numpy", imported_modules(source))
+        self.assertIn("cold start import time", self.report)
+
+    def test_codec_compatible(self):
+        _, numpy_module = load(self.numpy_file)
+        _, python_module = load(self.python_file)
+        encoded = numpy_module["convert_for_dynamodb"](STATE)
+        self.assertEqual(python_module["convert_for_dynamodb"](STATE), encoded)
+        decoded = python_module["revert_from_dynamodb"](encoded)
+        self.assertEqual(decoded, STATE)
+        self.assertIsInstance(decoded["floats"], list)
+        decoded = numpy_module["revert_from_dynamodb"](encoded)
+        np.testing.assert_array_equal(decoded["floats"], STATE["floats"])
+
+    def test_table_is_cached(self):
+        _, module = load(self.python_file)
+        boto3 = mock.Mock()
+        module["boto3"] = boto3
+        with mock.patch.dict(os.environ, {"TABLE_NAME": "state"}):
+            table = module["get_table"]()
+            self.assertIs(module["get_table"](), table)
+        boto3.resource.assert_called_once_with("dynamodb")
+
+    def invoke(self, module, prices):
+        for price in prices:
+            StubMarket.price = price
+            module["lambda_handler"]({}, None)
+
+    def test_handler_state_cache(self):
+        _, module = load(self.numpy_file)
+        table = StubTable()
+        module.update(_table=table, BitflyerMarket=StubMarket,
+                      traceback=mock.Mock())
+        revert = module["revert_attribute"]
+        with mock.patch.dict(os.environ, ENV):
+            # State is read once, and not written while it does not change
+            self.invoke(module, [100.0] * 5)
+            self.assertEqual(table.gets, 1)
+            self.assertLess(table.writes, 5)
+            item = table.items["MACD"]
+            self.assertEqual(item["version"], table.writes)
+            self.assertEqual(revert(item["prices"]), 100.0)
+
+            # Only the keys that changed are written
+            writes = table.writes
+            old = module["encode_binary"](-1.0)
+            item["emalong_values"] = item["signal_line_values_old"] = old
+            self.invoke(module, [100.0])
+            self.assertEqual(table.writes, writes)
+            self.invoke(module, [101.0])
+            self.assertEqual(table.writes, writes + 1)
+            self.assertEqual(revert(item["prices"]), 100.0)
+            item = table.items["MACD"]
+            self.assertEqual(revert(item["prices"]), 101.0)
+            self.assertNotEqual(item["emalong_values"], old)
+            self.assertEqual(item["signal_line_values_old"], old)
+            item["signal_line_values_old"] = module["encode_binary"](0.0)
+
+            # Another writer saved a newer state: the write of the cached
+            # one is rejected, and the next invocation reads the newer one
+            item["version"] += 1
+            item["prices"] = module["encode_binary"](99.0)
+            signals = []
+            generate = module["MACDForcusBuyStrategy"].generate_signals
+
+            def record(strategy, price):
+                signals.append(strategy.dynamic["prices"])
+                return generate(strategy, price)
+
+            with mock.patch.object(module["MACDForcusBuyStrategy"],
+                                   "generate_signals", record):
+                self.invoke(module, [103.0, 104.0])
+            self.assertEqual(signals, [101.0, 99.0])
+            self.assertEqual(table.gets, 2)
+            self.assertEqual(table.items["MACD"]["version"], item["version"] + 1)
+            self.assertEqual(revert(table.items["MACD"]["prices"]), 104.0)
+
+    def test_handler_migration(self):
+        # Items saved in the map format, without versions, are read and their
+        # keys that change are written in the binary format
+        _, module = load(self.numpy_file)
+        state = {"prices": 100.0, "emashort_values": 100.0,
+                 "emalong_values": 100.0, "macd_values": 0.0,
+                 "macd_values_old": 0.0, "signal_line_values": 0.0,
+                 "signal_line_values_old": 0.0}
+        table = StubTable()
+        table.items["MACD"] = {"id": "MACD"}
+        table.items["MACD"].update(
+            (k, module["convert_for_dynamodb"](v)) for k, v in state.items())
+        module.update(_table=table, BitflyerMarket=StubMarket)
+        with mock.patch.dict(os.environ, ENV):
+            self.invoke(module, [101.0])
+        item = table.items["MACD"]
+        self.assertEqual(item["version"], 1)
+        self.assertEqual(item["macd_values_old"], {"F": "0.0"})
+        self.assertEqual(module["revert_attribute"](item["prices"]), 101.0)
+
+    def test_binary_codec(self):
+        for file_path in (self.numpy_file, self.python_file):
+            _, module = load(file_path)
+            prices = [float(round(p)) for p in random_data(1e7, 0.002, 2000, 111)]
+            for value in (STATE, prices, [2**70, -1], -0.0, [-0.0, 1.0],
+                          [1.5, float("nan")]):
+                legacy = module["revert_from_dynamodb"](
+                    module["convert_for_dynamodb"](value))
+                for compression in ("none", "zlib"):
+                    encoded = module["encode_binary"](value, compression)
+                    self.assertEqual(repr(module["decode_binary"](encoded)),
+                                     repr(legacy))
+            # Prices are saved as compressed deltas
+            legacy_size = len(json.dumps(module["convert_for_dynamodb"](prices)))
+            self.assertLess(len(module["encode_binary"](prices)) * 3,
+                            legacy_size)
+            # Deltas only where they are exact, the same bytes as utils
+            for value in (prices, [2**62, -2**62], [2**62, -2**62 - 1],
+                          [-2**63, 2**63 - 1], [-2**62, 2**62 - 1],
+                          [0.0, -0.0], [2.0**53, 1.0], [float("inf"), 1.0],
+                          [3, -5, 7], [1.0, 2.5]):
+                self.assertEqual(module["encode_binary"](value, "none"),
+                                 dynamodb.encode_binary(value, "none"))
+
+    def test_state_codec_from_utils(self):
+        # The handler uses the codec of utils/dynamodb.py, not a copy
+        with open("app/aws_build/_lambda_base.py") as f:
+            self.assertNotIn("def encode_binary", f.read())
+        for file_path in (self.numpy_file, self.python_file):
+            source, _ = load(file_path)
+            for name in STATE_CODEC_NAMES:
+                value = getattr(dynamodb, name)
+                if callable(value):
+                    self.assertIn(inspect.getsource(value), source)
+
+    def test_handler_prefetch(self):
+        _, module = load(self.numpy_file)
+        module.update(_table=SlowTable(), BitflyerMarket=SlowMarket)
+        strategy_class = module["MACDForcusBuyStrategy"]
+        env = dict(ENV, TRADE_ENABLE="1")
+        with mock.patch.dict(os.environ, env), \
+             mock.patch.object(strategy_class, "execute_trade") as execute:
+            # The state, the price and the open orders are read in parallel
+            SlowMarket.orders = []
+            start = time.perf_counter()
+            response = module["lambda_handler"]({}, None)
+            elapsed = time.perf_counter() - start
+            self.assertLess(elapsed, 0.5)
+            body = json.loads(response["body"])
+            self.assertEqual(body["signal"], "Hold")
+            self.assertLessEqual(body["latency_ms"], elapsed * 1000)
+            execute.assert_called_once()
+
+            SlowMarket.orders = [{"child_order_id": "1"}]
+            module["lambda_handler"]({}, None)
+            execute.assert_called_once()
+
+    def test_handler_state_read_failure(self):
+        # A failed read of the state places no order and writes nothing
+        _, module = load(self.numpy_file)
+        table = StubTable()
+        table.get_item = mock.Mock(side_effect=RuntimeError("throttled"))
+        module.update(_table=table, BitflyerMarket=SlowMarket,
+                      traceback=mock.Mock())
+        strategy_class = module["MACDForcusBuyStrategy"]
+        env = dict(ENV, TRADE_ENABLE="1")
+        with mock.patch.dict(os.environ, env), \
+             mock.patch.object(strategy_class, "execute_trade") as execute:
+            SlowMarket.orders = []
+            response = module["lambda_handler"]({}, None)
+        execute.assert_not_called()
+        self.assertEqual(table.writes, 0)
+        self.assertIsNone(json.loads(response["body"])["signal"])
+        module["traceback"].print_exc.assert_called_once()
+
+    def test_no_numpy_rejected(self):
+        result, out_file = build(self.tmp.name,
+                                 "MovingAverageCrossoverStrategy",
+                                 "--no-numpy")
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("MovingAverageCrossoverStrategy.generate_signals",
+                      result.stderr)
+        self.assertFalse(os.path.exists(out_file))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import sys
+import time
+import unittest
+
+import numpy as np
+
+sys.path.append(".")
+from src.bitbacktest.market import BacktestMarket
+from src.bitbacktest.develop.strategy_cust import MACDForcusBuyStrategy
+from src.bitbacktest.data_generater import random_data
+from src.bitbacktest.ledger import (TradeLedger, match_round_trips,
+                                    FILL_DTYPE, BUY, SELL)
+
+price_data = random_data(1e7, 0.002, 1500, 111)
+
+
+def make_fills(rows):
+    ledger = TradeLedger(capacity=1)
+    for i, row in enumerate(rows):
+        ledger.append(row[0], row[1], row[2], row[3], 0.0, i,
+                      row[4] if len(row) > 4 else None)
+    return ledger.fills
+
+
+def reference_match(fills, lifo=False):
+    # Plain loop, one open lot per buy
+    lots = []
+    trips = []
+    for f in fills:
+        if f["side"] == BUY:
+            lots.append([f["index"], f["price"], f["qty"]])
+            continue
+        q = f["qty"]
+        while q > 1e-12 and lots:
+            lot = lots[-1] if lifo else lots[0]
+            m = min(q, lot[2])
+            trips.append((lot[0], f["index"], m, m * (f["price"] - lot[1])))
+            q -= m
+            lot[2] -= m
+            if lot[2] <= 1e-12:
+                lots.remove(lot)
+    return trips
+
+
+class TestLedger(unittest.TestCase):
+
+    def test_fifo_lifo(self):
+        fills = make_fills([
+            (0, BUY, 1.0, 100.),
+            (1, BUY, 2.0, 110.),
+            (2, SELL, 1.5, 120.),
+            (3, BUY, 1.0, 90.),
+            (4, SELL, 2.5, 100.),
+        ])
+        for method, lifo in (("fifo", False), ("lifo", True)):
+            trips = match_round_trips(fills, method)
+            expected = reference_match(fills, lifo)
+            self.assertEqual(len(trips), len(expected))
+            for t, e in zip(trips, expected):
+                self.assertEqual((t["entry_index"], t["exit_index"]), e[:2])
+                self.assertAlmostEqual(t["qty"], e[2])
+                self.assertAlmostEqual(t["pnl"], e[3])
+            self.assertTrue(np.all(trips["holding"] >= 0))
+
+    def test_start_position(self):
+        fills = make_fills([(0, SELL, 1.0, 100.), (1, BUY, 1.0, 90.),
+                            (2, SELL, 1.0, 95.)])
+        for method in ("fifo", "lifo"):
+            trips = match_round_trips(fills, method, start_position=1.0)
+            self.assertEqual(len(trips), 1)
+            self.assertEqual(trips[0]["exit_index"], 2)
+
+    def test_large_fifo(self):
+        rng = np.random.RandomState(0)
+        n = 200000
+        side = np.where(np.arange(n) % 2 == 0, BUY, SELL)
+        fills = np.zeros(n, dtype=FILL_DTYPE)
+        fills["index"] = np.arange(n)
+        fills["side"] = side
+        # Sells never exceed the open position, as in BacktestMarket
+        fills["qty"] = np.where(side == BUY, rng.randint(2, 5, n),
+                                rng.randint(1, 3, n)) / 100
+        fills["price"] = 100 + rng.randn(n)
+        fills["order_id"] = np.arange(n)
+        start = time.perf_counter()
+        trips = match_round_trips(fills, "fifo")
+        self.assertLess(time.perf_counter() - start, 1.0)
+        sold = min(fills["qty"][side == BUY].sum(), fills["qty"][side == SELL].sum())
+        self.assertAlmostEqual(trips["qty"].sum(), sold)
+        expected = reference_match(fills[:2000])
+        small = match_round_trips(fills[:2000], "fifo")
+        self.assertAlmostEqual(small["pnl"].sum(), sum(e[3] for e in expected))
+
+    def test_forcus_buy_linked(self):
+        strategy = MACDForcusBuyStrategy(BacktestMarket(price_data))
+        strategy.reset_all(
+            {
+                "short_window": 12,
+                "long_window": 26,
+                "signal_window": 9,
+                "one_order_quantity": 0.01,
+                "profit": 1.002
+            }, 1e6)
+        strategy.backtest()
+        market = strategy.market
+        fills = market.ledger.fills
+        self.assertEqual(len(fills), market.portfolio["trade_count"])
+        sells = fills[fills["side"] == SELL]
+        self.assertGreater(len(sells), 0)
+        self.assertTrue(np.all(sells["parent_id"] >= 0))
+        trips = match_round_trips(fills, "linked")
+        self.assertEqual(len(trips), len(sells))
+        self.assertTrue(np.all(trips["exit_price"] >= trips["entry_price"]))
+        self.assertTrue(np.allclose(trips["fee"],
+                                    0.01 * market.fee_rate *
+                                    (trips["entry_price"] + trips["exit_price"])))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.append(".")
+from src.bitbacktest.strategy import MACDStrategy
+from src.bitbacktest.market import BacktestMarket
+from src.bitbacktest.backtester import GridBacktester
+from src.bitbacktest.data_generater import random_data
+from src.bitbacktest.metrics import Metrics, compute_metrics, METRICS
+
+price_data = random_data(1e7, 0.002, 600, 111)
+
+
+def manual_market():
+    # Buy 1 at 100, hold while the price falls to 80, sell at 110
+    prices = np.array([100., 90., 80., 95., 110., 105.])
+    market = BacktestMarket(prices, fee_rate=0.01)
+    market.reset_portfolio(1000, 0)
+    for i, price in enumerate(prices):
+        market.set_current_index(i)
+        if i == 0:
+            market.place_market_order("Buy", 1)
+        if i == 4:
+            market.place_market_order("Sell", 0.98)
+        market.save_history(price)
+    return market
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_manual(self):
+        market = manual_market()
+        m = compute_metrics(market)
+        self.assertEqual(set(m), set(METRICS))
+        values = np.array(market.hist["total_value_hist"])
+        self.assertAlmostEqual(m["max_drawdown"], 1 - values.min() / 1000)
+        # Below the start value from tick 0 until 110 at tick 4
+        self.assertEqual(m["drawdown_duration"], 4)
+        # Fees are paid in coin: 0.01 at 100 and 0.0098 at 110
+        self.assertAlmostEqual(m["fee_drag"], (0.01 * 100 + 0.0098 * 110) / 1000)
+        self.assertAlmostEqual(m["turnover"], (100 + 0.98 * 110) / 1000)
+        self.assertTrue(0 < m["exposure"] < 1)
+        self.assertNotEqual(m["sharpe"], 0)
+
+    def test_selected_and_annualized(self):
+        market = manual_market()
+        m = Metrics(["sharpe"], periods_per_year=4).compute(market)
+        self.assertEqual(list(m), ["sharpe"])
+        self.assertAlmostEqual(m["sharpe"],
+                               compute_metrics(market, ["sharpe"])["sharpe"] * 2)
+        with self.assertRaises(ValueError):
+            Metrics(["calmar"])
+
+    def test_backtest_metrics(self):
+        strategy = MACDStrategy(BacktestMarket(price_data))
+        param = {
+            "short_window": 12,
+            "long_window": 26,
+            "signal_window": 9,
+            "one_order_quantity": 0.01
+        }
+        strategy.reset_all(param, 1e6)
+        result = strategy.backtest(metrics=["max_drawdown", "fee_drag"])
+        self.assertEqual(result["max_drawdown"],
+                         compute_metrics(strategy.market,
+                                         ["max_drawdown"])["max_drawdown"])
+        self.assertIn("fee_drag", result)
+        self.assertNotIn("max_drawdown", strategy.market.portfolio)
+
+        results = GridBacktester(strategy).backtest([param], 1e6,
+                                                    metrics=["sortino"])
+        self.assertIn("sortino", results[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+import json
+import sys
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.append(".")
+from src.bitbacktest.market import BacktestMarket, BitflyerMarket
+from src.bitbacktest.develop.strategy_cust import MACDForcusBuyStrategy
+from src.bitbacktest.data_generater import random_data
+
+price_data = random_data(1e7, 0.002, 3000, 111)
+
+
+class ScanMarket(BacktestMarket):
+    """Reference that checks every open order on every tick"""
+
+    def check_order(self):
+        price = self.get_current_price()
+        for order in list(self.order.values()):
+            if order.order_type == "TrailingStop":
+                if order.side == "Sell" and price > order.extreme:
+                    order.extreme, order.price = price, price * (1 - order.trail)
+                if order.side == "Buy" and price < order.extreme:
+                    order.extreme, order.price = price, price * (1 + order.trail)
+        for order in list(self.order.values()):
+            if order.order_id not in self.order:
+                continue
+            crossed = price >= order.price if order.triggers_up \
+                else price <= order.price
+            if crossed and self._fill(order.side, order.quantity,
+                                      order.order_id, order.parent_id):
+                del self.order[order.order_id]
+                if order.oco_id is not None:
+                    self.cancel_order(order.oco_id)
+
+
+def run_random_orders(market, seed):
+    rng = np.random.RandomState(seed)
+    market.reset_portfolio(1e6, 0.5)
+    for i in range(len(market)):
+        market.set_current_index(i)
+        price = market.get_current_price()
+        r = rng.rand()
+        if r < 0.05:
+            market.place_market_order("Buy", 0.01)
+            market.place_oco_order("Sell", 0.01, price * 1.004, price * 0.996,
+                                   parent_id=market.last_order_id)
+        elif r < 0.08:
+            market.place_trailing_stop_order(rng.choice(["Buy", "Sell"]),
+                                             0.01, 0.003)
+        elif r < 0.11:
+            market.place_stop_order("Buy", 0.01, price * 1.002)
+        elif r < 0.14:
+            market.place_limit_order(rng.choice(["Buy", "Sell"]), 0.01,
+                                     price * (1 + rng.uniform(-0.004, 0.004)))
+        elif r < 0.16 and market.order:
+            market.cancel_order(next(iter(market.order)))
+        market.check_order()
+        market.save_history(price)
+    return market
+
+
+class TestOrders(unittest.TestCase):
+
+    def test_same_as_scan(self):
+        for seed in range(3):
+            a = run_random_orders(BacktestMarket(price_data), seed)
+            b = run_random_orders(ScanMarket(price_data), seed)
+            self.assertEqual(a.portfolio, b.portfolio)
+            self.assertEqual(a.hist["total_value_hist"],
+                             b.hist["total_value_hist"])
+            self.assertEqual(sorted(a.order), sorted(b.order))
+            self.assertGreater(a.portfolio["trade_count"], 100)
+
+    def test_stop_and_oco(self):
+        market = BacktestMarket(np.array([100., 103., 99., 95., 96., 106.]))
+        market.reset_portfolio(1000, 1)
+        market.place_oco_order("Sell", 0.5, 105, 96)
+        market.place_stop_order("Buy", 0.1, 102)
+        market.place_trailing_stop_order("Sell", 0.2, 0.05)
+        filled = []
+        for i in range(len(market)):
+            market.set_current_index(i)
+            market.check_order()
+            filled.append(sorted(set(market.ledger.fills["order_id"])))
+        # Stop buy at 103, trailing sell from the peak 103 at 95,
+        # stop-loss at 95 cancels the take-profit at 106
+        self.assertEqual(filled[1], [2])
+        self.assertEqual(filled[3], [1, 2, 3])
+        self.assertEqual(market.open_order_count(), 0)
+
+    def test_trailing_stop_heaps_stay_small(self):
+        # A new high on every tick moves the trailing stop each time
+        market = BacktestMarket(np.arange(100., 1100.))
+        market.reset_portfolio(1000, 1)
+        market.place_trailing_stop_order("Sell", 0.5, 0.05)
+        market.place_limit_order("Sell", 0.5, 1e9)
+        for i in range(len(market)):
+            market.set_current_index(i)
+            market.check_order()
+            self.assertLessEqual(len(market._up) + len(market._down), 20)
+            self.assertLessEqual(len(market._peaks), 20)
+        self.assertEqual(market.open_order_count(), 2)
+        self.assertEqual(market.fork()._down, market._down)
+
+    def test_forcus_buy_fills_every_crossed_order(self):
+        # Orders crossed on the same tick are all filled
+        param = {
+            "short_window": 12,
+            "long_window": 26,
+            "signal_window": 9,
+            "one_order_quantity": 0.01,
+            "profit": 1.002
+        }
+        a = MACDForcusBuyStrategy(BacktestMarket(price_data))
+        a.reset_all(param, 1e6)
+        b = MACDForcusBuyStrategy(ScanMarket(price_data))
+        b.reset_all(param, 1e6)
+        self.assertEqual(a.backtest(), b.backtest())
+
+    def test_forcus_buy_exit_orders(self):
+        param = {
+            "short_window": 12,
+            "long_window": 26,
+            "signal_window": 9,
+            "one_order_quantity": 0.01,
+            "profit": 1.004
+        }
+        for extra, order_type in (({}, "Limit"), ({"stop_loss": 0.996}, "Stop"),
+                                  ({"trailing_stop": 0.003}, "TrailingStop")):
+            strategy = MACDForcusBuyStrategy(BacktestMarket(price_data[:300]))
+            strategy.reset_all(dict(param, **extra), 1e6)
+            strategy.backtest()
+            types = {o.order_type for o in strategy.market.get_open_orders()}
+            self.assertIn(order_type, types)
+
+    def test_forcus_buy_exit_orders_bitflyer(self):
+        # The exit orders are sent as special (parent) orders
+        market = BitflyerMarket()
+        market.set_apikey("key", "secret")
+        param = {"one_order_quantity": 0.01, "profit": 1.01}
+        expected = [
+            ({}, "/v1/me/sendchildorder", None),
+            ({"stop_loss": 0.99}, "/v1/me/sendparentorder", "OCO"),
+            ({"trailing_stop": 0.02}, "/v1/me/sendparentorder", "SIMPLE"),
+        ]
+        for extra, endpoint, method in expected:
+            strategy = MACDForcusBuyStrategy(market)
+            strategy.reset_param(dict(param, **extra))
+            session = mock.Mock()
+            session.post.return_value.json.return_value = {
+                "parent_order_acceptance_id": "p1",
+                "child_order_acceptance_id": "c1"
+            }
+            with mock.patch.object(BitflyerMarket, "_session", session), \
+                 mock.patch.object(BitflyerMarket, "get_current_price",
+                                   return_value=1e7):
+                strategy.place_exit_order(1e7, "c0")
+            url = session.post.call_args.args[0]
+            body = json.loads(session.post.call_args.kwargs["data"])
+            self.assertTrue(url.endswith(endpoint))
+            self.assertEqual(body.get("order_method"), method)
+        conditions = [p["condition_type"] for p in body["parameters"]]
+        self.assertEqual(conditions, ["TRAIL"])
+        self.assertEqual(body["parameters"][0]["offset"], 200000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.append(".")
+from src.bitbacktest.pruning import (Pruner, MaxDrawdownRule, MinEquityRule,
+                                     MaxTradeCountRule, BehindBestRule)
+from src.bitbacktest.strategy import MACDStrategy
+from src.bitbacktest.market import BacktestMarket
+from src.bitbacktest.backtester import GridBacktester
+
+# Price falls to half, so any long position loses
+price_data = np.linspace(1e7, 5e6, 1000)
+param = {"short_window": 4, "long_window": 26, "signal_window": 9,
+         "one_order_quantity": 0.05}
+
+
+class TestPruning(unittest.TestCase):
+
+    def run_backtest(self, pruner):
+        strategy = MACDStrategy(BacktestMarket(price_data))
+        strategy.reset_all(param, 1e5, 1.0)
+        return strategy, strategy.backtest(pruner=pruner)
+
+    def test_not_pruned(self):
+        strategy, result = self.run_backtest(
+            Pruner([MaxDrawdownRule(0.9)], interval=100))
+        self.assertFalse(result["pruned"])
+        self.assertEqual(len(strategy.market.hist["total_value_hist"]), 1000)
+
+    def test_max_drawdown(self):
+        strategy, result = self.run_backtest(
+            Pruner([MaxDrawdownRule(0.2)], interval=100))
+        self.assertTrue(result["pruned"])
+        self.assertIn("drawdown", result["prune_reason"])
+        self.assertLess(result["pruned_at"], 1000)
+        self.assertEqual(len(strategy.market.hist["total_value_hist"]),
+                         result["pruned_at"] + 1)
+
+    def test_min_equity_and_trade_count(self):
+        _, result = self.run_backtest(Pruner([MinEquityRule(0.8)], interval=50))
+        self.assertTrue(result["pruned"])
+        _, result = self.run_backtest(
+            Pruner([MaxTradeCountRule(0)], interval=10, warmup=0))
+        self.assertEqual(result["prune_reason"][:11], "trade_count")
+
+    def test_behind_best_in_grid(self):
+        pruner = Pruner([BehindBestRule(0.05)], interval=100)
+        no_trade = dict(param, one_order_quantity=0.0)
+        backtester = GridBacktester(MACDStrategy(BacktestMarket(price_data)))
+        # Holding 1 coin is the best finished run
+        results = backtester.backtest([no_trade], 1e5, 1.0, pruner=pruner)
+        self.assertFalse(results[0]["pruned"])
+        self.assertEqual(len(pruner.best_curve), 1000)
+        # A run without coin is far behind it at the same index
+        results = backtester.backtest([no_trade], 1e5, 0.0, pruner=pruner)
+        self.assertTrue(results[0]["pruned"])
+        self.assertEqual(results[0]["pruned_at"], 99)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import sys
+import tempfile
+import unittest
+
+sys.path.append(".")
+from src.bitbacktest.results import ResultSink, TopKResults
+from src.bitbacktest.grid import ParamGrid
+from src.bitbacktest.strategy import MACDStrategy
+from src.bitbacktest.market import BacktestMarket
+from src.bitbacktest.backtester import GridBacktester
+from src.bitbacktest.data_generater import random_data
+
+grid = ParamGrid({"short_window": [4, 8, 12], "long_window": [26, 52],
+                  "signal_window": 9, "one_order_quantity": 0.01})
+
+
+class TestTopKResults(unittest.TestCase):
+
+    def test_keeps_best(self):
+        top = TopKResults(2)
+        for i, v in enumerate([3, 1, 5, 4, 2]):
+            top.push({"i": i}, {"total_value": v})
+        self.assertEqual([r["total_value"] for _, r in top.items()], [5, 4])
+
+        top = TopKResults(2, maximize=False)
+        for i, v in enumerate([3, 1, 5, 4, 2]):
+            top.push({"i": i}, {"total_value": v})
+        self.assertEqual([r["total_value"] for _, r in top.items()], [1, 2])
+
+
+class TestResultSink(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_batches_and_read_back(self):
+        with ResultSink(self.tmpdir.name, batch_size=2, format="npz") as sink:
+            for i in range(5):
+                sink.append({"a": i, "name": "x"},
+                            {"total_value": float(i), "pruned": None})
+        sink = ResultSink(self.tmpdir.name, format="npz")
+        rows = list(sink.rows())
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[3], ({"a": 3, "name": "x"},
+                                   {"total_value": 3.0, "pruned": None}))
+        completed = sink.completed()
+        self.assertTrue(ResultSink.is_completed(completed, {"name": "x", "a": 4}))
+        self.assertFalse(ResultSink.is_completed(completed, {"a": 5, "name": "x"}))
+        self.assertEqual(len(sink.to_dataframe()), 5)
+
+    def test_resume_and_top_k(self):
+        data = random_data(1e7, 0.002, 200, 111)
+        backtester = GridBacktester(MACDStrategy(BacktestMarket(data)))
+        expected = backtester.backtest(grid, 1e6)
+
+        sink = ResultSink(self.tmpdir.name, batch_size=2, format="npz")
+        params = list(grid)
+        backtester.backtest(params[:3], 1e6, sink=sink)
+        backtester.backtest(grid, 1e6, sink=sink, top_k=2, keep_results=False)
+        self.assertEqual(backtester.test_results, [])
+        self.assertEqual(len(list(sink.rows())), len(params))
+
+        # The runs in the sink are ranked with the resumed ones
+        resumed = backtester.top_results.items()
+        backtester.backtest(grid, 1e6, top_k=2)
+        self.assertEqual(resumed, backtester.top_results.items())
+        self.assertEqual([r for _, r in resumed],
+                         sorted(expected, key=lambda r: -r["total_value"])[:2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import pickle
+import sys
+import unittest
+
+sys.path.append(".")
+from src.bitbacktest.strategy import (MACDStrategy,
+                                      MovingAverageCrossoverStrategy,
+                                      BollingerBandsStrategy)
+from src.bitbacktest.develop.strategy_cust import MACDForcusBuyStrategy
+from src.bitbacktest.market import BacktestMarket
+from src.bitbacktest.data_generater import random_data
+
+price_data = random_data(1e7, 0.002, 3000, 111)
+cases = [
+    (MovingAverageCrossoverStrategy, {
+        "short_window": 10,
+        "long_window": 40,
+        "one_order_quantity": 0.01
+    }),
+    (BollingerBandsStrategy, {
+        "window_size": 50,
+        "num_std_dev": 2,
+        "one_order_quantity": 0.01,
+        "buy_count_limit": 5
+    }),
+    (MACDForcusBuyStrategy, {
+        "short_window": 12,
+        "long_window": 26,
+        "signal_window": 9,
+        "one_order_quantity": 0.01,
+        "profit": 1.004,
+        "stop_loss": 0.996
+    }),
+]
+
+
+class TestResume(unittest.TestCase):
+
+    def test_same_as_full_run(self):
+        for cls, param in cases:
+            full = cls(BacktestMarket(price_data))
+            full.reset_all(param, 1e6, 0.1)
+            expected = dict(full.backtest(hold_params=["count"]))
+
+            first = cls(BacktestMarket(price_data[:2000]))
+            first.reset_all(param, 1e6, 0.1)
+            first.backtest(hold_params=["count"])
+            snapshot = pickle.loads(pickle.dumps(first.snapshot()))
+
+            resumed = cls(BacktestMarket(price_data))
+            resumed.restore(snapshot)
+            result = resumed.backtest(resume=True)
+            self.assertEqual(result, expected, cls.__name__)
+            self.assertEqual(resumed.market.hist, full.market.hist)
+            self.assertEqual(resumed.hold_params, full.hold_params)
+            self.assertEqual(resumed.market.ledger.fills.tolist(),
+                             full.market.ledger.fills.tolist())
+            self.assertEqual(sorted(resumed.market.order),
+                             sorted(full.market.order))
+
+    def test_without_history(self):
+        cls, param = cases[2]
+        first = cls(BacktestMarket(price_data[:2000]))
+        first.reset_all(param, 1e6)
+        first.backtest()
+        snapshot = first.snapshot(history=False)
+        self.assertEqual(snapshot["market"]["hist"]["total_value_hist"], [])
+
+        full = cls(BacktestMarket(price_data))
+        full.reset_all(param, 1e6)
+        full.backtest()
+        resumed = cls(BacktestMarket(price_data))
+        resumed.restore(snapshot)
+        self.assertEqual(resumed.backtest(resume=True), full.market.portfolio)
+        self.assertEqual(resumed.market.hist["total_value_hist"],
+                         full.market.hist["total_value_hist"][2000:])
+
+    def test_other_data(self):
+        strategy = MACDStrategy(BacktestMarket(price_data[:100]))
+        strategy.reset_all(cases[2][1], 1e6)
+        strategy.backtest()
+        snapshot = strategy.snapshot()
+        other = MACDStrategy(BacktestMarket(price_data[1:]))
+        with self.assertRaises(ValueError):
+            other.restore(snapshot)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.append(".")
+from src.bitbacktest.strategy import MACDStrategy
+from src.bitbacktest.market import BacktestMarket
+from src.bitbacktest.backtester import GridBacktester, SamplingBacktester
+from src.bitbacktest.data_generater import random_data
+from src.bitbacktest import space
+from src.bitbacktest.results import ResultSink
+
+price_data = random_data(1e7, 0.002, 600, 111)
+
+
+class TestSpace(unittest.TestCase):
+
+    def test_sample_unit(self):
+        for method in ("sobol", "halton", "lhs", "random"):
+            points = space.sample_unit(16, 3, method, random_state=1)
+            self.assertEqual(points.shape, (16, 3))
+            self.assertTrue(np.all((points >= 0) & (points < 1)))
+        # Latin hypercube has one point in each of the n strata of every axis
+        points = space.sample_unit(10, 2, "lhs", random_state=1)
+        for j in range(2):
+            self.assertEqual(sorted((points[:, j] * 10).astype(int)),
+                             list(range(10)))
+        with self.assertRaises(ValueError):
+            space.sample_unit(4, 2, "grid")
+
+    def test_halton_is_even(self):
+        points = space.sample_unit(64, 1, "halton", random_state=3)[:, 0]
+        counts = np.bincount((points * 8).astype(int), minlength=8)
+        self.assertTrue(np.all(counts == 8))
+
+    def test_dimensions(self):
+        from skopt.space import Integer as SkoptInteger
+        target_params = {
+            "a": space.Integer(1, 3),
+            "b": space.Real(0.5, 2.0, prior="log-uniform"),
+            "c": space.Categorical(["x", "y"]),
+            "d": SkoptInteger(10, 20),
+            "e": 7
+        }
+        samples = space.sample_params(target_params, 32, "sobol", 5)
+        self.assertEqual(len(samples), 32)
+        for s in samples:
+            self.assertIn(s["a"], target_params["a"])
+            self.assertIsInstance(s["a"], int)
+            self.assertTrue(0.5 <= s["b"] <= 2.0)
+            self.assertIn(s["c"], ("x", "y"))
+            self.assertTrue(10 <= s["d"] <= 20)
+            self.assertIsInstance(s["d"], int)
+            self.assertEqual(s["e"], 7)
+        self.assertEqual({s["a"] for s in samples}, {1, 2, 3})
+        self.assertEqual(space.sample_params(target_params, 32, "sobol", 5),
+                         samples)
+
+
+class TestSamplingBacktester(unittest.TestCase):
+
+    def test_best_of_samples(self):
+        strategy = MACDStrategy(BacktestMarket(price_data))
+        target_params = {
+            "short_window": space.Integer(4, 30),
+            "long_window": space.Integer(40, 120),
+            "signal_window": 9,
+            "one_order_quantity": 0.01
+        }
+        backtester = SamplingBacktester(strategy)
+        best_value, best_params = backtester.backtest(target_params,
+                                                      1e6,
+                                                      n_samples=8,
+                                                      method="lhs")
+        self.assertEqual(len(backtester.samples), 8)
+        self.assertIn(best_params, backtester.samples)
+        results = GridBacktester(strategy).backtest(backtester.samples, 1e6)
+        self.assertEqual(best_value, max(r["total_value"] for r in results))
+
+    def test_without_skopt(self):
+        strategy = MACDStrategy(BacktestMarket(price_data))
+        target_params = {
+            "short_window": space.Integer(4, 30),
+            "long_window": space.Integer(40, 120),
+            "signal_window": 9,
+            "one_order_quantity": space.Real(0.005, 0.02)
+        }
+        with mock.patch.dict(sys.modules, {"skopt": None,
+                                           "skopt.space": None}):
+            backtester = SamplingBacktester(strategy)
+            best_value, best_params = backtester.backtest(target_params,
+                                                          1e6,
+                                                          n_samples=4)
+        self.assertIn(best_params, backtester.samples)
+        self.assertTrue(0.005 <= best_params["one_order_quantity"] <= 0.02)
+
+    def test_resume_from_sink(self):
+        # Every sample is in the sink the second time
+        strategy = MACDStrategy(BacktestMarket(price_data))
+        target_params = {"short_window": space.Integer(4, 30),
+                         "long_window": 60, "signal_window": 9,
+                         "one_order_quantity": 0.01}
+        with tempfile.TemporaryDirectory() as tmp:
+            expected = SamplingBacktester(strategy).backtest(
+                target_params, 1e6, n_samples=4,
+                sink=ResultSink(tmp, format="npz"))
+            backtester = SamplingBacktester(strategy)
+            best = backtester.backtest(target_params, 1e6, n_samples=4,
+                                       sink=ResultSink(tmp, format="npz"))
+        self.assertEqual(backtester.grid_backtester.test_results, [])
+        self.assertEqual(best, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
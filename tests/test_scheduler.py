@@ -0,0 +1,90 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.append(".")
+from src.bitbacktest.strategy import MovingAverageCrossoverStrategy
+from src.bitbacktest.market import BacktestMarket
+from src.bitbacktest.backtester import GridBacktester
+from src.bitbacktest.scheduler import CostModel, CostAwareScheduler
+from src.bitbacktest.data_generater import random_data
+
+price_data = random_data(1e7, 0.002, 400, 111)
+params = [{"short_window": 5, "long_window": l, "one_order_quantity": 0.01}
+          for l in (20, 200, 40, 100, 10, 60)]
+start_cash = 1e6
+
+
+class TestCostModel(unittest.TestCase):
+
+    def test_prior_orders_by_window(self):
+        model = CostModel()
+        self.assertGreater(model.estimate(params[1]), model.estimate(params[0]))
+
+    def test_fit_from_observations(self):
+        model = CostModel()
+        model.observe({"long_window": 10}, 1.1)
+        model.observe({"long_window": 100}, 10.1)
+        self.assertAlmostEqual(model.estimate({"long_window": 50}), 5.1)
+        self.assertEqual(model.estimate({"long_window": 10}), 1.1)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "cost.json")
+            model.save(path)
+            loaded = CostModel().load(path)
+        self.assertAlmostEqual(loaded.estimate({"long_window": 50}), 5.1)
+
+
+class TestCostAwareScheduler(unittest.TestCase):
+
+    def test_longest_first_assignment(self):
+        scheduler = CostAwareScheduler(2)
+        queues = scheduler._assign(params)
+        self.assertEqual(queues[0][0], 1)  # long_window=200 first
+        self.assertEqual(queues[1][0], 3)  # long_window=100 second
+
+    def test_steals_from_most_remaining_work(self):
+        scheduler = CostAwareScheduler(2)
+        queues = scheduler._assign(params)
+        scheduler.cost_model.observe(params[0], 1.0)
+        scheduler.cost_model.observe(params[1], 3.0)
+        while queues[0]:
+            scheduler._next_task(0, queues)
+        # The running sums give the estimates of the remaining tasks
+        a, b = scheduler.cost_model.coefficients()
+        remaining = scheduler._remaining @ np.array([1.0, a, b])
+        expected = sum(scheduler.cost_model.estimate(params[i])
+                       for i in queues[1])
+        self.assertAlmostEqual(remaining[0], 0.0)
+        self.assertAlmostEqual(remaining[1], expected)
+        first = queues[1][0]
+        self.assertEqual(scheduler._next_task(0, queues), (first, True))
+        while queues[1]:
+            scheduler._next_task(1, queues)
+        self.assertEqual(scheduler._next_task(0, queues), (None, False))
+
+    def test_warm_kernel_for_long_runs(self):
+        # 400 ticks per task, 1e6 ticks per worker pay for the compile
+        scheduler = CostAwareScheduler(2)
+        strategy = MovingAverageCrossoverStrategy(BacktestMarket(price_data))
+        self.assertFalse(scheduler._warm_kernel(strategy, 4000))
+        self.assertTrue(scheduler._warm_kernel(strategy, 5000))
+        self.assertFalse(scheduler._warm_kernel(strategy, 5000, pruner=True))
+
+    def test_parallel_grid_matches_serial(self):
+        strategy = MovingAverageCrossoverStrategy(BacktestMarket(price_data))
+        expected = GridBacktester(strategy).backtest(params, start_cash)
+        backtester = GridBacktester(strategy)
+        results = backtester.backtest(params, start_cash, n_workers=2)
+        self.assertEqual(results, expected)
+        report = backtester.schedule_report
+        self.assertEqual(report["n_tasks"], len(params))
+        self.assertGreater(report["efficiency"], 0)
+        self.assertLessEqual(report["efficiency"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
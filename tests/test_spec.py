@@ -0,0 +1,163 @@
+import ast
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.append(".")
+from src.bitbacktest.market import BacktestMarket
+from src.bitbacktest.spec import make_strategy_class, validate_spec
+from src.bitbacktest import vectorize
+from src.bitbacktest.vectorize import BatchEvaluator
+from src.bitbacktest.data_generater import random_data
+
+price_data = random_data(1e7, 0.002, 5000, 111)
+
+MA_SPEC = {
+    "name": "MACrossSpec",
+    "params": {
+        "short_window": 30,
+        "long_window": 120,
+        "one_order_quantity": 0.01,
+        "profit": 1.003
+    },
+    "indicators": {
+        "short": {"type": "sma", "window": "short_window"},
+        "long": {"type": "sma", "window": "long_window"},
+        "vol": {"type": "std", "window": "long_window"},
+        "band": {"type": "add", "inputs": ["long", "vol"]}
+    },
+    "rules": {
+        "Buy": {"all": [{"cross_above": ["short", "long"]}, {"rising": "long"}]},
+        "Sell": {"cross_below": ["short", "band"]}
+    },
+    "actions": {
+        "Buy": {"side": "Buy", "quantity": "one_order_quantity",
+                "take_profit": "profit"},
+        "Sell": {"side": "Sell", "quantity": 0.005}
+    }
+}
+
+MACD_SPEC = {
+    "name": "MACDSpec",
+    "params": {
+        "short_window": 12,
+        "long_window": 26,
+        "signal_window": 9,
+        "one_order_quantity": 0.01,
+        "profit": 1.002
+    },
+    "indicators": {
+        "short": {"type": "ema", "window": "short_window"},
+        "long": {"type": "ema", "window": "long_window"},
+        "macd": {"type": "sub", "inputs": ["short", "long"]},
+        "signal": {"type": "ema", "input": "macd", "window": "signal_window"}
+    },
+    "rules": {
+        "Buy": {"cross_above": ["macd", "signal"]},
+        "Sell": {"cross_below": ["macd", "signal"]}
+    },
+    "actions": {
+        "Buy": {"side": "Buy", "quantity": "one_order_quantity",
+                "take_profit": "profit"}
+    }
+}
+
+
+def run_streaming(spec, param, prices=price_data):
+    strategy = make_strategy_class(spec)(BacktestMarket(prices))
+    strategy.reset_all(param, 1e6, 0.1)
+    return strategy.backtest()
+
+
+class TestSpec(unittest.TestCase):
+
+    def test_batch_same_as_streaming(self):
+        for spec in (MA_SPEC, MACD_SPEC):
+            evaluator = BatchEvaluator(spec)
+            params = [{}, {"short_window": 8, "profit": 1.001}]
+            results = evaluator.sweep(price_data, params, 1e6, 0.1)
+            for param, result in zip(params, results):
+                expected = run_streaming(spec, param)
+                self.assertEqual(result, expected)
+                self.assertGreater(result["trade_count"], 10)
+
+    def test_batch_without_scipy(self):
+        with mock.patch.object(vectorize, "_lfilter", lambda: None):
+            result = BatchEvaluator(MACD_SPEC).backtest(price_data, {}, 1e6, 0.1)
+        self.assertEqual(result, run_streaming(MACD_SPEC, {}))
+
+    def test_order_num_max(self):
+        with mock.patch.dict(os.environ, {"ORDER_NUM_MAX": "2"}):
+            result = BatchEvaluator(MACD_SPEC).backtest(price_data, {}, 1e6, 0.1)
+            expected = run_streaming(MACD_SPEC, {})
+        self.assertEqual(result, expected)
+
+    def test_signals(self):
+        evaluator = BatchEvaluator(MA_SPEC)
+        codes = evaluator.signals(price_data)
+        strategy = make_strategy_class(MA_SPEC)(BacktestMarket(price_data))
+        strategy.reset_all({}, 1e6)
+        signals = [strategy.generate_signals(p) for p in price_data]
+        self.assertEqual([evaluator.signal_names[c] for c in codes], signals)
+
+    def test_validate(self):
+        self.assertEqual(validate_spec(MA_SPEC)["indicators"]["short"]["input"],
+                         "price")
+        invalid = [
+            ("indicators", {"x": {"type": "wma", "window": 3}}),
+            ("indicators", {"x": {"type": "sma", "input": "y", "window": 3}}),
+            ("indicators", {"x": {"type": "sma", "window": "unknown"}}),
+            ("indicators", {"count": {"type": "sma", "window": 3}}),
+            ("rules", {"Buy": {"cross": ["short", "long"]}}),
+            ("rules", {"Buy": {"above": ["short"]}}),
+            ("actions", {"Buy": {"side": "Long", "quantity": 1}}),
+            ("actions", {"Close": {"side": "Sell", "quantity": 1}}),
+            ("actions", {"Buy": {"side": "Buy", "quantity": "size"}}),
+        ]
+        for key, value in invalid:
+            spec = dict(MA_SPEC, **{key: value})
+            with self.assertRaises(ValueError, msg=str(value)):
+                validate_spec(spec)
+
+    def test_lambda_source(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            spec_file = os.path.join(tmp, "spec.json")
+            out_file = os.path.join(tmp, "_lambda.py")
+            with open(spec_file, "w") as f:
+                json.dump(MA_SPEC, f)
+            subprocess.run([
+                sys.executable, "app/aws_build/build_lambda_src.py", "-d",
+                "src/", "--spec", spec_file, "-o", out_file
+            ], check=True, capture_output=True)
+            with open(out_file) as f:
+                source = f.read()
+        classes = [
+            node.name for node in ast.parse(source).body
+            if isinstance(node, ast.ClassDef)
+        ]
+        self.assertIn("MACrossSpec", classes)
+        self.assertLess(classes.index("Strategy"), classes.index("SpecStrategy"))
+        self.assertLess(classes.index("SpecStrategy"), classes.index("MACrossSpec"))
+
+        # The handler's state round trips through the DynamoDB format every tick
+        module = {}
+        exec(compile(source, "_lambda.py", "exec"), module)
+        strategy = module["MACrossSpec"](BacktestMarket(price_data))
+        strategy.reset_param({k: float(v) for k, v in MA_SPEC["params"].items()})
+        expected = make_strategy_class(MA_SPEC)(BacktestMarket(price_data))
+        expected.reset_param({})
+        for price in price_data[:1000]:
+            state = module["convert_for_dynamodb"](strategy.dump_dynamic())
+            strategy.load_dynamic(module["revert_from_dynamodb"](state))
+            self.assertEqual(strategy.generate_signals(float(price)),
+                             expected.generate_signals(price))
+
+
+if __name__ == "__main__":
+    unittest.main()
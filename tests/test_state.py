@@ -0,0 +1,62 @@
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.append(".")
+from src.bitbacktest.state import StrategyState
+from src.bitbacktest.strategy import MACDStrategy, MACDState
+from src.bitbacktest.market import BacktestMarket
+from src.bitbacktest.data_generater import random_data
+from src.bitbacktest.utils.dynamodb import convert_for_dynamodb, revert_from_dynamodb
+
+
+class SampleState(StrategyState):
+    __slots__ = ("price", "ema")
+
+
+class TestStrategyState(unittest.TestCase):
+
+    def test_attribute_and_item_access(self):
+        state = SampleState(price=1.5)
+        self.assertEqual(state.price, 1.5)
+        self.assertEqual(state["price"], 1.5)
+        state["ema"] = 2.0
+        self.assertEqual(state.ema, 2.0)
+        self.assertEqual(state.count, 0)
+        self.assertIsNone(SampleState().price)
+
+    def test_dict_round_trip_keeps_extra_keys(self):
+        data = {"id": "key", "count": 3, "price": 1.5, "ema": None}
+        state = SampleState.from_dict(data)
+        self.assertEqual(state.to_dict(), {**data})
+        self.assertIn("id", state)
+        self.assertEqual(state["id"], "key")
+
+    def test_dynamodb_round_trip(self):
+        state = SampleState(count=7, price=10000000.25, ema=None, id="key")
+        converted = convert_for_dynamodb(state.to_dict())
+        reverted = SampleState.from_dict(revert_from_dynamodb(converted))
+        self.assertEqual(reverted.to_dict(), state.to_dict())
+
+    def test_macd_uses_state_class(self):
+        data = random_data(1e7, 0.002, 500, 111)
+        strategy = MACDStrategy(BacktestMarket(data))
+        strategy.reset_all({"short_window": 12, "long_window": 26,
+                            "signal_window": 9, "one_order_quantity": 0.01},
+                           1e6, 0.1)
+        self.assertIsInstance(strategy.dynamic, MACDState)
+        strategy.backtest(hold_params=["macd_values"])
+        self.assertEqual(strategy.dynamic.count, len(data))
+        self.assertEqual(len(strategy.hold_params["macd_values"]), len(data))
+
+        dumped = strategy.dump_dynamic()
+        self.assertIsInstance(dumped, dict)
+        strategy.load_dynamic(dumped)
+        self.assertIsInstance(strategy.dynamic, MACDState)
+        self.assertEqual(strategy.dump_dynamic(), dumped)
+        self.assertTrue(np.isfinite(strategy.dynamic.macd_values))
+
+
+if __name__ == "__main__":
+    unittest.main()
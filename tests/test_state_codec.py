@@ -0,0 +1,72 @@
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.append(".")
+from src.bitbacktest.utils.dynamodb import (DynamoDBState, convert_for_dynamodb,
+                                            decode_binary, encode_binary,
+                                            revert_attribute)
+from tests.test_lambda_build import StubTable
+
+STATE = {
+    "price_hist": np.round(np.linspace(1e7, 1.01e7, 500)),
+    "count": 3,
+    "value": 0.1,
+    "ring": [0.0, 1.5, -2.25],
+    "ids": np.arange(4),
+    "nested": {"flag": True, "name": "MA", "empty": None},
+}
+
+
+class TestStateCodec(unittest.TestCase):
+
+    def assertStateEqual(self, a, b):
+        self.assertEqual(a.keys(), b.keys())
+        for k in a:
+            if isinstance(b[k], (list, np.ndarray)):
+                # Lists of numbers are read as arrays, as in the map format
+                self.assertEqual(a[k].dtype, np.asarray(b[k]).dtype)
+                np.testing.assert_array_equal(a[k], b[k])
+            else:
+                self.assertEqual(a[k], b[k])
+
+    def test_round_trip(self):
+        for compression in ("none", "zlib"):
+            encoded = encode_binary(STATE, compression)
+            self.assertStateEqual(decode_binary(encoded), STATE)
+        # Same values as the map format
+        self.assertEqual(revert_attribute(convert_for_dynamodb(0.1)), 0.1)
+        self.assertEqual(revert_attribute(encode_binary([1, 2])).tolist(), [1, 2])
+        with self.assertRaises(ValueError):
+            encode_binary(STATE, "gzip")
+
+    def test_delta_compression(self):
+        raw = encode_binary(STATE["price_hist"], "none")
+        packed = encode_binary(STATE["price_hist"])
+        self.assertEqual(raw[:2], b"rd")
+        self.assertLess(len(packed) * 10, len(raw))
+
+    def test_dirty_keys(self):
+        table = StubTable()
+        state = DynamoDBState(table, "MA")
+        self.assertIsNone(state.load())
+        self.assertEqual(sorted(state.save(STATE)), sorted(STATE))
+        self.assertEqual(state.save(STATE), [])
+        changed = dict(STATE, count=4)
+        del changed["nested"]
+        self.assertEqual(sorted(state.save(changed)), ["count", "nested"])
+        self.assertEqual(table.writes, 2)
+        self.assertEqual(table.items["MA"]["version"], 2)
+        self.assertNotIn("nested", table.items["MA"])
+
+        other = DynamoDBState(table, "MA")
+        self.assertStateEqual(other.load(), changed)
+        other.save(dict(changed, count=5))
+        with self.assertRaises(table.ConditionalCheckFailedException):
+            state.save(dict(changed, count=6))
+        self.assertEqual(state.load()["count"], 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
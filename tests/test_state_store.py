@@ -0,0 +1,208 @@
+import base64
+import os
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+sys.path.append(".")
+from src.bitbacktest.market import BacktestMarket
+from src.bitbacktest.strategy import MACDStrategy, MovingAverageCrossoverStrategy
+from src.bitbacktest.state_store import (DynamoDBStateStore, FileStateStore,
+                                         SQLiteStateStore)
+from src.bitbacktest.utils.dynamodb import convert_for_dynamodb
+from src.bitbacktest.data_generater import random_data
+
+price_data = random_data(1e7, 0.002, 300, 111)
+MACD_PARAM = {"short_window": 12, "long_window": 26, "signal_window": 9,
+              "one_order_quantity": 0.001}
+MA_PARAM = {"short_window": 5, "long_window": 20, "one_order_quantity": 0.001}
+
+
+def strategy_states(n):
+    states = {}
+    for i in range(n):
+        if i % 2:
+            strategy = MACDStrategy(BacktestMarket(price_data))
+            strategy.reset_param(MACD_PARAM)
+        else:
+            strategy = MovingAverageCrossoverStrategy(BacktestMarket(price_data))
+            strategy.reset_param(MA_PARAM)
+        for price in price_data[:50 + i]:
+            strategy.generate_signals(price)
+        states[f"strategy-{i}"] = strategy.dump_dynamic()
+    return states
+
+
+class StubClient:
+    """batch_get_item of StubDynamoDBTable, it processes 3 keys per request"""
+
+    def __init__(self, table):
+        self.table = table
+        self.requests = 0
+        self.keys_per_request = 3
+
+    def batch_get_item(self, RequestItems):
+        self.requests += 1
+        request = RequestItems[self.table.name]
+        keys = request["Keys"]
+        n = self.keys_per_request
+        responses, unprocessed = keys[:n], keys[n:]
+        serializer, deserializer = TypeSerializer(), TypeDeserializer()
+        names = request.get("ExpressionAttributeNames")
+        items = []
+        for key in responses:
+            key = deserializer.deserialize(key["id"])
+            if key in self.table.items:
+                items.append({k: serializer.serialize(v)
+                              for k, v in self.table.items[key].items()
+                              if names is None or k in names.values()})
+        response = {"Responses": {self.table.name: items}}
+        if unprocessed:
+            response["UnprocessedKeys"] = {
+                self.table.name: dict(request, Keys=unprocessed)}
+        return response
+
+
+class StubDynamoDBTable:
+
+    def __init__(self):
+        self.name = "states"
+        self.items = {}
+        self.batches = 0
+        self.meta = SimpleNamespace(client=StubClient(self))
+
+    def batch_writer(self, overwrite_by_pkeys):
+        table = self
+
+        class Writer:
+
+            def __enter__(self):
+                table.batches += 1
+                return self
+
+            def __exit__(self, *exc):
+                pass
+
+            def put_item(self, Item):
+                table.items[Item["id"]] = dict(Item)
+
+        return Writer()
+
+
+class TestStateStore(unittest.TestCase):
+
+    def assertStatesEqual(self, a, b):
+        self.assertEqual(a.keys(), b.keys())
+        for key in a:
+            self.assertEqual(a[key].keys(), b[key].keys())
+            for k in a[key]:
+                np.testing.assert_array_equal(a[key][k], b[key][k])
+
+    def check_store(self, make_store):
+        states = strategy_states(6)
+        with make_store() as store:
+            self.assertEqual(store.load_many(["unknown"]), {})
+            self.assertEqual(sorted(store.save_many(states)), sorted(states))
+            self.assertEqual(store.save_many(states), [])
+        with make_store() as store:
+            loaded = store.load_many(list(states) + ["unknown"])
+            self.assertStatesEqual(loaded, states)
+            # Only the states that changed are written
+            self.assertEqual(store.save_many(loaded), [])
+            loaded["strategy-1"]["prices"] = 1.0
+            self.assertEqual(store.save_many(loaded), ["strategy-1"])
+            self.assertEqual(store.load("strategy-1")["prices"], 1.0)
+            self.assertIsNone(store.load("unknown"))
+
+    def test_sqlite(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.check_store(
+                lambda: SQLiteStateStore(os.path.join(tmp, "states.db")))
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.check_store(lambda: FileStateStore(os.path.join(tmp, "st")))
+
+    def test_dynamodb(self):
+        table = StubDynamoDBTable()
+        table.items["strategy-0"] = {"id": "strategy-0", "version": 5}
+        with mock.patch("time.sleep") as sleep:
+            self.check_store(lambda: DynamoDBStateStore(table))
+        # Every retry of unprocessed keys waits, none of them for long as
+        # each request reads some keys
+        self.assertEqual(sleep.call_count, 2 + 1)
+        self.assertLessEqual(max(c.args[0] for c in sleep.call_args_list),
+                             2 * DynamoDBStateStore.BACKOFF_BASE)
+        # 7 keys are read in 3 requests, as the stub processes 3 keys of each.
+        # The versions of the 6 keys saved without a load are read first.
+        self.assertEqual(table.meta.client.requests, 1 + 2 + 3 + 1 + 1)
+        self.assertEqual(table.batches, 2)
+        # Items are written with the version of the Lambda handler
+        self.assertEqual(table.items["strategy-0"]["version"], 6)
+        self.assertEqual(table.items["strategy-1"]["version"], 2)
+        self.assertEqual(table.items["strategy-2"]["version"], 1)
+
+        # Items of the Lambda handler in the map format are read, arrays
+        # with their base64 chunks as strings
+        def chunks(values):
+            return {"0": base64.b64encode(values.tobytes()).decode("utf-8")}
+
+        table.items["old"] = {"id": "old", "version": 3,
+                              "prices": convert_for_dynamodb(5.0),
+                              "hist": {"LF": chunks(np.array([1.5, 2.5]))},
+                              "ids": {"LI": chunks(np.array([1, 2]))}}
+        store = DynamoDBStateStore(table)
+        state = store.load("old")
+        self.assertEqual(state["prices"], 5.0)
+        np.testing.assert_array_equal(state["hist"], [1.5, 2.5])
+        np.testing.assert_array_equal(state["ids"], [1, 2])
+        # and those written by convert_for_dynamodb(), as Binary
+        table.items["old"]["hist"] = convert_for_dynamodb([0.5, 1.0])
+        np.testing.assert_array_equal(store.load("old")["hist"], [0.5, 1.0])
+
+    def test_dynamodb_throttled(self):
+        table = StubDynamoDBTable()
+        table.meta.client.keys_per_request = 0
+        store = DynamoDBStateStore(table)
+        with mock.patch("time.sleep") as sleep:
+            with self.assertRaises(RuntimeError):
+                store.load("strategy-0")
+        # Exponential backoff with jitter, capped
+        n = DynamoDBStateStore.MAX_RETRIES
+        self.assertEqual(table.meta.client.requests, n + 1)
+        self.assertEqual(sleep.call_count, n)
+        for i, call in enumerate(sleep.call_args_list):
+            self.assertLessEqual(call.args[0], min(
+                DynamoDBStateStore.BACKOFF_MAX,
+                DynamoDBStateStore.BACKOFF_BASE * 2**(i + 1)))
+
+    def test_paper_trading_resume(self):
+        # Saving the state every tick and resuming from the store gives the
+        # same signals as running without a stop
+        strategy = MACDStrategy(BacktestMarket(price_data))
+        strategy.reset_param(MACD_PARAM)
+        expected = [strategy.generate_signals(p) for p in price_data]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "paper.db")
+            signals = []
+            for start in range(0, len(price_data), 100):
+                with SQLiteStateStore(path) as store:
+                    strategy = MACDStrategy(BacktestMarket(price_data))
+                    strategy.reset_param(MACD_PARAM)
+                    state = store.load("MACD")
+                    if state is not None:
+                        strategy.load_dynamic(state)
+                    for price in price_data[start:start + 100]:
+                        signals.append(strategy.generate_signals(price))
+                        store.save("MACD", strategy.dump_dynamic())
+        self.assertEqual(signals, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import pickle
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.append(".")
+from src.bitbacktest.market import BacktestMarket
+from src.bitbacktest.strategy import MACDStrategy
+from src.bitbacktest.develop.strategy_cust import MACDForcusBuyStrategy
+from src.bitbacktest.data_generater import random_data
+from src.bitbacktest.storage import HistoryBuffer, compact_prices
+from src.bitbacktest.checkpoint import Checkpointer
+
+# BTC_JPY like prices, integers
+price_data = np.round(random_data(1e7, 0.002, 3000, 111))
+param = {
+    "short_window": 12,
+    "long_window": 26,
+    "signal_window": 9,
+    "one_order_quantity": 0.01,
+    "profit": 1.002
+}
+
+
+def run(cls, compact, prices=price_data, **kwargs):
+    strategy = cls(BacktestMarket(prices, compact=compact))
+    strategy.reset_all(param, 1e6)
+    strategy.backtest(backend="python", **kwargs)
+    return strategy
+
+
+class TestStorage(unittest.TestCase):
+
+    def test_compact_prices(self):
+        self.assertEqual(compact_prices(price_data).dtype, np.int32)
+        fractional = random_data(1e3, 0.002, 100, 1).astype(np.float32)
+        self.assertEqual(compact_prices(fractional.astype(np.float64)).dtype,
+                         np.float32)
+        with self.assertRaises(ValueError):
+            compact_prices(np.array([1e10]), np.int32)
+        # Fractional prices above 2^23 would be rounded by float32
+        fractional = random_data(1e7, 0.002, 100, 1)
+        with self.assertWarns(UserWarning):
+            self.assertEqual(compact_prices(fractional).dtype, np.float64)
+        with self.assertRaises(ValueError):
+            compact_prices(fractional, np.float32)
+        # Integers beyond int32 fall back to float32
+        self.assertEqual(compact_prices(np.array([1e10, 2.0])).dtype,
+                         np.float32)
+        self.assertEqual(compact_prices(np.array([2**40])).dtype, np.float32)
+
+    def test_history_buffer(self):
+        buffer = HistoryBuffer()
+        values = np.random.RandomState(0).rand(3000) * 1e6
+        for v in values[:2000]:
+            buffer.append(v)
+        buffer.extend(values[2000:])
+        self.assertEqual(len(buffer), 3000)
+        self.assertTrue(np.array_equal(buffer.values, values.astype(np.float32)))
+        self.assertEqual(buffer[-1], np.float32(values[-1]))
+        self.assertEqual(len(pickle.loads(pickle.dumps(buffer))[10:]), 2990)
+
+    def test_same_portfolio(self):
+        # Prices are read as float64, the portfolio is the same
+        for cls in (MACDStrategy, MACDForcusBuyStrategy):
+            a = run(cls, False)
+            b = run(cls, True)
+            self.assertEqual(a.market.portfolio, b.market.portfolio)
+            self.assertEqual(b.market.data.dtype, np.int32)
+            hist = b.market.hist["total_value_hist"]
+            self.assertIsInstance(hist, HistoryBuffer)
+            self.assertEqual(hist.values.dtype, np.float32)
+            self.assertTrue(np.allclose(hist.values,
+                                        a.market.hist["total_value_hist"],
+                                        rtol=1e-6))
+
+    def test_float_prices(self):
+        prices = random_data(1e7, 0.002, 3000, 111)
+        exact = random_data(1e5, 0.002, 3000, 111).astype(
+            np.float32).astype(np.float64)
+        a = run(MACDStrategy, False, exact)
+        b = run(MACDStrategy, True, exact)
+        self.assertEqual(b.market.data.dtype, np.float32)
+        self.assertEqual(a.market.portfolio, b.market.portfolio)
+        # Not rounded to float32
+        a = run(MACDStrategy, False, prices)
+        with self.assertWarns(UserWarning):
+            b = run(MACDStrategy, True, prices)
+        self.assertEqual(b.market.data.dtype, np.float64)
+        self.assertEqual(a.market.portfolio, b.market.portfolio)
+
+    def test_metrics_and_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            a = run(MACDStrategy, True, metrics=["max_drawdown", "sharpe"],
+                    checkpoint=Checkpointer(tmp, every_ticks=1000))
+            b = MACDStrategy(BacktestMarket(price_data, compact=True))
+            b.backtest(resume_from=tmp)
+        hist = b.market.hist["total_value_hist"]
+        self.assertIsInstance(hist, HistoryBuffer)
+        self.assertEqual(hist, a.market.hist["total_value_hist"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import sys
+import unittest
+
+sys.path.append(".")
+from src.bitbacktest.strategy import MACDStrategy
+from src.bitbacktest.market import BacktestMarket
+from src.bitbacktest.backtester import GridBacktester, SuccessiveHalvingBacktester
+from src.bitbacktest.data_generater import random_data
+from skopt.space import Integer
+
+price_data = random_data(1e7, 0.002, 900, 111)
+target_params = {
+    "short_window": Integer(4, 30, name="short_window"),
+    "long_window": Integer(40, 120, name="long_window"),
+    "signal_window": 9,
+    "one_order_quantity": 0.01
+}
+
+
+class TestSuccessiveHalving(unittest.TestCase):
+
+    def test_rungs_and_result(self):
+        strategy = MACDStrategy(BacktestMarket(price_data))
+        backtester = SuccessiveHalvingBacktester(strategy)
+        best_value, best_params = backtester.backtest(
+            target_params, 1e6, n_candidates=9, eta=3, min_resource=100)
+        rungs = backtester.rung_results
+        self.assertEqual([len(r) for r in rungs], [9, 3, 1])
+        self.assertIsInstance(best_params["short_window"], int)
+        self.assertEqual(best_params["signal_window"], 9)
+        # The last rung runs on the full data
+        expected = GridBacktester(strategy).backtest([best_params], 1e6)
+        self.assertEqual(best_value, expected[0]["total_value"])
+        # The original market is untouched
+        self.assertIs(strategy.market.data, price_data)
+
+    def test_candidate_list_and_decimate(self):
+        strategy = MACDStrategy(BacktestMarket(price_data))
+        candidates = [dict(target_params, short_window=s, long_window=60)
+                      for s in (4, 8, 12, 16)]
+        best_value, best_params = SuccessiveHalvingBacktester(strategy).backtest(
+            candidates, 1e6, eta=2, min_resource=200, mode="decimate")
+        self.assertIn(best_params, candidates)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.append(".")
+from src.bitbacktest.strategy import MACDStrategy
+from src.bitbacktest.market import BacktestMarket
+from src.bitbacktest.backtester import GridBacktester
+from src.bitbacktest.sweep import (SweepQueue, SweepWorker, run_worker,
+                                   DistributedGridBacktester)
+from src.bitbacktest.data_generater import random_data
+
+price_data = random_data(1e7, 0.002, 300, 111)
+params = [{"short_window": s, "long_window": l, "signal_window": 9,
+           "one_order_quantity": 0.01} for s in (4, 8, 12) for l in (26, 52)]
+start_cash = 1e6
+
+
+class TestSweepQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "sweep.sqlite")
+        self.strategy = MACDStrategy(BacktestMarket(price_data))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_submit_is_idempotent(self):
+        queue = SweepQueue(self.path)
+        self.assertEqual(queue.submit(params, start_cash), len(params))
+        self.assertEqual(queue.submit(params, start_cash), 0)
+        self.assertEqual(queue.counts()["pending"], len(params))
+
+    def test_workers_in_several_processes(self):
+        queue = SweepQueue(self.path)
+        queue.submit(params, start_cash)
+        processes = [
+            multiprocessing.Process(target=run_worker,
+                                    args=(self.path, self.strategy),
+                                    kwargs={"poll_interval": 0.05})
+            for _ in range(3)
+        ]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join(timeout=60)
+            self.assertEqual(p.exitcode, 0)
+
+        results = queue.results()
+        self.assertEqual([r[0] for r in results], params)
+        expected = GridBacktester(self.strategy).backtest(params, start_cash)
+        for (_, result, _), exp in zip(results, expected):
+            self.assertAlmostEqual(result["total_value"], exp["total_value"])
+
+    def test_expired_lease_is_reclaimed(self):
+        queue = SweepQueue(self.path, lease_seconds=0.1)
+        queue.submit(params[:1], start_cash)
+        task = queue.claim("crashed-worker")
+        self.assertIsNotNone(task)
+        self.assertIsNone(queue.claim("other-worker"))
+
+        time.sleep(0.2)
+        finished = SweepWorker(queue, self.strategy, "other-worker").run(
+            poll_interval=0.01)
+        self.assertEqual(finished, 1)
+        # The crashed worker can no longer write its result
+        self.assertFalse(queue.complete(task["id"], "crashed-worker", {}))
+        self.assertEqual(queue.counts()["done"], 1)
+
+    def test_distributed_grid_backtester(self):
+        backtester = DistributedGridBacktester(self.strategy, self.path)
+        results = backtester.backtest(params, start_cash, n_workers=2,
+                                      poll_interval=0.05)
+        self.assertEqual(len(results), len(params))
+        self.assertEqual(backtester.grid_backtest_params, params)
+
+        # A later sweep on the same queue returns only its own tasks
+        results_again = backtester.backtest(params[2:4], start_cash,
+                                            n_workers=1, poll_interval=0.05)
+        self.assertEqual(backtester.grid_backtest_params, params[2:4])
+        self.assertEqual(results_again, results[2:4])
+
+
+if __name__ == "__main__":
+    unittest.main()